@@ -23,6 +23,12 @@ from mcp.client.session import ClientSession
 from mcp.client.sse import sse_client
 from uuid import uuid4
 
+# Rna目录（observability等公共模块）
+rna_dir = str(Path(__file__).resolve().parent.parent)
+if rna_dir not in sys.path:
+    sys.path.append(rna_dir)
+from observability import inject_headers, init_tracing, span
+
 # 设置详细的日志格式
 logging.basicConfig(
     level=logging.INFO,
@@ -34,6 +40,9 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# 分阶段耗时追踪（RNA_TRACE_EXPORTER 未设置时不记录）
+tracer = init_tracing("rna-frontend")
+
 # MCP服务器URL
 MCP_SERVER_URL = "http://localhost:8000/sse"
 # Agent Core HTTP API
@@ -771,7 +780,8 @@ def call_mcp_tool_sync(tool_name: str, arguments: Dict[str, Any]) -> Any:
     """同步调用MCP工具 - 使用正确的SSE客户端连接方式"""
     try:
         logger.info(f"[MCP调用] 工具: {tool_name}, 参数: {arguments}")
-        result = asyncio.run(call_mcp_tool(tool_name, arguments))
+        with span("frontend.mcp_call", tool=tool_name):
+            result = asyncio.run(call_mcp_tool(tool_name, arguments))
         logger.info(f"[MCP返回] 工具: {tool_name}, 返回类型: {type(result)}")
 
         # 解析MCP结果
@@ -785,7 +795,7 @@ def call_mcp_tool_sync(tool_name: str, arguments: Dict[str, Any]) -> Any:
 
 async def call_mcp_tool(tool_name: str, arguments: Dict[str, Any]) -> Any:
     """异步调用MCP工具"""
-    async with sse_client(MCP_SERVER_URL) as (read, write):
+    async with sse_client(MCP_SERVER_URL, headers=inject_headers()) as (read, write):
         async with ClientSession(read, write) as session:
             await session.initialize()
             result = await session.call_tool(tool_name, arguments)
@@ -1143,9 +1153,12 @@ if 'call_agent_core_sync' not in globals():
             if conversation_id:
                 payload["conversation_id"] = conversation_id
                 
-            resp = requests.post(AGENT_CORE_CHAT_URL, json=payload, timeout=120)
-            resp.raise_for_status()
-            return resp.json()
+            with span("frontend.chat") as chat_span:
+                resp = requests.post(AGENT_CORE_CHAT_URL, json=payload, headers=inject_headers(), timeout=120)
+                resp.raise_for_status()
+                chat_span.add_bytes(sent=len(resp.request.body or b""), received=len(resp.content))
+                with span("deserialize"):
+                    return resp.json()
         except Exception as e:
             logger.error(f"调用 Agent Core 失败: {e}")
             return {"success": False, "error": str(e)}
@@ -10,6 +10,7 @@ import time
 import uuid
 from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 from pydantic import BaseModel
 from typing import Dict, Any, List, Optional
 import os
@@ -20,27 +21,44 @@ import json
 project_root = os.path.dirname(os.path.dirname(
     os.path.dirname(os.path.abspath(__file__))))
 sys.path.insert(0, project_root)
+# Rna目录（observability等公共模块）
+rna_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if rna_dir not in sys.path:
+    sys.path.append(rna_dir)
 from config import get_config
-from rna_agent_graph import process_user_message_with_history
+from log_management import PAYLOAD, setup_logging
+
+# 异步日志：写文件在后台线程中进行，日志文件按大小轮转（Rna/logs/agent_server.log）；
+# 需在导入智能体模块之前配置，导入时的日志同样写入
+setup_logging("agent_server")
+
+from observability import (
+    METRICS_CONTENT_TYPE, REGISTRY, REQUEST_ID_HEADER,
+    continue_trace, init_tracing, observe_http_request, render_metrics, span
+)
+from rna_agent_graph import process_user_message_with_history, rna_agent
 from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, ToolMessage
 
 # 获取配置
 config = get_config()
 
-# 设置详细的日志格式
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s [%(levelname)s] %(name)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(sys.stdout),
-        logging.FileHandler('agent_server.log', encoding='utf-8')
-    ]
-)
 logger = logging.getLogger(__name__)
 
+# 分阶段耗时追踪（RNA_TRACE_EXPORTER 未设置时不记录）
+tracer = init_tracing("rna-agent")
+
 # 全局对话存储 - 在生产环境中应使用Redis或数据库
 conversation_store: Dict[str, List[BaseMessage]] = {}
 
+# 对话存储规模和工具发现状态（抓取 /metrics 时读取）
+REGISTRY.callback("rna_conversations", "对话存储中的对话数", lambda: len(conversation_store))
+REGISTRY.callback("rna_conversation_messages", "对话存储中的消息总数",
+                  lambda: sum(len(messages) for messages in list(conversation_store.values())))
+REGISTRY.callback("rna_mcp_tools", "当前可用的MCP工具数",
+                  lambda: rna_agent.tool_registry.get_stats()["tool_count"])
+REGISTRY.callback("rna_mcp_tool_discovery_failures", "MCP工具发现失败次数",
+                  lambda: rna_agent.tool_registry.get_stats()["failures"], type="counter")
+
 # 创建FastAPI应用
 app = FastAPI(
     title="RNA智能体核心服务",
@@ -116,23 +134,37 @@ def deserialize_message(data: Dict[str, Any]) -> BaseMessage:
 
 @app.middleware("http")
 async def log_requests(request: Request, call_next):
-    """HTTP请求日志中间件"""
+    """HTTP请求日志中间件（沿用前端传入的请求ID，并在响应头中返回）"""
     start_time = time.time()
 
-    # 记录请求开始
-    logger.info(f"🔄 [HTTP请求] {request.method} {request.url}")
-    logger.info(f"📋 [请求头] {dict(request.headers)}")
-
-    # 如果是POST请求，尝试记录body
-    if request.method == "POST":
+    with continue_trace(request.headers) as request_id, \
+            span("http.request", method=request.method, path=request.url.path) as http_span:
+        # 记录请求开始
+        logger.info(f"🔄 [HTTP请求] {request.method} {request.url} (请求ID {request_id})")
+        http_span.add_bytes(received=int(request.headers.get("content-length", 0)))
+
+        # 请求头和请求体只在DEBUG级别抽样记录
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"📋 [请求头] {dict(request.headers)}", extra=PAYLOAD)
+            if request.method == "POST":
+                try:
+                    body = await request.body()
+                    if body:
+                        logger.debug(f"📝 [请求体] {body.decode('utf-8')}", extra=PAYLOAD)
+                except Exception as e:
+                    logger.warning(f"⚠️ [请求体读取失败] {e}")
+
+        # 路由在 call_next 中才完成匹配，请求结束后再按匹配到的路由记录；处理中抛出的异常记为500
+        started = time.perf_counter()
+        status = 500
         try:
-            body = await request.body()
-            if body:
-                logger.info(f"📝 [请求体] {body.decode('utf-8')}")
-        except Exception as e:
-            logger.warning(f"⚠️ [请求体读取失败] {e}")
-
-    response = await call_next(request)
+            response = await call_next(request)
+            status = response.status_code
+        finally:
+            observe_http_request(request.method, request.scope, time.perf_counter() - started, status)
+        response.headers[REQUEST_ID_HEADER] = request_id
+        http_span.set(status_code=response.status_code)
+        http_span.add_bytes(sent=int(response.headers.get("content-length", 0)))
 
     # 记录响应
     process_time = time.time() - start_time
@@ -158,13 +190,20 @@ async def health_check():
         "service": "RNA智能体核心服务",
         "version": "2.0.0",
         "api_keys": api_keys_status,
+        "mcp_tools": rna_agent.tool_registry.get_stats(),
         "timestamp": time.time()
     }
 
-    logger.info(f"✅ [健康检查] 返回结果: {result}")
+    logger.debug(f"✅ [健康检查] 返回结果: {result}")
     return result
 
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus指标"""
+    return PlainTextResponse(render_metrics(), media_type=METRICS_CONTENT_TYPE)
+
+
 @app.post("/chat", response_model=ChatResponse)
 async def chat(request: ChatRequest):
     """处理聊天消息"""
@@ -173,7 +212,7 @@ async def chat(request: ChatRequest):
     try:
         logger.info("="*80)
         logger.info(f"🤖 [聊天开始] 收到用户消息")
-        logger.info(f"📝 [用户消息] {request.message}")
+        logger.debug(f"📝 [用户消息] {request.message}", extra=PAYLOAD)
         logger.info(f"🆔 [对话ID] {request.conversation_id}")
         logger.info(f"📏 [消息长度] {len(request.message)} 字符")
         logger.info("="*80)
@@ -187,7 +226,10 @@ async def chat(request: ChatRequest):
 
         # 调用智能体处理消息
         logger.info("🚀 [Agent调用] 开始调用智能体处理消息...")
-        result = process_user_message_with_history(request.message, history)
+        with span("agent.turn", history_messages=len(history)) as turn_span:
+            # 对话ID同时作为分析会话ID，同一对话的工具调用共享会话中的变量
+            result = process_user_message_with_history(request.message, history, session_id=conversation_id)
+            turn_span.set(success=result["success"], messages=len(result.get("messages", [])))
 
         # 更新对话存储
         if result["success"]:
@@ -199,7 +241,8 @@ async def chat(request: ChatRequest):
         if result["success"]:
             logger.info(f"✅ [处理成功] 智能体处理完成")
             logger.info(f"⏱️ [处理时间] {process_time:.2f}s")
-            logger.info(f"📤 [最终响应] {result['final_response'][:200]}...")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"📤 [最终响应] {result['final_response'][:200]}...", extra=PAYLOAD)
             logger.info(f"💬 [消息数量] {len(result.get('messages', []))}")
 
             # 记录消息类型统计
@@ -210,12 +253,15 @@ async def chat(request: ChatRequest):
                 message_types[msg_type] = message_types.get(msg_type, 0) + 1
             logger.info(f"📊 [消息类型统计] {message_types}")
 
+            with span("serialize", messages=len(messages)):
+                serialized = [serialize_message(msg) for msg in messages]
+
             return ChatResponse(
                 success=True,
                 conversation_id=conversation_id,
                 final_response=result["final_response"],
-                messages=[serialize_message(msg) for msg in result.get("messages", [])],
-                message_count=len(result.get("messages", []))
+                messages=serialized,
+                message_count=len(messages)
             )
         else:
             logger.error(f"❌ [处理失败] 智能体处理出错")
@@ -288,6 +334,7 @@ async def delete_conversation(conversation_id: str):
         raise HTTPException(status_code=404, detail="对话不存在")
     
     del conversation_store[conversation_id]
+    await rna_agent.close_session_async(conversation_id)
     logger.info(f"✅ [删除成功] 对话 {conversation_id} 已删除")
     
     return {"message": f"对话 {conversation_id} 已删除"}
@@ -298,6 +345,8 @@ async def clear_conversation(conversation_id: str):
     logger.info(f"🧹 [清空对话] 对话ID: {conversation_id}")
     
     conversation_store[conversation_id] = []
+    # 清空后重新开始分析，会话中的旧变量一并释放
+    await rna_agent.close_session_async(conversation_id)
     logger.info(f"✅ [清空成功] 对话 {conversation_id} 已清空")
     
     return {"message": f"对话 {conversation_id} 已清空"}
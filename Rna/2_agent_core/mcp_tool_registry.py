@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+RNA分析智能体核心 - MCP工具发现
+首次请求时才从MCP服务器获取工具列表，按TTL缓存并在后台刷新，
+获取失败时按指数退避重试；工具集内容变化时生成新的版本号
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class ToolDiscoveryError(RuntimeError):
+    """在限定时间内无法从MCP服务器获取工具列表"""
+
+
+def tool_set_version(tools: List[Any]) -> str:
+    """根据工具名称、描述和参数定义计算工具集版本号"""
+    items = []
+    for tool in tools:
+        schema = getattr(tool, "args_schema", None)
+        if isinstance(schema, dict):
+            schema_repr = json.dumps(schema, sort_keys=True, default=str)
+        elif hasattr(schema, "model_json_schema"):
+            schema_repr = json.dumps(schema.model_json_schema(), sort_keys=True, default=str)
+        else:
+            schema_repr = repr(schema)
+        items.append((tool.name, getattr(tool, "description", ""), schema_repr))
+    items.sort()
+    return hashlib.blake2b(json.dumps(items).encode("utf-8"), digest_size=6).hexdigest()
+
+
+class MCPToolRegistry:
+    """MCP工具注册表
+
+    - get_tools: 缓存有效时直接返回；缓存过期时返回旧工具集并触发后台刷新；
+      还没有缓存时（首次请求）同步获取，失败按退避重试直到超时
+    - start: 启动后台刷新线程，服务启动后尽早预取，之后每个TTL刷新一次
+    """
+
+    def __init__(self, fetch_tools: Callable[[], Any], ttl: float = 300.0,
+                 retry_base: float = 0.5, retry_max: float = 30.0,
+                 prepare_tool: Optional[Callable[[Any], None]] = None):
+        """
+        Args:
+            fetch_tools: 返回工具列表的协程函数（如 MultiServerMCPClient.get_tools）
+            ttl: 工具列表缓存时间（秒）
+            retry_base: 首次重试等待时间（秒），之后每次翻倍
+            retry_max: 重试等待时间上限（秒）
+            prepare_tool: 每个新获取的工具对象的预处理（如设置 return_direct）
+        """
+        self.fetch_tools = fetch_tools
+        self.ttl = ttl
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.prepare_tool = prepare_tool
+
+        self.tools: Optional[List[Any]] = None
+        self.version: Optional[str] = None
+        self.fetched_at = 0.0
+        self.last_error: Optional[str] = None
+        self.stats = {"fetches": 0, "failures": 0, "version_changes": 0, "stale_serves": 0}
+
+        self._lock = threading.Lock()
+        self._fetch_lock = threading.Lock()
+        self._refreshing = False
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _fetch(self) -> Tuple[List[Any], str]:
+        """获取一次工具列表（在独立事件循环中运行，可从任意线程调用）"""
+        # 同一时间只有一个获取请求发往MCP服务器
+        with self._fetch_lock:
+            start_time = time.time()
+            try:
+                tools = list(asyncio.run(self.fetch_tools()))
+            except Exception as e:
+                with self._lock:
+                    self.stats["failures"] += 1
+                    self.last_error = str(e)
+                raise
+
+            if self.prepare_tool is not None:
+                for tool in tools:
+                    self.prepare_tool(tool)
+            version = tool_set_version(tools)
+
+            with self._lock:
+                self.stats["fetches"] += 1
+                self.last_error = None
+                if version != self.version:
+                    if self.version is not None:
+                        self.stats["version_changes"] += 1
+                    logger.info(f"🛠️ [工具发现] 工具集版本 {self.version} → {version}，"
+                                f"共 {len(tools)} 个工具: {[t.name for t in tools]}")
+                    self.tools = tools
+                    self.version = version
+                self.fetched_at = time.time()
+            logger.info(f"✅ [工具发现] 获取工具列表耗时 {time.time() - start_time:.2f}s")
+            return self.tools, self.version
+
+    def _fetch_with_retry(self, timeout: Optional[float]) -> Tuple[List[Any], str]:
+        deadline = time.time() + timeout if timeout is not None else None
+        attempt = 0
+        while True:
+            try:
+                return self._fetch()
+            except Exception as e:
+                delay = min(self.retry_base * 2 ** attempt, self.retry_max)
+                attempt += 1
+                if deadline is not None and time.time() + delay > deadline:
+                    raise ToolDiscoveryError(f"无法从MCP服务器获取工具列表: {e}") from e
+                if self._stop_event.is_set():
+                    raise ToolDiscoveryError("工具注册表已停止") from e
+                logger.warning(f"⚠️ [工具发现] 第 {attempt} 次获取失败: {e}，{delay:.1f}s 后重试")
+                self._stop_event.wait(delay)
+
+    def get_tools(self, timeout: Optional[float] = 30.0) -> Tuple[List[Any], str]:
+        """返回 (工具列表, 版本号)"""
+        with self._lock:
+            tools, version, age = self.tools, self.version, time.time() - self.fetched_at
+        if tools is not None:
+            if age > self.ttl:
+                with self._lock:
+                    self.stats["stale_serves"] += 1
+                self.refresh_in_background()
+            return tools, version
+        return self._fetch_with_retry(timeout)
+
+    def refresh_in_background(self):
+        """在后台线程中刷新工具列表（已有刷新进行中时不重复发起）"""
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def refresh():
+            try:
+                self._fetch_with_retry(self.ttl)
+            except ToolDiscoveryError as e:
+                logger.warning(f"⚠️ [工具发现] 后台刷新失败，继续使用旧工具集: {e}")
+            finally:
+                with self._lock:
+                    self._refreshing = False
+
+        threading.Thread(target=refresh, name="mcp-tools-refresh", daemon=True).start()
+
+    def invalidate(self):
+        """标记缓存过期，下次获取时触发刷新"""
+        with self._lock:
+            self.fetched_at = 0.0
+
+    def start(self):
+        """启动后台预取和定期刷新（不阻塞调用方）"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="mcp-tools-registry", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            try:
+                # 不设超时：MCP服务器晚于智能体启动时持续退避重试
+                self._fetch_with_retry(None)
+            except ToolDiscoveryError:
+                return
+            if self._stop_event.wait(self.ttl):
+                return
+
+    def stop(self):
+        self._stop_event.set()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """注册表统计"""
+        with self._lock:
+            return {
+                "version": self.version,
+                "tool_count": len(self.tools) if self.tools is not None else 0,
+                "age_seconds": round(time.time() - self.fetched_at, 1) if self.tools is not None else None,
+                "ttl": self.ttl,
+                "last_error": self.last_error,
+                **self.stats
+            }
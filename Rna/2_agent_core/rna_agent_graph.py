@@ -6,10 +6,13 @@ RNA分析智能体核心 - LangGraph实现
 
 import logging
 import os
+import sys
 import asyncio
+import contextvars
 import json
 import time
-from typing import Dict, Any, List, Annotated, TypedDict, Literal
+import threading
+from typing import Dict, Any, List, Annotated, Optional, TypedDict, Literal
 from datetime import datetime
 
 # LangChain和LangGraph相关导入
@@ -25,19 +28,66 @@ from pydantic import SecretStr
 # MCP Adapters 导入
 from langchain_mcp_adapters.client import MultiServerMCPClient
 
-# 设置详细的日志格式
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s [%(levelname)s] %(name)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(),
-        logging.FileHandler('rna_agent_graph.log', encoding='utf-8')
-    ]
+from mcp_tool_registry import MCPToolRegistry, ToolDiscoveryError
+
+# Rna目录（observability等公共模块）
+rna_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if rna_dir not in sys.path:
+    sys.path.append(rna_dir)
+from log_management import PAYLOAD, setup_logging
+from observability import (
+    LLM_CALLS, LLM_LATENCY, LLM_TOKENS, TOOL_CALLS, TOOL_LATENCY, inject_headers, span
 )
+
+# 作为服务的一部分导入时由 agent_server 配置日志，单独运行时使用自己的日志文件
+if __name__ == "__main__":
+    setup_logging("rna_agent_graph")
 logger = logging.getLogger(__name__)
 
 # MCP服务器配置
 MCP_SERVER_URL = "http://localhost:8000/sse"
+# 工具列表缓存时间（秒），过期后在后台刷新
+MCP_TOOLS_TTL = float(os.getenv("MCP_TOOLS_TTL", "300"))
+# 首个请求等待工具发现的最长时间（秒）
+MCP_TOOLS_TIMEOUT = float(os.getenv("MCP_TOOLS_TIMEOUT", "30"))
+
+# 当前对话对应的分析会话ID，工具调用时自动填入带 session_id 参数的MCP工具
+_session_id: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("rna_session_id", default=None)
+
+
+
+def _traced_http_client(headers=None, timeout=None, auth=None):
+    """MCP SSE连接使用的httpx客户端：每个请求带上当前请求ID和span，后端据此串联追踪"""
+    import httpx
+
+    async def add_trace_headers(request):
+        inject_headers(request.headers)
+
+    return httpx.AsyncClient(headers=headers, timeout=timeout, auth=auth, follow_redirects=True,
+                             event_hooks={"request": [add_trace_headers]})
+
+
+def _mcp_connection() -> Dict[str, Any]:
+    connection: Dict[str, Any] = {"url": MCP_SERVER_URL, "transport": "sse"}
+    try:
+        # 较新版本的 langchain-mcp-adapters 才支持自定义httpx客户端
+        from langchain_mcp_adapters.sessions import SSEConnection
+        if "httpx_client_factory" in getattr(SSEConnection, "__annotations__", {}):
+            connection["httpx_client_factory"] = _traced_http_client
+    except ImportError:
+        pass
+    return connection
+
+
+def _tool_params(tool) -> List[str]:
+    """工具的参数名列表（MCP工具的 args_schema 为JSON Schema字典）"""
+    schema = getattr(tool, "args_schema", None)
+    if isinstance(schema, dict):
+        return list(schema.get("properties", {}))
+    if hasattr(schema, "model_fields"):
+        return list(schema.model_fields)
+    return []
+
 
 # 强化的系统提示
 SYSTEM_PROMPT = """你是一个专业的RNA单细胞分析智能体。
@@ -59,6 +109,15 @@ SYSTEM_PROMPT = """你是一个专业的RNA单细胞分析智能体。
 - mcp_Rnagent-MCP_marker_genes_analysis: 标记基因分析
 - mcp_Rnagent-MCP_generate_analysis_report: 生成分析报告
 - mcp_Rnagent-MCP_complete_analysis_pipeline: 完整分析流程
+- mcp_Rnagent-MCP_plot_embedding: 快速绘制UMAP/PCA嵌入图（按聚类或QC指标着色）
+- mcp_Rnagent-MCP_open_analysis_session: 为当前对话创建独立的分析会话
+- mcp_Rnagent-MCP_close_analysis_session: 关闭当前对话的分析会话并释放资源
+
+分析会话：
+- 每个对话有自己独立的分析会话，变量和数据在同一对话的多次工具调用之间保留
+- session_id 由系统按对话自动填入，调用工具时不需要也不要自己指定
+- 会话在首次调用工具时自动创建，一般无需调用 open_analysis_session；
+  只有用户要求重新开始分析时才调用 close_analysis_session
 
 记住：绝不直接回答计算结果，必须通过工具执行！"""
 
@@ -73,40 +132,77 @@ class RNAAnalysisAgent:
 
     def __init__(self):
         logger.info("🧬 [Agent初始化] 开始初始化RNA分析智能体")
-        self.mcp_client = None
-        self.tools = None
-        self.graph = None
-        # 异步初始化
-        asyncio.run(self._async_init())
-        logger.info("✅ [Agent初始化] RNA分析智能体初始化完成")
-
-    async def _async_init(self):
-        """异步初始化MCP客户端和工具"""
-        logger.info("🔌 [MCP初始化] 开始初始化MCP客户端")
-        
-        # 创建MCP客户端
+        # 创建MCP客户端（不建立连接）
         self.mcp_client = MultiServerMCPClient({
-            "rna_analysis": {
-                "url": MCP_SERVER_URL,
-                "transport": "sse",
-            }
+            "rna_analysis": _mcp_connection()
         })
-        
-        # 获取工具列表
-        logger.info("🛠️ [工具获取] 从MCP服务器动态获取工具列表")
-        tools = await self.mcp_client.get_tools()
-        
+        # 工具列表在后台预取，启动不等待MCP服务器
+        self.tool_registry = MCPToolRegistry(
+            self.mcp_client.get_tools,
+            ttl=MCP_TOOLS_TTL,
+            prepare_tool=self._prepare_tool
+        )
+        # 已编译的工作流，按工具集版本缓存
+        self._graphs: Dict[str, Any] = {}
+        self._graphs_lock = threading.Lock()
+        self.tool_registry.start()
+        logger.info("✅ [Agent初始化] RNA分析智能体初始化完成，工具列表在后台获取")
+
+    @staticmethod
+    def _prepare_tool(tool):
         # 设置 return_direct=True 避免 LangGraph 无限循环
-        for tool in tools:
-            tool.return_direct = True
-            
-        self.tools = tools
-        logger.info(f"✅ [工具加载] 成功加载 {len(self.tools)} 个工具: {[tool.name for tool in self.tools]}")
-        
-        # 创建图
-        self.graph = self._create_graph()
+        tool.return_direct = True
+
+        # 每次工具调用记录一个span
+        call_tool = tool.coroutine
+        if call_tool is None:
+            return
+        takes_session = "session_id" in _tool_params(tool)
+
+        async def traced_call(*args, **kwargs):
+            # 工具按对话在各自的会话中执行，模型给出的 session_id 一律以当前对话为准
+            session_id = _session_id.get()
+            if takes_session and session_id:
+                kwargs["session_id"] = session_id
+            status = "error"
+            with span("tool.dispatch", tool=tool.name) as tool_span, TOOL_LATENCY.time(tool=tool.name):
+                try:
+                    result = await call_tool(*args, **kwargs)
+                    status = "ok"
+                finally:
+                    TOOL_CALLS.inc(tool=tool.name, status=status)
+                if tool_span.recording:
+                    content = result[0] if isinstance(result, tuple) else result
+                    tool_span.add_bytes(received=len(str(content)))
+                return result
+
+        tool.coroutine = traced_call
+
+    async def close_session_async(self, session_id: str) -> bool:
+        """关闭对话对应的分析会话（对话删除或清空时调用）"""
+        try:
+            tools, _ = await asyncio.to_thread(self.tool_registry.get_tools, MCP_TOOLS_TIMEOUT)
+            close_tool = next((t for t in tools if t.name.endswith("close_analysis_session")), None)
+            if close_tool is None:
+                return False
+            await close_tool.ainvoke({"session_id": session_id})
+            logger.info(f"🧩 [会话关闭] 对话 {session_id} 的分析会话已关闭")
+            return True
+        except Exception as e:
+            logger.warning(f"⚠️ [会话关闭] 关闭对话 {session_id} 的分析会话失败: {e}")
+            return False
 
-    def _create_graph(self):
+    def _get_graph(self, tools: List[Any], version: str):
+        """获取工具集版本对应的工作流，同一版本只编译一次"""
+        with self._graphs_lock:
+            graph = self._graphs.get(version)
+            if graph is None:
+                graph = self._create_graph(tools)
+                # 只保留当前版本，旧版本的工具已不可用
+                self._graphs = {version: graph}
+            return graph
+
+    def _create_graph(self, tools: List[Any]):
         """创建LangGraph工作流"""
         logger.info("🔧 [图构建] 开始创建LangGraph工作流")
 
@@ -114,8 +210,8 @@ class RNAAnalysisAgent:
         workflow = StateGraph(AgentState)
 
         # 添加节点
-        workflow.add_node("llm", self._call_model)
-        workflow.add_node("tools", ToolNode(self.tools))
+        workflow.add_node("llm", lambda state: self._call_model(state, tools))
+        workflow.add_node("tools", ToolNode(tools))
 
         # 设置边
         workflow.add_edge(START, "llm")
@@ -129,7 +225,7 @@ class RNAAnalysisAgent:
         logger.info("✅ [图构建] LangGraph工作流创建完成")
         return workflow.compile()
 
-    def _call_model(self, state: AgentState):
+    def _call_model(self, state: AgentState, tools: List[Any]):
         """调用语言模型"""
         start_time = time.time()
         messages = state["messages"]
@@ -144,12 +240,15 @@ class RNAAnalysisAgent:
             messages = [SystemMessage(content=SYSTEM_PROMPT)] + messages
             logger.info("📋 [系统提示] 已添加强化的系统提示")
 
-        # 记录输入消息详情
-        for i, msg in enumerate(messages):
-            msg_type = type(msg).__name__
-            msg_content = getattr(msg, 'content', '')[:100] if hasattr(
-                msg, 'content') else str(msg)[:100]
-            logger.info(f"   [{i+1}] {msg_type}: {msg_content}...")
+        # 记录输入消息详情（与历史长度成正比，只在DEBUG级别汇总为一条抽样记录）
+        if logger.isEnabledFor(logging.DEBUG):
+            details = []
+            for i, msg in enumerate(messages):
+                msg_type = type(msg).__name__
+                msg_content = getattr(msg, 'content', '')[:100] if hasattr(
+                    msg, 'content') else str(msg)[:100]
+                details.append(f"   [{i+1}] {msg_type}: {msg_content}...")
+            logger.debug("📨 [输入消息详情]\n" + "\n".join(details), extra=PAYLOAD)
 
         # 检查消息数量，如果超过阈值则进行截断或摘要
         if len(messages) > 100:  # 设置最大消息数量阈值
@@ -165,24 +264,37 @@ class RNAAnalysisAgent:
             llm = self._get_llm_client()
 
             # 绑定工具
-            llm_with_tools = llm.bind_tools(self.tools)
+            llm_with_tools = llm.bind_tools(tools)
 
             logger.info("🚀 [LLM调用] 发送请求到语言模型...")
 
             # 调用模型
-            response = llm_with_tools.invoke(messages)
+            model = getattr(llm, "model_name", None) or getattr(llm, "model", "")
+            status = "error"
+            with span("llm.call", model=model, messages=len(messages)) as llm_span, LLM_LATENCY.time(model=model):
+                try:
+                    response = llm_with_tools.invoke(messages)
+                    status = "ok"
+                finally:
+                    LLM_CALLS.inc(model=model, status=status)
+                usage = getattr(response, "usage_metadata", None) or {}
+                llm_span.set(input_tokens=usage.get("input_tokens"), output_tokens=usage.get("output_tokens"),
+                             tool_calls=len(getattr(response, "tool_calls", None) or []))
+            LLM_TOKENS.inc(usage.get("input_tokens") or 0, model=model, direction="input")
+            LLM_TOKENS.inc(usage.get("output_tokens") or 0, model=model, direction="output")
 
             call_time = time.time() - start_time
 
             logger.info(f"✅ [LLM响应] 模型调用完成，耗时: {call_time:.2f}s")
-            logger.info(f"📝 [响应内容] {response.content[:200]}...")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"📝 [响应内容] {response.content[:200]}...", extra=PAYLOAD)
 
             # 检查是否有工具调用 - 修复新版LangChain兼容性
             if isinstance(response, AIMessage) and hasattr(response, 'tool_calls') and response.tool_calls:
                 logger.info(f"🔧 [工具调用] 模型请求调用 {len(response.tool_calls)} 个工具:")
                 for i, tool_call in enumerate(response.tool_calls):
                     logger.info(f"   [{i+1}] 工具: {tool_call['name']}")
-                    logger.info(f"       参数: {tool_call.get('args', {})}")
+                    logger.debug(f"       参数: {tool_call.get('args', {})}", extra=PAYLOAD)
                 
                 # 检查是否有Python REPL工具调用，如果有则立即添加占位符ToolMessage
                 messages_to_return = [response]
@@ -287,13 +399,20 @@ class RNAAnalysisAgent:
             raise ValueError(
                 "No valid API key found. Please set a real OPENAI_API_KEY or DEEPSEEK_API_KEY in env.template")
 
-    async def process_message_async(self, message: str, history: List[BaseMessage] = None) -> Dict[str, Any]:
-        """异步处理用户消息，支持历史消息"""
+    async def process_message_async(self, message: str, history: List[BaseMessage] = None,
+                                    session_id: Optional[str] = None) -> Dict[str, Any]:
+        """异步处理用户消息，支持历史消息
+
+        session_id 为对话对应的分析会话，本次处理中的工具调用都在该会话中执行
+        （由 process_message 在独立事件循环中运行，设置的会话ID不会泄漏到其他请求）
+        """
         start_time = time.time()
+        _session_id.set(session_id)
 
         try:
             logger.info("🎯 [消息处理] 开始处理用户消息")
-            logger.info(f"📝 [输入消息] {message}")
+            logger.info(f"📏 [输入消息] {len(message)} 字符")
+            logger.debug(f"📝 [输入消息] {message}", extra=PAYLOAD)
             
             # 准备消息列表
             messages = []
@@ -314,9 +433,16 @@ class RNAAnalysisAgent:
             logger.info("🚀 [图执行] 开始执行LangGraph工作流")
             logger.info(f"📊 [初始状态] 总消息数: {len(messages)}")
 
+            # 缓存命中时立即返回；首个请求在线程中等待工具发现，不阻塞事件循环
+            with span("mcp.discover") as discover_span:
+                tools, version = await asyncio.to_thread(self.tool_registry.get_tools, MCP_TOOLS_TIMEOUT)
+                discover_span.set(version=version, tools=len(tools))
+            graph = self._get_graph(tools, version)
+
             # 运行图 - 使用异步调用，设置递归限制
             config = {"recursion_limit": 15}
-            result = await self.graph.ainvoke(initial_state, config=config)
+            with span("graph.invoke", messages=len(messages)):
+                result = await graph.ainvoke(initial_state, config=config)
 
             process_time = time.time() - start_time
 
@@ -335,7 +461,8 @@ class RNAAnalysisAgent:
 
             logger.info(f"✅ [处理完成] 消息处理成功，耗时: {process_time:.2f}s")
             logger.info(f"📊 [最终状态] 总消息数: {len(final_messages)}")
-            logger.info(f"📤 [最终响应] {final_response[:200]}...")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"📤 [最终响应] {final_response[:200]}...", extra=PAYLOAD)
 
             return {
                 "success": True,
@@ -344,6 +471,16 @@ class RNAAnalysisAgent:
                 "process_time": process_time
             }
 
+        except ToolDiscoveryError as e:
+            process_time = time.time() - start_time
+            logger.error(f"❌ [工具发现] MCP服务器暂不可用，耗时: {process_time:.2f}s: {e}")
+            return {
+                "success": False,
+                "error": f"分析服务暂不可用，请稍后重试: {str(e)}",
+                "messages": [],
+                "process_time": process_time
+            }
+
         except Exception as e:
             process_time = time.time() - start_time
             logger.error(f"❌ [处理错误] 消息处理失败，耗时: {process_time:.2f}s")
@@ -359,19 +496,22 @@ class RNAAnalysisAgent:
                 "process_time": process_time
             }
 
-    def process_message(self, message: str, history: List[BaseMessage] = None) -> Dict[str, Any]:
+    def process_message(self, message: str, history: List[BaseMessage] = None,
+                        session_id: Optional[str] = None) -> Dict[str, Any]:
         """同步包装的消息处理函数"""
         # 检查是否已经在事件循环中
         try:
             loop = asyncio.get_running_loop()
             # 如果已经在事件循环中，创建新任务
             import concurrent.futures
+            # 复制上下文，新线程中的span仍属于当前请求
+            context = contextvars.copy_context()
             with concurrent.futures.ThreadPoolExecutor() as executor:
-                future = executor.submit(asyncio.run, self.process_message_async(message, history))
+                future = executor.submit(context.run, asyncio.run, self.process_message_async(message, history, session_id))
                 return future.result()
         except RuntimeError:
             # 没有运行的事件循环，可以直接使用asyncio.run
-            return asyncio.run(self.process_message_async(message, history))
+            return asyncio.run(self.process_message_async(message, history, session_id))
 
 
 # 创建全局智能体实例
@@ -381,17 +521,18 @@ rna_agent = RNAAnalysisAgent()
 
 def process_user_message(message: str) -> Dict[str, Any]:
     """处理用户消息的主入口函数"""
-    logger.info(f"📨 [入口函数] 收到用户消息: {message}")
+    logger.info(f"📨 [入口函数] 收到用户消息 ({len(message)} 字符)")
     result = rna_agent.process_message(message)
     logger.info(f"📤 [入口函数] 返回处理结果: success={result['success']}")
     return result
 
-def process_user_message_with_history(message: str, history: List[BaseMessage] = None) -> Dict[str, Any]:
-    """处理用户消息的主入口函数，支持历史记忆"""
-    logger.info(f"📨 [入口函数] 收到用户消息: {message}")
+def process_user_message_with_history(message: str, history: List[BaseMessage] = None,
+                                      session_id: Optional[str] = None) -> Dict[str, Any]:
+    """处理用户消息的主入口函数，支持历史记忆；session_id 为对话对应的分析会话"""
+    logger.info(f"📨 [入口函数] 收到用户消息 ({len(message)} 字符)")
     logger.info(f"📚 [入口函数] 历史消息数量: {len(history) if history else 0}")
     
-    result = rna_agent.process_message(message, history)
+    result = rna_agent.process_message(message, history, session_id)
     logger.info(f"📤 [入口函数] 返回处理结果: success={result['success']}")
     logger.info(f"💬 [入口函数] 最终消息数量: {len(result.get('messages', []))}")
     
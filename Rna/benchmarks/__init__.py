@@ -0,0 +1,9 @@
+"""
+RnAgent基准测试
+pipeline_benchmark: PBMC3K分析流程逐阶段计时（python -m benchmarks）
+synthetic_data: 以PBMC3K为模板生成任意规模的合成数据集（python -m benchmarks.synthetic_data）
+"""
+
+from .pipeline_benchmark import compare_results, latest_result, run_benchmark
+
+__all__ = ['compare_results', 'latest_result', 'run_benchmark']
@@ -0,0 +1,7 @@
+"""运行分析流程基准测试：python -m benchmarks --help"""
+
+import sys
+
+from .pipeline_benchmark import main
+
+sys.exit(main())
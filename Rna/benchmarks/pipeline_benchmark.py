@@ -0,0 +1,498 @@
+#!/usr/bin/env python3
+"""
+PBMC3K分析流程基准测试
+按 unified_server 中的真实分析流程逐阶段计时：加载、质控、过滤、标准化、高变基因、缩放、
+PCA、近邻图、UMAP、Leiden聚类、差异基因和绘图，记录每个阶段的墙钟时间、CPU时间和峰值内存（RSS）
+
+数据集：pbmc3k（原始数据），以及按细胞数放大的合成数据（如 10k、100k、500k），
+合成数据由 synthetic_data 以PBMC3K为模板生成10x文件并缓存在 benchmarks/data 下（生成时间不计入流程），
+加载阶段与pbmc3k一样计入真实的10x解析时间；
+每个数据集在独立的子进程中运行，峰值内存互不影响，单个数据集内存不足也不会中断其余测试
+
+完全离线运行，只使用CPU；结果写入JSON，可与保存的基线结果对比：
+
+    cd Rna
+    python -m benchmarks --datasets pbmc3k,10k,100k,500k
+    python -m benchmarks --datasets pbmc3k --baseline benchmarks/results/baseline.json
+    python -m benchmarks --compare benchmarks/results/new.json --baseline benchmarks/results/baseline.json
+"""
+
+import os
+import io
+import sys
+import json
+import time
+import socket
+import argparse
+import platform
+import resource
+import tempfile
+import threading
+import traceback
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+try:
+    import psutil
+except ImportError:  # 没有psutil时只记录进程级峰值内存
+    psutil = None
+
+PROJECT_ROOT = Path(__file__).resolve().parents[2]
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+SYNTHETIC_DIR = Path(__file__).resolve().parent / "data"
+
+STAGES = (
+    "load", "qc", "filter", "normalize", "hvg", "scale", "pca",
+    "neighbors", "umap", "leiden", "rank_genes_groups", "plot"
+)
+# 可通过 --skip 跳过的阶段（后续阶段不依赖其结果）
+OPTIONAL_STAGES = ("scale", "umap", "rank_genes_groups", "plot")
+
+# 超过基线 10% 且绝对差值超过 0.05s 视为变慢（小于该值的差异主要是计时噪声）
+DEFAULT_REGRESSION_THRESHOLD = 0.10
+DEFAULT_MIN_DELTA_SECONDS = 0.05
+
+
+def default_data_path() -> str:
+    """PBMC3K数据目录（项目根目录 config.get_data_path，相对路径按项目根目录解析）"""
+    if str(PROJECT_ROOT) not in sys.path:
+        sys.path.insert(0, str(PROJECT_ROOT))
+    from config import get_data_path
+    path = Path(get_data_path())
+    return str(path if path.is_absolute() else PROJECT_ROOT / path)
+
+
+def parse_dataset(name: str) -> Tuple[str, Optional[int]]:
+    """"pbmc3k" -> ("pbmc3k", None)；"10k" / "1.5m" / "25000" -> ("synthetic", 细胞数)"""
+    name = name.strip().lower()
+    if name == "pbmc3k":
+        return "pbmc3k", None
+    multiplier = 1
+    if name.endswith("k"):
+        name, multiplier = name[:-1], 1000
+    elif name.endswith("m"):
+        name, multiplier = name[:-1], 1000000
+    try:
+        n_cells = int(float(name) * multiplier)
+    except ValueError:
+        raise ValueError(f"无法识别的数据集: {name}（可用 pbmc3k 或细胞数，如 10k、100k、500k）")
+    if n_cells <= 0:
+        raise ValueError(f"细胞数必须大于0: {name}")
+    return "synthetic", n_cells
+
+
+# ===== 计量 =====
+
+def _rss_bytes() -> int:
+    if psutil is not None:
+        return psutil.Process(os.getpid()).memory_info().rss
+    return _max_rss_bytes()
+
+
+def _max_rss_bytes() -> int:
+    """进程启动以来的峰值RSS（Linux上单位为KB，macOS上为字节）"""
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss if platform.system() == "Darwin" else max_rss * 1024
+
+
+class _PeakRSSSampler:
+    """在后台线程中按固定间隔采样RSS，得到单个阶段内的峰值"""
+
+    def __init__(self, interval: float = 0.02):
+        self.interval = interval
+        self.peak = 0
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def __enter__(self) -> "_PeakRSSSampler":
+        self.peak = _rss_bytes()
+        if psutil is not None:
+            self._thread = threading.Thread(target=self._run, name="bench-rss-sampler", daemon=True)
+            self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            self.peak = max(self.peak, _rss_bytes())
+
+    def __exit__(self, *exc_info):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.peak = max(self.peak, _rss_bytes())
+
+
+def _mb(value: float) -> float:
+    return round(value / (1024 * 1024), 1)
+
+
+class StageTimer:
+    """记录每个阶段的墙钟时间、CPU时间（含BLAS/numba线程）和峰值RSS"""
+
+    def __init__(self):
+        self.stages: List[Dict[str, Any]] = []
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        record: Dict[str, Any] = {"stage": name, "status": "ok"}
+        rss_before = _rss_bytes()
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        with _PeakRSSSampler() as sampler:
+            try:
+                yield
+            except Exception as e:
+                record["status"] = "error"
+                record["error"] = f"{type(e).__name__}: {e}"
+                raise
+            finally:
+                record["wall_s"] = round(time.perf_counter() - wall_start, 4)
+                record["cpu_s"] = round(time.process_time() - cpu_start, 4)
+                self.stages.append(record)
+        record["peak_rss_mb"] = _mb(sampler.peak)
+        record["rss_delta_mb"] = _mb(_rss_bytes() - rss_before)
+        record["process_peak_rss_mb"] = _mb(_max_rss_bytes())
+
+
+# ===== 数据集 =====
+
+def load_pbmc3k(data_path: str):
+    import scanpy as sc
+
+    # cache=False：每次都计入真实的解析时间
+    adata = sc.read_10x_mtx(data_path, var_names='gene_symbols', cache=False)
+    adata.var_names_make_unique()
+    return adata
+
+
+def prepare_synthetic(template: str, n_cells: int, seed: int = 0,
+                      synthetic_dir: Optional[str] = None) -> Tuple[str, float]:
+    """以 template 为模板生成（或复用已缓存的）合成10x数据集，返回 (数据目录, 生成耗时秒数)"""
+    # 延迟导入：python -m benchmarks.synthetic_data 时不重复导入该模块
+    from .synthetic_data import generate_dataset, is_complete
+
+    out_dir = Path(synthetic_dir or SYNTHETIC_DIR) / f"synthetic-{n_cells}-seed{seed}"
+    if is_complete(str(out_dir), {"n_cells": n_cells, "seed": seed, "template": str(template)}):
+        return str(out_dir), 0.0
+    started = time.perf_counter()
+    generate_dataset(str(out_dir), n_cells, template=template, seed=seed)
+    return str(out_dir), round(time.perf_counter() - started, 2)
+
+
+# ===== 流程 =====
+
+def run_pipeline(load: Callable[[], Any], timer: StageTimer, skip: Tuple[str, ...] = ()) -> Dict[str, Any]:
+    """按 unified_server 中的分析参数依次执行各阶段；某阶段失败时记录错误并停止后续阶段"""
+    import numpy as np
+    import scanpy as sc
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    info: Dict[str, Any] = {}
+
+    def should_run(stage: str) -> bool:
+        if stage in skip:
+            timer.stages.append({"stage": stage, "status": "skipped"})
+            return False
+        return True
+
+    with timer.stage("load"):
+        adata = load()
+    info["n_obs"], info["n_vars"] = int(adata.n_obs), int(adata.n_vars)
+    info["nnz"] = int(adata.X.nnz) if hasattr(adata.X, "nnz") else int(np.count_nonzero(adata.X))
+
+    with timer.stage("qc"):
+        adata.var['mt'] = adata.var_names.str.startswith('MT-')
+        sc.pp.calculate_qc_metrics(adata, qc_vars=['mt'], inplace=True)
+
+    with timer.stage("filter"):
+        sc.pp.filter_genes(adata, min_cells=3)
+        sc.pp.filter_cells(adata, min_genes=200)
+        adata = adata[(adata.obs.n_genes_by_counts < 5000) & (adata.obs.pct_counts_mt < 20), :].copy()
+    info["n_obs_filtered"], info["n_vars_filtered"] = int(adata.n_obs), int(adata.n_vars)
+
+    with timer.stage("normalize"):
+        adata.raw = adata
+        sc.pp.normalize_total(adata, target_sum=1e4)
+        sc.pp.log1p(adata)
+
+    with timer.stage("hvg"):
+        sc.pp.highly_variable_genes(adata, min_mean=0.0125, max_mean=3, min_disp=0.5)
+        adata.raw = adata
+        adata = adata[:, adata.var.highly_variable].copy()
+    info["n_hvg"] = int(adata.n_vars)
+
+    if should_run("scale"):
+        with timer.stage("scale"):
+            sc.pp.scale(adata, max_value=10)
+
+    with timer.stage("pca"):
+        sc.tl.pca(adata, svd_solver='arpack')
+
+    with timer.stage("neighbors"):
+        sc.pp.neighbors(adata, n_neighbors=10, n_pcs=40)
+
+    if should_run("umap"):
+        with timer.stage("umap"):
+            sc.tl.umap(adata)
+
+    with timer.stage("leiden"):
+        sc.tl.leiden(adata, resolution=0.5)
+    info["n_clusters"] = int(adata.obs['leiden'].nunique())
+
+    if should_run("rank_genes_groups"):
+        with timer.stage("rank_genes_groups"):
+            sc.tl.rank_genes_groups(adata, 'leiden', method='wilcoxon')
+
+    if should_run("plot"):
+        with timer.stage("plot"):
+            basis = 'umap' if 'X_umap' in adata.obsm else 'pca'
+            fig, axes = plt.subplots(2, 2, figsize=(12, 10))
+            for ax, color in zip(axes.flat, ['leiden', 'total_counts', 'n_genes_by_counts', 'pct_counts_mt']):
+                sc.pl.embedding(adata, basis=basis, color=color, ax=ax, show=False)
+            buffer = io.BytesIO()
+            fig.savefig(buffer, format='png', dpi=100, bbox_inches='tight')
+            plt.close(fig)
+            if 'rank_genes_groups' in adata.uns:
+                sc.pl.rank_genes_groups(adata, n_genes=5, sharey=False, show=False)
+                plt.gcf().savefig(buffer, format='png', dpi=100)
+                plt.close('all')
+            info["plot_bytes"] = buffer.tell()
+
+    return info
+
+
+def _run_dataset(dataset: str, data_path: str, seed: int, warmup: bool, skip: Tuple[str, ...],
+                 synthetic_dir: Optional[str] = None) -> Dict[str, Any]:
+    """在子进程中运行单个数据集"""
+    kind, n_cells = parse_dataset(dataset)
+    result: Dict[str, Any] = {"dataset": dataset, "kind": kind}
+
+    template = data_path
+    if kind == "synthetic":
+        try:
+            data_path, result["generate_s"] = prepare_synthetic(template, n_cells, seed, synthetic_dir)
+        except Exception as e:
+            result.update(status="error", error=f"合成数据生成失败: {type(e).__name__}: {e}",
+                          traceback=traceback.format_exc(), stages=[])
+            return result
+        result["data_path"] = data_path
+
+    if warmup:
+        # 在小数据上先跑一遍，numba编译和模块导入不计入正式计时
+        warmup_start = time.perf_counter()
+        try:
+            run_pipeline(lambda: load_pbmc3k(template)[:500].copy(), StageTimer(), skip)
+        except Exception as e:
+            result["warmup_error"] = f"{type(e).__name__}: {e}"
+        result["warmup_s"] = round(time.perf_counter() - warmup_start, 2)
+
+    timer = StageTimer()
+    try:
+        result.update(run_pipeline(lambda: load_pbmc3k(data_path), timer, skip))
+        result["status"] = "ok"
+    except Exception as e:
+        result["status"] = "error"
+        result["error"] = f"{type(e).__name__}: {e}"
+        result["traceback"] = traceback.format_exc()
+    result["stages"] = timer.stages
+    result["total_wall_s"] = round(sum(s.get("wall_s", 0) for s in timer.stages), 3)
+    result["total_cpu_s"] = round(sum(s.get("cpu_s", 0) for s in timer.stages), 3)
+    result["peak_rss_mb"] = max((s.get("peak_rss_mb", 0) for s in timer.stages), default=0)
+    return result
+
+
+def _environment() -> Dict[str, Any]:
+    versions = {}
+    for module in ("numpy", "scipy", "pandas", "anndata", "scanpy", "umap", "leidenalg", "igraph", "numba", "sklearn"):
+        try:
+            versions[module] = __import__(module).__version__
+        except Exception:
+            versions[module] = None
+    return {
+        "host": socket.gethostname(),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "cpu_count": os.cpu_count(),
+        "memory_gb": round(psutil.virtual_memory().total / 1024 ** 3, 1) if psutil is not None else None,
+        "threads": {k: os.environ.get(k) for k in ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS",
+                                                   "MKL_NUM_THREADS", "NUMBA_NUM_THREADS")},
+        "versions": versions
+    }
+
+
+def run_benchmark(datasets: List[str], data_path: Optional[str] = None, seed: int = 0,
+                  warmup: bool = True, skip: Tuple[str, ...] = (), threads: Optional[int] = None,
+                  synthetic_dir: Optional[str] = None) -> Dict[str, Any]:
+    """依次在独立子进程中运行各数据集，返回完整结果"""
+    data_path = data_path or default_data_path()
+    for name in datasets:
+        parse_dataset(name)
+
+    if threads:
+        # 子进程以spawn方式启动，继承这里设置的线程数
+        for var in ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS", "NUMBA_NUM_THREADS"):
+            os.environ[var] = str(threads)
+
+    results: Dict[str, Any] = {
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "data_path": data_path,
+        "seed": seed,
+        "warmup": warmup,
+        "environment": _environment(),
+        "datasets": {}
+    }
+
+    context = multiprocessing.get_context("spawn")
+    for name in datasets:
+        print(f"⏱️ [基准测试] {name} ...", flush=True)
+        started = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+            try:
+                result = pool.submit(_run_dataset, name, data_path, seed, warmup, skip, synthetic_dir).result()
+            except BrokenProcessPool:
+                result = {"dataset": name, "status": "crashed", "stages": [],
+                          "error": "子进程异常退出（可能是内存不足）"}
+        results["datasets"][name] = result
+        status = "✅" if result["status"] == "ok" else "❌"
+        print(f"{status} [基准测试] {name}: {result.get('n_obs', '?')} 个细胞，"
+              f"流程耗时 {result.get('total_wall_s', 0):.2f}s，峰值内存 {result.get('peak_rss_mb', 0):.0f} MB"
+              f"（总计 {time.perf_counter() - started:.1f}s"
+              + (f"，其中生成数据 {result['generate_s']:.1f}s" if result.get("generate_s") else "")
+              + "）", flush=True)
+        if result["status"] != "ok":
+            print(f"   {result.get('error')}")
+    return results
+
+
+# ===== 对比 =====
+
+def compare_results(current: Dict[str, Any], baseline: Dict[str, Any],
+                    threshold: float = DEFAULT_REGRESSION_THRESHOLD,
+                    min_delta: float = DEFAULT_MIN_DELTA_SECONDS) -> Dict[str, Any]:
+    """逐数据集、逐阶段对比墙钟时间和峰值内存；两边都成功的阶段才参与对比"""
+    rows = []
+    for dataset, result in current.get("datasets", {}).items():
+        base = baseline.get("datasets", {}).get(dataset)
+        if base is None:
+            continue
+        base_stages = {s["stage"]: s for s in base.get("stages", []) if s.get("status") == "ok"}
+        for stage in result.get("stages", []):
+            old = base_stages.get(stage["stage"])
+            if stage.get("status") != "ok" or old is None:
+                continue
+            delta = stage["wall_s"] - old["wall_s"]
+            ratio = stage["wall_s"] / old["wall_s"] if old["wall_s"] > 0 else float("inf")
+            if delta > min_delta and ratio > 1 + threshold:
+                verdict = "slower"
+            elif -delta > min_delta and ratio < 1 - threshold:
+                verdict = "faster"
+            else:
+                verdict = "same"
+            rows.append({
+                "dataset": dataset,
+                "stage": stage["stage"],
+                "baseline_s": old["wall_s"],
+                "current_s": stage["wall_s"],
+                "ratio": round(ratio, 3),
+                "baseline_rss_mb": old.get("peak_rss_mb"),
+                "current_rss_mb": stage.get("peak_rss_mb"),
+                "verdict": verdict
+            })
+    return {
+        "threshold": threshold,
+        "min_delta_s": min_delta,
+        "rows": rows,
+        "regressions": [r for r in rows if r["verdict"] == "slower"]
+    }
+
+
+def print_results(results: Dict[str, Any]):
+    for name, result in results["datasets"].items():
+        print(f"\n📊 {name} ({result.get('n_obs', '?')} 细胞 × {result.get('n_vars', '?')} 基因, "
+              f"过滤后 {result.get('n_obs_filtered', '?')} 细胞, {result.get('n_clusters', '?')} 个聚类)")
+        print(f"  {'stage':<18} {'wall [s]':>10} {'cpu [s]':>10} {'peak RSS [MB]':>14}")
+        for stage in result.get("stages", []):
+            if stage.get("status") == "skipped":
+                print(f"  {stage['stage']:<18} {'skipped':>10}")
+                continue
+            print(f"  {stage['stage']:<18} {stage.get('wall_s', 0):>10.3f} {stage.get('cpu_s', 0):>10.3f} "
+                  f"{stage.get('peak_rss_mb', 0):>14.1f}" + ("  ❌ " + stage["error"] if "error" in stage else ""))
+
+
+def print_comparison(comparison: Dict[str, Any]):
+    print(f"\n🔍 与基线对比（变慢判定: >{comparison['threshold']:.0%} 且 >{comparison['min_delta_s']}s）")
+    print(f"  {'dataset':<10} {'stage':<18} {'baseline':>10} {'current':>10} {'ratio':>8}")
+    marks = {"slower": "🔴", "faster": "🟢", "same": "  "}
+    for row in comparison["rows"]:
+        print(f"  {row['dataset']:<10} {row['stage']:<18} {row['baseline_s']:>10.3f} "
+              f"{row['current_s']:>10.3f} {row['ratio']:>7.2f}x {marks[row['verdict']]}")
+    if comparison["regressions"]:
+        print(f"⚠️ {len(comparison['regressions'])} 个阶段比基线变慢")
+    else:
+        print("✅ 没有阶段比基线变慢")
+
+
+def latest_result(results_dir: Path = RESULTS_DIR) -> Optional[Path]:
+    """最近一次保存的结果文件"""
+    files = sorted(results_dir.glob("pipeline-*.json")) if results_dir.exists() else []
+    return files[-1] if files else None
+
+
+def _write_json(path: Path, data: Dict[str, Any]):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with tempfile.NamedTemporaryFile("w", dir=path.parent, suffix=".tmp", delete=False, encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(f.name, path)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description="PBMC3K分析流程基准测试")
+    parser.add_argument("--datasets", default="pbmc3k,10k", help="逗号分隔：pbmc3k 或细胞数（如 10k,100k,500k）")
+    parser.add_argument("--data-path", help="PBMC3K 10x数据目录，默认取 config.get_data_path()")
+    parser.add_argument("--output", help=f"结果JSON路径，默认 {RESULTS_DIR}/pipeline-<时间>.json")
+    parser.add_argument("--baseline", help="基线结果JSON，运行后与之对比")
+    parser.add_argument("--compare", help="不运行测试，直接将该结果文件与 --baseline 对比")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_REGRESSION_THRESHOLD, help="变慢判定比例")
+    parser.add_argument("--skip", default="", help=f"跳过的可选阶段（逗号分隔）：{','.join(OPTIONAL_STAGES)}")
+    parser.add_argument("--threads", type=int, help="BLAS/numba线程数")
+    parser.add_argument("--seed", type=int, default=0, help="合成数据随机种子")
+    parser.add_argument("--synthetic-dir", help=f"合成数据缓存目录，默认 {SYNTHETIC_DIR}")
+    parser.add_argument("--no-warmup", action="store_true", help="不预热（numba编译时间计入第一个数据集）")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        if not args.baseline:
+            parser.error("--compare 需要同时指定 --baseline")
+        with open(args.compare, encoding="utf-8") as f:
+            results = json.load(f)
+    else:
+        skip = tuple(s.strip() for s in args.skip.split(",") if s.strip())
+        unknown = set(skip) - set(OPTIONAL_STAGES)
+        if unknown:
+            parser.error(f"不能跳过的阶段: {', '.join(sorted(unknown))}（流程阶段: {', '.join(STAGES)}）")
+        results = run_benchmark([d for d in args.datasets.split(",") if d.strip()], args.data_path,
+                                args.seed, not args.no_warmup, skip, args.threads, args.synthetic_dir)
+        output = Path(args.output) if args.output else RESULTS_DIR / f"pipeline-{datetime.now():%Y%m%d-%H%M%S}.json"
+        _write_json(output, results)
+        print_results(results)
+        print(f"\n💾 结果已保存: {output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        comparison = compare_results(results, baseline, args.threshold)
+        print_comparison(comparison)
+        if comparison["regressions"]:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
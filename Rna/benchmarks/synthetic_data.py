@@ -0,0 +1,519 @@
+#!/usr/bin/env python3
+"""
+合成单细胞数据生成器
+以PBMC3K为模板，生成任意细胞数和基因数的 10x 格式（matrix.mtx / genes.tsv / barcodes.tsv）和 h5ad 数据集，
+用于基准测试和压力测试：
+
+- 文库大小和线粒体比例：成对地从PBMC3K的细胞中重采样（保留两者的相关性），文库大小加入对数正态扰动
+- 基因表达谱：PBMC3K各基因的平均表达比例；基因数不同时对基因重采样（线粒体基因始终保留）
+- 聚类结构：预设若干聚类，每个聚类上调一组随机选取的标记基因；真实标签写入 true_clusters.tsv 和 obs['true_cluster']
+- 稀疏度和过离散：每个细胞的分子按表达谱逐个抽样（多项分布），每批为每个聚类生成若干带gamma噪声的
+  表达谱变体，按PBMC3K估计的离散度使基因表达在细胞间过离散
+- 按批生成并直接写入文件，内存占用与总细胞数无关，可以生成数百万细胞的数据集
+
+生成后将 PBMC3K_PATH 指向输出目录，所有工具（config.get_data_path）即改用该数据集：
+
+    cd Rna
+    python -m benchmarks.synthetic_data --cells 1000000 --output /data/synthetic-1m --format 10x,h5ad
+    export PBMC3K_PATH=/data/synthetic-1m
+"""
+
+import os
+import csv
+import json
+import time
+import argparse
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+import scipy.sparse as sp
+
+PROJECT_ROOT = Path(__file__).resolve().parents[2]
+DEFAULT_TEMPLATE = PROJECT_ROOT / "PBMC3kRNA-seq" / "filtered_gene_bc_matrices" / "hg19"
+
+# 写入 synthetic.json 表示数据集已完整生成
+SUMMARY_FILE = "synthetic.json"
+H5AD_FILE = "synthetic.h5ad"
+
+# matrix.mtx 中非零元素数量在写完后回填，预留固定宽度（前导零不影响解析）
+_NNZ_WIDTH = 20
+# 10x条形码为16位碱基，按奇数乘子在 4^16 范围内打散序号，保证唯一
+_BARCODE_SPACE = 4 ** 16
+_BARCODE_MULTIPLIER = 2654435761
+
+
+@dataclass
+class TemplateStats:
+    """从模板数据集中提取的统计量"""
+    gene_ids: np.ndarray
+    gene_symbols: np.ndarray
+    gene_profile: np.ndarray        # 各基因占总计数的比例
+    library_sizes: np.ndarray       # 每个细胞的总计数
+    mt_fractions: np.ndarray        # 每个细胞的线粒体基因计数比例
+    dispersion: float               # 负二项离散度（中位数）
+
+
+def _read_genes(path: Path) -> Tuple[np.ndarray, np.ndarray]:
+    with open(path, newline="", encoding="utf-8") as f:
+        rows = [row for row in csv.reader(f, delimiter="\t") if row]
+    ids = np.array([row[0] for row in rows], dtype=object)
+    symbols = np.array([row[1] if len(row) > 1 else row[0] for row in rows], dtype=object)
+    return ids, symbols
+
+
+def _is_mt(symbols: np.ndarray) -> np.ndarray:
+    return np.array([str(s).upper().startswith("MT-") for s in symbols], dtype=bool)
+
+
+def load_template_stats(template_dir: Optional[str] = None) -> TemplateStats:
+    """读取模板10x数据（基因×细胞）并提取统计量"""
+    from scipy.io import mmread
+
+    template_dir = Path(template_dir or DEFAULT_TEMPLATE)
+    counts = sp.csr_matrix(mmread(str(template_dir / "matrix.mtx")).T, dtype=np.float64)  # 细胞×基因
+    gene_ids, gene_symbols = _read_genes(template_dir / "genes.tsv")
+
+    totals = np.asarray(counts.sum(axis=1)).ravel()
+    keep = totals > 0
+    counts, totals = counts[keep], totals[keep]
+    mt_totals = np.asarray(counts[:, _is_mt(gene_symbols)].sum(axis=1)).ravel()
+    gene_totals = np.asarray(counts.sum(axis=0)).ravel()
+
+    # 按文库大小归一化后估计每个基因的离散度：var = mean + phi * mean^2
+    normalized = sp.diags(np.median(totals) / totals) @ counts
+    mean = np.asarray(normalized.mean(axis=0)).ravel()
+    variance = np.asarray(normalized.multiply(normalized).mean(axis=0)).ravel() - mean ** 2
+    expressed = mean > 0.1
+    phi = (variance[expressed] - mean[expressed]) / mean[expressed] ** 2
+    phi = phi[phi > 0]
+    # 模板中的离散度包含细胞类型差异，聚类差异另行加入，这里限制在合理范围内
+    dispersion = float(np.clip(np.median(phi), 0.01, 0.5)) if phi.size else 0.1
+
+    return TemplateStats(
+        gene_ids=gene_ids,
+        gene_symbols=gene_symbols,
+        gene_profile=gene_totals / gene_totals.sum(),
+        library_sizes=totals,
+        mt_fractions=mt_totals / totals,
+        dispersion=dispersion
+    )
+
+
+def make_barcodes(start: int, count: int, seed: int = 0) -> List[str]:
+    """生成10x风格的条形码（16位碱基 + "-1"），同一种子下序号不同则条形码不同"""
+    index = np.arange(start, start + count, dtype=np.uint64)
+    offset = np.uint64((seed * 0x9E3779B1) % _BARCODE_SPACE)
+    # uint64溢出按 2^64 取模，不影响按 4^16（2^32）取模的结果
+    code = (index * np.uint64(_BARCODE_MULTIPLIER) + offset) % np.uint64(_BARCODE_SPACE)
+    shifts = np.arange(30, -1, -2, dtype=np.uint64)
+    digits = (code[:, None] >> shifts) & np.uint64(3)
+    letters = np.array([b"A", b"C", b"G", b"T"], dtype="S1")[digits.astype(np.intp)]
+    return [b.decode("ascii") + "-1" for b in letters.view("S16").ravel()]
+
+
+_POWERS_OF_10 = 10 ** np.arange(1, 19, dtype=np.int64)
+
+
+def format_int_rows(*columns: np.ndarray) -> bytes:
+    """将若干非负整数列格式化为 "a b c\n" 文本行（向量化实现，比逐行格式化快一个数量级以上）"""
+    widths = [1 + np.searchsorted(_POWERS_OF_10, column, side="right") for column in columns]
+    line_lengths = sum(widths) + len(columns)
+    ends = np.cumsum(line_lengths)
+    if len(ends) == 0:
+        return b""
+    buffer = np.empty(int(ends[-1]), dtype=np.uint8)
+    position = ends - line_lengths
+    for column, width in zip(columns, widths):
+        value = column.astype(np.int64, copy=True)
+        last = position + width - 1
+        # 从个位开始逐位写入，只处理仍有该位数字的元素
+        for digit in range(int(width.max())):
+            mask = width > digit
+            buffer[(last - digit)[mask]] = 48 + value[mask] % 10
+            value //= 10
+        buffer[position + width] = 32
+        position = position + width + 1
+    buffer[ends - 1] = 10
+    return buffer.tobytes()
+
+
+def make_unique(names: Sequence[str]) -> List[str]:
+    """与 AnnData.var_names_make_unique 相同的规则：重复的名称依次加 -1、-2 …"""
+    seen: Dict[str, int] = {}
+    result = []
+    for name in names:
+        if name in seen:
+            seen[name] += 1
+            result.append(f"{name}-{seen[name]}")
+        else:
+            seen[name] = 0
+            result.append(name)
+    return result
+
+
+class SyntheticDataGenerator:
+    """按批生成计数矩阵（细胞×基因，CSR）和真实聚类标签"""
+
+    def __init__(self, stats: TemplateStats, n_cells: int, n_genes: Optional[int] = None,
+                 n_clusters: int = 8, n_markers: int = 30, marker_fold: float = 4.0,
+                 depth: float = 1.0, variants: int = 16, chunk_size: int = 4096, seed: int = 0):
+        """
+        Args:
+            n_genes: 基因数，默认与模板相同
+            n_clusters: 预设聚类数
+            n_markers: 每个聚类上调的标记基因数
+            marker_fold: 标记基因上调倍数（对数正态分布的中位数）
+            depth: 测序深度系数，乘到重采样的文库大小上
+            variants: 每批为每个聚类生成的表达谱变体数（提供细胞间的过离散）
+            chunk_size: 每批生成的细胞数
+        """
+        self.stats = stats
+        self.n_cells = n_cells
+        self.n_clusters = max(1, n_clusters)
+        self.depth = depth
+        self.variants = max(1, variants)
+        self.chunk_size = max(1, chunk_size)
+        self.seed = seed
+        self.rng = np.random.default_rng(seed)
+
+        self.gene_ids, self.gene_symbols, profile = self._select_genes(n_genes)
+        self.n_genes = len(self.gene_ids)
+        is_mt = _is_mt(self.gene_symbols)
+        self.mt_idx = np.flatnonzero(is_mt)
+        self.other_idx = np.flatnonzero(~is_mt)
+
+        # 非线粒体基因的聚类表达谱：在高表达基因中为每个聚类选取标记基因并上调
+        other_profile = profile[self.other_idx]
+        candidates = np.argsort(other_profile)[::-1][:3000]
+        self.cluster_profiles = np.tile(other_profile, (self.n_clusters, 1))
+        for k in range(self.n_clusters):
+            markers = self.rng.choice(candidates, min(n_markers, len(candidates)), replace=False)
+            self.cluster_profiles[k, markers] *= self.rng.lognormal(np.log(marker_fold), 0.5, len(markers))
+        self.cluster_profiles /= self.cluster_profiles.sum(axis=1, keepdims=True)
+        self.cluster_weights = self.rng.dirichlet(np.full(self.n_clusters, 2.0))
+
+        mt_profile = profile[self.mt_idx]
+        self.mt_cdf = np.cumsum(mt_profile / mt_profile.sum()) if mt_profile.sum() > 0 else None
+
+    def _select_genes(self, n_genes: Optional[int]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        stats = self.stats
+        n_template = len(stats.gene_ids)
+        if not n_genes or n_genes == n_template:
+            return stats.gene_ids, stats.gene_symbols, stats.gene_profile
+
+        mt_idx = np.flatnonzero(_is_mt(stats.gene_symbols))
+        other_idx = np.flatnonzero(~_is_mt(stats.gene_symbols))
+        if n_genes < n_template:
+            # 保留线粒体基因，其余随机选取（保持原顺序），稀疏度分布与模板一致
+            n_other = max(n_genes - len(mt_idx), 0)
+            chosen = np.sort(np.concatenate([mt_idx[:n_genes],
+                                             self.rng.choice(other_idx, n_other, replace=False)]))
+            return stats.gene_ids[chosen], stats.gene_symbols[chosen], stats.gene_profile[chosen]
+
+        # 基因数多于模板：新增的基因从模板的非线粒体基因中重采样表达比例
+        extra = n_genes - n_template
+        source = self.rng.choice(other_idx, extra, replace=True)
+        ids = np.concatenate([stats.gene_ids, np.array([f"SYNG{i:011d}" for i in range(extra)], dtype=object)])
+        symbols = np.concatenate([stats.gene_symbols, np.array([f"SYN{i}" for i in range(extra)], dtype=object)])
+        return ids, symbols, np.concatenate([stats.gene_profile, stats.gene_profile[source]])
+
+    def _variant_cdfs(self) -> np.ndarray:
+        """每个聚类生成 variants 个带gamma噪声的表达谱，返回各变体的累积分布（聚类 × 变体 行）"""
+        profiles = np.repeat(self.cluster_profiles, self.variants, axis=0)
+        phi = self.stats.dispersion
+        if phi > 0:
+            profiles = profiles * self.rng.gamma(1.0 / phi, phi, size=profiles.shape)
+        cdfs = np.cumsum(profiles, axis=1)
+        cdfs /= cdfs[:, -1:]
+        return cdfs
+
+    @staticmethod
+    def _sample(cdf: np.ndarray, cells: np.ndarray, counts: np.ndarray,
+                rng: np.random.Generator) -> Tuple[np.ndarray, np.ndarray]:
+        """为每个细胞按累积分布抽取 counts 个分子，返回 (细胞序号, 基因序号)"""
+        total = int(counts.sum())
+        genes = np.searchsorted(cdf, rng.random(total), side="right")
+        np.minimum(genes, len(cdf) - 1, out=genes)
+        return np.repeat(cells, counts), genes
+
+    def chunks(self) -> Iterator[Tuple[sp.csr_matrix, np.ndarray]]:
+        """按批生成 (计数矩阵, 真实聚类标签)"""
+        stats, rng = self.stats, self.rng
+        for start in range(0, self.n_cells, self.chunk_size):
+            m = min(self.chunk_size, self.n_cells - start)
+            source = rng.integers(0, len(stats.library_sizes), m)
+            library = stats.library_sizes[source] * rng.lognormal(0.0, 0.1, m) * self.depth
+            molecules = rng.poisson(library)
+            if self.mt_cdf is not None:
+                n_mt = rng.binomial(molecules, stats.mt_fractions[source])
+            else:
+                n_mt = np.zeros(m, dtype=np.int64)
+            n_other = molecules - n_mt
+            clusters = rng.choice(self.n_clusters, m, p=self.cluster_weights)
+            groups = clusters * self.variants + rng.integers(0, self.variants, m)
+
+            cdfs = self._variant_cdfs()
+            cell_parts, gene_parts = [], []
+            order = np.argsort(groups, kind="stable")
+            bounds = np.searchsorted(groups[order], np.arange(len(cdfs) + 1))
+            for group in range(len(cdfs)):
+                cells = order[bounds[group]:bounds[group + 1]]
+                if len(cells):
+                    cell_ids, genes = self._sample(cdfs[group], cells, n_other[cells], rng)
+                    cell_parts.append(cell_ids)
+                    gene_parts.append(self.other_idx[genes])
+            if self.mt_cdf is not None:
+                cell_ids, genes = self._sample(self.mt_cdf, np.arange(m), n_mt, rng)
+                cell_parts.append(cell_ids)
+                gene_parts.append(self.mt_idx[genes])
+
+            # 相同 (细胞, 基因) 的分子合并为计数；np.unique 的结果按细胞、基因排序，可直接构造CSR
+            keys = np.concatenate(cell_parts).astype(np.int64) * self.n_genes + np.concatenate(gene_parts)
+            keys, values = np.unique(keys, return_counts=True)
+            rows, cols = np.divmod(keys, self.n_genes)
+            indptr = np.searchsorted(rows, np.arange(m + 1))
+            matrix = sp.csr_matrix((values.astype(np.float32), cols.astype(np.int32), indptr),
+                                   shape=(m, self.n_genes))
+            yield matrix, clusters
+
+
+class TenXWriter:
+    """10x v2格式（与PBMC3K相同）：matrix.mtx 为 基因×细胞 的坐标格式（1起始），逐批追加"""
+
+    def __init__(self, out_dir: Path, gene_ids: np.ndarray, gene_symbols: np.ndarray, n_cells: int):
+        self.out_dir = out_dir
+        with open(out_dir / "genes.tsv", "w", encoding="utf-8") as f:
+            f.writelines(f"{gene_id}\t{symbol}\n" for gene_id, symbol in zip(gene_ids, gene_symbols))
+
+        self._matrix = open(out_dir / "matrix.mtx", "wb")
+        self._matrix.write(b"%%MatrixMarket matrix coordinate integer general\n")
+        self._matrix.write(b"% synthetic dataset generated by RnAgent benchmarks.synthetic_data\n")
+        self._matrix.write(f"{len(gene_ids)} {n_cells} ".encode("ascii"))
+        self._nnz_offset = self._matrix.tell()
+        self._matrix.write(b"0" * _NNZ_WIDTH + b"\n")
+        self._barcodes = open(out_dir / "barcodes.tsv", "w", encoding="ascii", newline="\n")
+        self._clusters = open(out_dir / "true_clusters.tsv", "w", encoding="ascii", newline="\n")
+        self.nnz = 0
+        self.cells_written = 0
+
+    def write(self, matrix: sp.csr_matrix, clusters: np.ndarray, barcodes: List[str]):
+        coo = matrix.tocoo()
+        self._matrix.write(format_int_rows(coo.col.astype(np.int64) + 1,
+                                           coo.row.astype(np.int64) + 1 + self.cells_written,
+                                           coo.data.astype(np.int64)))
+        self._barcodes.write("\n".join(barcodes) + "\n")
+        self._clusters.writelines(f"{barcode}\t{cluster}\n" for barcode, cluster in zip(barcodes, clusters))
+        self.nnz += coo.nnz
+        self.cells_written += matrix.shape[0]
+
+    def close(self):
+        self._matrix.seek(self._nnz_offset)
+        self._matrix.write(f"{self.nnz:0{_NNZ_WIDTH}d}".encode("ascii"))
+        for f in (self._matrix, self._barcodes, self._clusters):
+            f.close()
+
+
+class H5ADWriter:
+    """按AnnData的h5ad格式（X为CSR）逐批追加写入，先写临时文件，完成后改名"""
+
+    def __init__(self, path: Path, gene_ids: np.ndarray, gene_symbols: np.ndarray,
+                 n_clusters: int, compression: Optional[str] = None):
+        import h5py
+
+        self.path = path
+        self._tmp_path = path.with_name(path.name + ".tmp")
+        self._string = h5py.string_dtype()
+        self._n_clusters = n_clusters
+        self.n_genes = len(gene_ids)
+        self.nnz = 0
+        self.cells_written = 0
+
+        f = self._file = h5py.File(self._tmp_path, "w")
+        f.attrs.update({"encoding-type": "anndata", "encoding-version": "0.1.0"})
+
+        x = f.create_group("X")
+        x.attrs.update({"encoding-type": "csr_matrix", "encoding-version": "0.1.0"})
+        self._data = x.create_dataset("data", shape=(0,), maxshape=(None,), dtype="float32",
+                                      chunks=(1 << 18,), compression=compression)
+        self._indices = x.create_dataset("indices", shape=(0,), maxshape=(None,), dtype="int32",
+                                         chunks=(1 << 18,), compression=compression)
+        self._indptr = x.create_dataset("indptr", data=np.zeros(1, dtype=np.int64), maxshape=(None,),
+                                        chunks=(1 << 16,))
+
+        obs = f.create_group("obs")
+        obs.attrs.update({"encoding-type": "dataframe", "encoding-version": "0.2.0",
+                          "_index": "_index", "column-order": ["true_cluster"]})
+        self._obs_index = self._string_array(obs, "_index", [], resizable=True)
+        cluster = obs.create_group("true_cluster")
+        cluster.attrs.update({"encoding-type": "categorical", "encoding-version": "0.2.0", "ordered": False})
+        self._cluster_codes = cluster.create_dataset("codes", shape=(0,), maxshape=(None,), dtype="int16",
+                                                     chunks=(1 << 16,))
+        self._string_array(cluster, "categories", [str(k) for k in range(n_clusters)])
+
+        var = f.create_group("var")
+        var.attrs.update({"encoding-type": "dataframe", "encoding-version": "0.2.0",
+                          "_index": "_index", "column-order": ["gene_ids"]})
+        self._string_array(var, "_index", make_unique([str(s) for s in gene_symbols]))
+        self._string_array(var, "gene_ids", [str(g) for g in gene_ids])
+
+        for name in ("layers", "obsm", "varm", "obsp", "varp", "uns"):
+            f.create_group(name).attrs.update({"encoding-type": "dict", "encoding-version": "0.1.0"})
+
+    def _string_array(self, group, name: str, values: List[str], resizable: bool = False):
+        kwargs = {"maxshape": (None,), "chunks": (1 << 14,)} if resizable else {}
+        dataset = group.create_dataset(name, data=np.array(values, dtype=object), dtype=self._string, **kwargs)
+        dataset.attrs.update({"encoding-type": "string-array", "encoding-version": "0.2.0"})
+        return dataset
+
+    @staticmethod
+    def _append(dataset, values: np.ndarray):
+        start = dataset.shape[0]
+        dataset.resize((start + len(values),))
+        dataset[start:] = values
+
+    def write(self, matrix: sp.csr_matrix, clusters: np.ndarray, barcodes: List[str]):
+        self._append(self._data, matrix.data.astype(np.float32))
+        self._append(self._indices, matrix.indices.astype(np.int32))
+        self._append(self._indptr, matrix.indptr[1:].astype(np.int64) + self.nnz)
+        self._append(self._obs_index, np.array(barcodes, dtype=object))
+        self._append(self._cluster_codes, clusters.astype(np.int16))
+        self.nnz += matrix.nnz
+        self.cells_written += matrix.shape[0]
+
+    def close(self):
+        self._file["X"].attrs["shape"] = (self.cells_written, self.n_genes)
+        self._file.close()
+        os.replace(self._tmp_path, self.path)
+
+
+def is_complete(output_dir: str, expected: Optional[Dict[str, Any]] = None) -> bool:
+    """输出目录中是否已有完整生成的数据集（参数与 expected 一致）"""
+    try:
+        with open(Path(output_dir) / SUMMARY_FILE, encoding="utf-8") as f:
+            summary = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return False
+    return all(summary.get("params", {}).get(k) == v for k, v in (expected or {}).items())
+
+
+def generate_dataset(output_dir: str, n_cells: int, n_genes: Optional[int] = None,
+                     formats: Sequence[str] = ("10x",), template: Optional[str] = None,
+                     seed: int = 0, compression: Optional[str] = None, verbose: bool = True,
+                     **options) -> Dict[str, Any]:
+    """生成数据集并返回摘要（同时写入 <输出目录>/synthetic.json）
+
+    Args:
+        formats: "10x" 和/或 "h5ad"（h5ad 写入 <输出目录>/synthetic.h5ad）
+        template: 模板10x数据目录，默认为项目中的PBMC3K
+        compression: h5ad 的压缩方式（如 "gzip"、"lzf"），默认不压缩
+        options: 传给 SyntheticDataGenerator 的其他参数（n_clusters、depth、chunk_size 等）
+    """
+    unknown = set(formats) - {"10x", "h5ad"}
+    if not formats:
+        raise ValueError("至少需要一种输出格式（10x、h5ad）")
+    if unknown:
+        raise ValueError(f"不支持的格式: {', '.join(sorted(unknown))}（可用 10x、h5ad）")
+
+    started = time.time()
+    out_dir = Path(output_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    (out_dir / SUMMARY_FILE).unlink(missing_ok=True)
+
+    template = str(template or DEFAULT_TEMPLATE)
+    generator = SyntheticDataGenerator(load_template_stats(template), n_cells, n_genes, seed=seed, **options)
+    writers: List[Any] = []
+    if "10x" in formats:
+        writers.append(TenXWriter(out_dir, generator.gene_ids, generator.gene_symbols, n_cells))
+    if "h5ad" in formats:
+        writers.append(H5ADWriter(out_dir / H5AD_FILE, generator.gene_ids, generator.gene_symbols,
+                                  generator.n_clusters, compression))
+
+    nnz = 0
+    genes_per_cell: List[np.ndarray] = []
+    report_every = max(n_cells // 10, generator.chunk_size)
+    next_report = report_every
+    try:
+        for matrix, clusters in generator.chunks():
+            barcodes = make_barcodes(writers[0].cells_written if writers else 0, matrix.shape[0], seed)
+            for writer in writers:
+                writer.write(matrix, clusters, barcodes)
+            nnz += matrix.nnz
+            # 每批只保留少量细胞用于统计，内存占用不随细胞数增长
+            genes_per_cell.append(np.diff(matrix.indptr)[:256])
+            done = writers[0].cells_written if writers else 0
+            if verbose and done >= next_report:
+                next_report += report_every
+                print(f"⏳ [合成数据] {done}/{n_cells} 个细胞，{time.time() - started:.1f}s", flush=True)
+    finally:
+        for writer in writers:
+            writer.close()
+
+    sampled = np.concatenate(genes_per_cell) if genes_per_cell else np.zeros(1)
+    summary = {
+        "params": {
+            "n_cells": n_cells,
+            "n_genes": generator.n_genes,
+            "seed": seed,
+            "formats": sorted(formats),
+            "template": template,
+            **{k: v for k, v in options.items() if k != "chunk_size"}
+        },
+        "n_clusters": generator.n_clusters,
+        "cluster_weights": [round(float(w), 4) for w in generator.cluster_weights],
+        "dispersion": round(generator.stats.dispersion, 4),
+        "nnz": int(nnz),
+        "density": round(nnz / max(n_cells * generator.n_genes, 1), 6),
+        "median_genes_per_cell": float(np.median(sampled)),
+        "seconds": round(time.time() - started, 2)
+    }
+    with open(out_dir / SUMMARY_FILE, "w", encoding="utf-8") as f:
+        json.dump(summary, f, ensure_ascii=False, indent=2)
+    if verbose:
+        print(f"✅ [合成数据] {n_cells} 个细胞 × {generator.n_genes} 个基因，非零元素 {nnz}"
+              f"（密度 {summary['density']:.4f}），耗时 {summary['seconds']:.1f}s → {out_dir}")
+    return summary
+
+
+def _parse_count(value: str) -> int:
+    value = value.strip().lower()
+    multiplier = {"k": 1000, "m": 1000000}.get(value[-1:], 1)
+    if multiplier > 1:
+        value = value[:-1]
+    return int(float(value) * multiplier)
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.synthetic_data",
+                                     description="以PBMC3K为模板生成合成单细胞数据集")
+    parser.add_argument("--cells", required=True, help="细胞数，如 50000、100k、2m")
+    parser.add_argument("--genes", help="基因数，默认与模板相同")
+    parser.add_argument("--output", required=True, help="输出目录")
+    parser.add_argument("--format", default="10x", help="逗号分隔：10x、h5ad")
+    parser.add_argument("--template", help=f"模板10x数据目录，默认 {DEFAULT_TEMPLATE}")
+    parser.add_argument("--clusters", type=int, default=8, help="预设聚类数")
+    parser.add_argument("--depth", type=float, default=1.0, help="测序深度系数")
+    parser.add_argument("--chunk-size", type=int, default=4096, help="每批生成的细胞数")
+    parser.add_argument("--compression", help="h5ad压缩方式：gzip、lzf")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子")
+    args = parser.parse_args(argv)
+
+    generate_dataset(
+        args.output,
+        _parse_count(args.cells),
+        _parse_count(args.genes) if args.genes else None,
+        formats=[f.strip() for f in args.format.split(",") if f.strip()],
+        template=args.template,
+        seed=args.seed,
+        compression=args.compression,
+        n_clusters=args.clusters,
+        depth=args.depth,
+        chunk_size=args.chunk_size
+    )
+    if "10x" in args.format:
+        print(f"💡 使用该数据集: export PBMC3K_PATH={Path(args.output).resolve()}")
+
+
+if __name__ == "__main__":
+    main()
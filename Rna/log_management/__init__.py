@@ -1,8 +1,9 @@
 """
 RnAgent日志管理模块
-提供启动时自动清理功能
+按运行组织和归档日志文件，提供异步日志配置
 """
 
-from .startup_cleaner import cleanup_logs_on_startup
+from .async_logging import PAYLOAD, get_async_logging, setup_logging
+from .log_manager import LogManager, ManagedRotatingFileHandler, get_log_manager
 
-__all__ = ['cleanup_logs_on_startup'] 
\ No newline at end of file
+__all__ = ['PAYLOAD', 'LogManager', 'ManagedRotatingFileHandler', 'get_async_logging', 'get_log_manager', 'setup_logging']
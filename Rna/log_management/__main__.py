@@ -0,0 +1,5 @@
+"""查看最近的运行日志：python -m log_management"""
+
+from .log_manager import main
+
+main()
@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+"""
+异步日志
+请求线程只把日志记录放入队列（QueueHandler），由后台监听线程写控制台和文件；
+日志文件写入当前运行目录（见 log_manager），按大小或时间轮转并在后台压缩，支持按模块设置级别，并对大段调试内容（代码、输出、消息历史）抽样记录；
+fork出的子进程（Fork会话服务器的模板和工作进程）没有监听线程，改为同步写入各自的 <service>-worker-<pid>.log
+
+环境变量：
+    LOG_LEVEL                 根日志级别，默认 INFO
+    LOG_LEVELS                按模块设置级别，如 "rna_agent_graph=DEBUG,httpx=WARNING"
+    LOG_DIR                   固定的日志目录，默认为当前运行目录 Rna/logs/runs/<运行ID>
+    MAX_LOG_FILE_SIZE         单个日志文件上限（字节），默认 100MB
+    LOG_BACKUP_COUNT          轮转保留的文件数，默认 5
+    LOG_PAYLOAD_SAMPLE_RATE   调试内容的记录比例（0~1），默认 0.1
+    LOG_QUEUE_SIZE            日志队列长度，满时丢弃新记录，默认 10000
+"""
+
+import os
+import sys
+import queue
+import atexit
+import logging
+import itertools
+import threading
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import Any, Dict, List, Optional
+
+from .log_manager import DEFAULT_MAX_AGE, ManagedRotatingFileHandler, get_log_manager
+
+LOG_FORMAT = '%(asctime)s [%(levelname)s] %(name)s - %(message)s'
+
+# 与 optimized_core/config.py 中 PerformanceConfig 的默认值一致
+DEFAULT_MAX_BYTES = 100 * 1024 * 1024
+DEFAULT_BACKUP_COUNT = 5
+
+# 标记为调试内容的日志：logger.debug(..., extra=PAYLOAD)
+PAYLOAD = {"payload": True}
+
+
+def default_log_dir() -> str:
+    """日志目录（LOG_DIR，默认为当前运行目录）"""
+    return os.getenv("LOG_DIR") or str(get_log_manager().run_dir())
+
+
+class PayloadSampler(logging.Filter):
+    """调试内容抽样：带 payload 标记的记录按比例保留，其余记录不受影响
+
+    按计数抽样（每 1/rate 条保留一条），结果可预期且无需随机数
+    """
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = max(0.0, min(rate, 1.0))
+        self._every = round(1 / self.rate) if self.rate > 0 else 0
+        self._counter = itertools.count(1)
+        self.dropped = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not getattr(record, "payload", False) or self._every == 1:
+            return True
+        if self._every == 0:
+            self.dropped += 1
+            return False
+        # itertools.count 的 next() 在CPython中是原子操作，多线程下无需加锁
+        if next(self._counter) % self._every == 1:
+            return True
+        self.dropped += 1
+        return False
+
+
+class _DroppingQueueHandler(QueueHandler):
+    """队列满时丢弃新记录并计数，不阻塞请求线程"""
+
+    def __init__(self, log_queue: "queue.Queue"):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class AsyncLogging:
+    """已启用的异步日志（setup_logging 的返回值）"""
+
+    def __init__(self, handler: _DroppingQueueHandler, listener: QueueListener,
+                 sampler: PayloadSampler, log_file: str, max_bytes: int = 0, backup_count: int = 0):
+        self.handler = handler
+        self.listener = listener
+        self.sampler = sampler
+        self.log_file = log_file
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self._stopped = False
+
+    def stop(self):
+        """写完队列中剩余的日志并停止监听线程"""
+        if not self._stopped:
+            self._stopped = True
+            self.listener.stop()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "queued": self.handler.queue.qsize(),
+            "dropped_queue_full": self.handler.dropped,
+            "dropped_sampled": self.sampler.dropped
+        }
+
+
+_active: Optional[AsyncLogging] = None
+_setup_lock = threading.Lock()
+
+# fork时父进程的日志配置，以及子进程中替换上去的同步handler
+_fork_spec: Optional[Dict[str, Any]] = None
+_fork_handlers: List[logging.Handler] = []
+_fork_held_queue: Optional["queue.Queue"] = None
+
+
+def parse_module_levels(spec: str) -> Dict[str, str]:
+    """解析 "模块=级别,模块=级别" 格式"""
+    levels = {}
+    for item in spec.split(","):
+        if "=" in item:
+            name, level = item.split("=", 1)
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def setup_logging(service: str, log_file: Optional[str] = None, level: Optional[str] = None,
+                  max_bytes: Optional[int] = None, backup_count: Optional[int] = None,
+                  module_levels: Optional[Dict[str, str]] = None) -> AsyncLogging:
+    """为当前进程配置异步日志（每个进程只生效一次，重复调用返回已有配置）
+
+    Args:
+        service: 服务名，默认日志文件为 <日志目录>/<service>.log
+        log_file: 日志文件路径
+        level: 根日志级别，默认取 LOG_LEVEL
+        max_bytes: 单个日志文件上限，默认取 MAX_LOG_FILE_SIZE
+        backup_count: 轮转保留的文件数，默认取 LOG_BACKUP_COUNT
+        module_levels: 按模块设置的级别，与 LOG_LEVELS 合并（LOG_LEVELS 优先）
+    """
+    global _active
+    with _setup_lock:
+        if _active is not None:
+            return _active
+
+        log_file = log_file or os.path.join(default_log_dir(), f"{service}.log")
+        os.makedirs(os.path.dirname(os.path.abspath(log_file)), exist_ok=True)
+        max_bytes = max_bytes if max_bytes is not None else int(os.getenv("MAX_LOG_FILE_SIZE", str(DEFAULT_MAX_BYTES)))
+        backup_count = backup_count if backup_count is not None else int(os.getenv("LOG_BACKUP_COUNT", str(DEFAULT_BACKUP_COUNT)))
+
+        formatter = logging.Formatter(LOG_FORMAT)
+        console = logging.StreamHandler(sys.stdout)
+        file_handler = ManagedRotatingFileHandler(
+            log_file, get_log_manager(), max_bytes=max_bytes, backup_count=backup_count,
+            max_age=float(os.getenv("LOG_MAX_AGE", str(DEFAULT_MAX_AGE))))
+        sampler = PayloadSampler(float(os.getenv("LOG_PAYLOAD_SAMPLE_RATE", "0.1")))
+        for handler in (console, file_handler):
+            handler.setFormatter(formatter)
+
+        log_queue: "queue.Queue" = queue.Queue(maxsize=int(os.getenv("LOG_QUEUE_SIZE", "10000")))
+        queue_handler = _DroppingQueueHandler(log_queue)
+        # 抽样在入队前进行，被丢弃的调试内容不占用队列
+        queue_handler.addFilter(sampler)
+        listener = QueueListener(log_queue, console, file_handler, respect_handler_level=True)
+
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(queue_handler)
+        root.setLevel((level or os.getenv("LOG_LEVEL", "INFO")).upper())
+
+        levels = dict(module_levels or {})
+        levels.update(parse_module_levels(os.getenv("LOG_LEVELS", "")))
+        for name, module_level in levels.items():
+            logging.getLogger(name).setLevel(module_level)
+
+        listener.start()
+        _active = AsyncLogging(queue_handler, listener, sampler, log_file, max_bytes, backup_count)
+        atexit.register(_active.stop)
+        global _fork_spec
+        _fork_spec = {"log_file": log_file, "max_bytes": max_bytes, "backup_count": backup_count,
+                      "sample_rate": sampler.rate}
+        return _active
+
+
+def get_async_logging() -> Optional[AsyncLogging]:
+    return _active
+
+
+# ===== fork =====
+# fork只复制调用线程：子进程继承的QueueHandler没有监听线程，日志会堆积在队列中直到丢弃；
+# 监听线程恰好持有队列锁时fork，子进程写日志还会死锁
+
+def worker_log_file(log_file: str, pid: int) -> str:
+    """fork出的子进程的日志文件名；不以 "<service>." 开头，不会被当作主日志轮转出的分段清理"""
+    base, ext = os.path.splitext(log_file)
+    return f"{base}-worker-{pid}{ext}"
+
+
+def _before_fork():
+    global _fork_held_queue
+    if _active is not None and not _active._stopped:
+        # 持有队列锁完成fork，子进程中的队列不会处于被其他线程锁住的状态
+        _fork_held_queue = _active.handler.queue
+        _fork_held_queue.mutex.acquire()
+
+
+def _after_fork_in_parent():
+    global _fork_held_queue
+    if _fork_held_queue is not None:
+        _fork_held_queue.mutex.release()
+        _fork_held_queue = None
+
+
+def _after_fork_in_child():
+    """子进程：移除继承的队列handler，改为同步写入控制台和 <service>-worker-<pid>.log（不创建线程，子进程可以继续fork）"""
+    global _active, _setup_lock, _fork_held_queue
+    _setup_lock = threading.Lock()
+    _fork_held_queue = None
+    if _fork_spec is None:
+        return
+
+    root = logging.getLogger()
+    inherited = list(_fork_handlers)
+    if _active is not None:
+        inherited.append(_active.handler)
+    for handler in inherited:
+        root.removeHandler(handler)
+    _active = None
+
+    formatter = logging.Formatter(LOG_FORMAT)
+    sampler = PayloadSampler(_fork_spec["sample_rate"])
+    file_handler = RotatingFileHandler(
+        worker_log_file(_fork_spec["log_file"], os.getpid()), maxBytes=_fork_spec["max_bytes"],
+        backupCount=_fork_spec["backup_count"], encoding="utf-8", delay=True)
+    _fork_handlers[:] = [logging.StreamHandler(sys.stdout), file_handler]
+    for handler in _fork_handlers:
+        handler.setFormatter(formatter)
+        handler.addFilter(sampler)
+        root.addHandler(handler)
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(before=_before_fork, after_in_parent=_after_fork_in_parent,
+                        after_in_child=_after_fork_in_child)
@@ -0,0 +1,450 @@
+#!/usr/bin/env python3
+"""
+日志管理器
+每次启动对应一个运行（run），日志写入 <日志根目录>/runs/<运行ID>/，保留最近 N 次运行供事后排查；
+日志文件按大小或时间轮转，轮转出的分段和之前运行遗留的日志由后台线程压缩为 .gz，
+所有运行的日志总量超过磁盘预算时从最早的运行开始删除
+
+由启动脚本创建运行后，运行ID通过环境变量 RNA_RUN_ID 传给各服务子进程，子进程写入同一目录；
+单独启动的服务会各自创建运行
+
+环境变量：
+    LOG_ROOT             日志根目录，默认 Rna/logs
+    LOG_KEEP_RUNS        保留最近的运行数，默认 10
+    LOG_MAX_TOTAL_SIZE   所有运行日志的总大小上限（字节），默认 1GB
+    LOG_MAX_AGE          单个日志分段的最长时间（秒），超过后轮转，默认 86400，0 表示只按大小轮转
+    RNA_RUN_ID           当前运行ID（由启动脚本设置）
+"""
+
+import os
+import re
+import gzip
+import json
+import time
+import queue
+import atexit
+import shutil
+import socket
+import logging
+import threading
+from pathlib import Path
+from datetime import datetime
+from logging.handlers import RotatingFileHandler
+from typing import Any, Callable, Dict, List, Optional, Union
+
+RUN_ID_ENV = "RNA_RUN_ID"
+RUN_META_FILE = "run.json"
+
+DEFAULT_KEEP_RUNS = 10
+DEFAULT_MAX_TOTAL_SIZE = 1024 * 1024 * 1024
+DEFAULT_MAX_AGE = 24 * 3600
+
+logger = logging.getLogger(__name__)
+
+
+def new_run_id() -> str:
+    """按启动时间生成运行ID（按名称排序即按时间排序）"""
+    return f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{os.getpid()}"
+
+
+def _pid_alive(pid: Optional[int]) -> bool:
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    except OSError:
+        return False
+    return True
+
+
+def _dir_size(path: Path) -> int:
+    """运行目录是平铺的，只扫描一层"""
+    total = 0
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_file(follow_symlinks=False):
+                    total += entry.stat(follow_symlinks=False).st_size
+    except FileNotFoundError:
+        pass
+    return total
+
+
+class LogManager:
+    """按运行组织日志目录，后台压缩归档并执行保留策略和磁盘预算"""
+
+    def __init__(self, root: Union[str, Path], keep_runs: int = DEFAULT_KEEP_RUNS,
+                 max_total_bytes: int = DEFAULT_MAX_TOTAL_SIZE):
+        """
+        Args:
+            root: 日志根目录，运行目录位于 <root>/runs/<运行ID>
+            keep_runs: 保留最近的运行数（包括当前运行）
+            max_total_bytes: 所有运行日志的总大小上限，0 表示不限制
+        """
+        self.root = Path(root)
+        self.runs_dir = self.root / "runs"
+        self.keep_runs = max(1, keep_runs)
+        self.max_total_bytes = max_total_bytes
+
+        self.run_id: Optional[str] = None
+        self._owns_run = False
+        self._finished = False
+        self._lock = threading.Lock()
+        self._queue: "queue.Queue[Any]" = queue.Queue()
+        self._worker: Optional[threading.Thread] = None
+        self.stats = {"compressed": 0, "bytes_saved": 0, "deleted_runs": 0,
+                      "deleted_segments": 0, "deleted_bytes": 0, "errors": 0}
+
+    # ===== 运行 =====
+
+    def run_dir(self, run_id: Optional[str] = None) -> Path:
+        return self.runs_dir / (run_id or self.current_run_id())
+
+    def current_run_id(self) -> str:
+        """当前运行ID：已通过 RNA_RUN_ID 指定时加入该运行，否则为本进程创建新运行"""
+        if self.run_id is None:
+            run_id = os.getenv(RUN_ID_ENV)
+            if run_id:
+                self.join_run(run_id)
+            else:
+                self.start_run()
+        return self.run_id
+
+    def start_run(self, run_id: Optional[str] = None, **metadata) -> str:
+        """创建新运行（进程内只生效一次）；之前运行的归档和清理在后台进行"""
+        with self._lock:
+            if self.run_id is not None:
+                return self.run_id
+            run_id = run_id or new_run_id()
+            run_dir = self.runs_dir / run_id
+            run_dir.mkdir(parents=True, exist_ok=True)
+            self._write_meta(run_dir, {
+                "run_id": run_id,
+                "started_at": datetime.now().isoformat(timespec="seconds"),
+                "pid": os.getpid(),
+                "host": socket.gethostname(),
+                "status": "running",
+                **metadata
+            })
+            self.run_id = run_id
+            self._owns_run = True
+            # 子进程继承环境变量，写入同一运行目录
+            os.environ[RUN_ID_ENV] = run_id
+
+        atexit.register(self.finish_run)
+        self.submit(self.archive_previous_runs)
+        return run_id
+
+    def join_run(self, run_id: str):
+        """加入其他进程创建的运行（不负责更新运行状态）"""
+        with self._lock:
+            if self.run_id is not None:
+                return
+            (self.runs_dir / run_id).mkdir(parents=True, exist_ok=True)
+            self.run_id = run_id
+
+    def finish_run(self, status: str = "finished"):
+        """记录当前运行的结束时间和状态（只有创建运行的进程会写入，重复调用只生效一次）"""
+        with self._lock:
+            if not self._owns_run or self._finished:
+                return
+            self._finished = True
+        run_dir = self.runs_dir / self.run_id
+        meta = self._read_meta(run_dir)
+        meta.update({
+            "ended_at": datetime.now().isoformat(timespec="seconds"),
+            "status": status,
+            "bytes": _dir_size(run_dir)
+        })
+        self._write_meta(run_dir, meta)
+
+    def list_runs(self) -> List[Dict[str, Any]]:
+        """最近的运行（新的在前），包括每次运行的日志文件和占用空间"""
+        runs = []
+        for run_dir in self._run_dirs(newest_first=True):
+            meta = self._read_meta(run_dir)
+            meta.setdefault("run_id", run_dir.name)
+            meta["path"] = str(run_dir)
+            meta["bytes"] = _dir_size(run_dir)
+            meta["files"] = sorted(p.name for p in run_dir.iterdir() if p.name != RUN_META_FILE)
+            runs.append(meta)
+        return runs
+
+    def _run_dirs(self, newest_first: bool = False) -> List[Path]:
+        try:
+            dirs = [p for p in self.runs_dir.iterdir() if p.is_dir()]
+        except FileNotFoundError:
+            return []
+        return sorted(dirs, key=lambda p: p.name, reverse=newest_first)
+
+    @staticmethod
+    def _read_meta(run_dir: Path) -> Dict[str, Any]:
+        try:
+            with open(run_dir / RUN_META_FILE, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    @staticmethod
+    def _write_meta(run_dir: Path, meta: Dict[str, Any]):
+        tmp_path = run_dir / f"{RUN_META_FILE}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, run_dir / RUN_META_FILE)
+
+    def _is_active(self, run_dir: Path) -> bool:
+        """当前运行，或创建它的进程仍在运行"""
+        if run_dir.name == self.run_id:
+            return True
+        meta = self._read_meta(run_dir)
+        return meta.get("status") == "running" and _pid_alive(meta.get("pid"))
+
+    # ===== 后台压缩 =====
+
+    def submit(self, task: Union[str, Path, Callable[[], None]]):
+        """交给后台线程处理：文件路径表示压缩该文件，可调用对象直接执行"""
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run_worker, name="rna-log-manager", daemon=True)
+                self._worker.start()
+        self._queue.put(task)
+
+    def compress_async(self, path: Union[str, Path]):
+        self.submit(Path(path))
+
+    def _run_worker(self):
+        while True:
+            task = self._queue.get()
+            if task is None:
+                return
+            try:
+                if callable(task):
+                    task()
+                else:
+                    self.compress(task)
+                    self.enforce_budget()
+            except Exception as e:
+                self.stats["errors"] += 1
+                logger.warning(f"⚠️ [日志管理] 后台任务失败: {e}")
+
+    def compress(self, path: Path) -> Optional[Path]:
+        """压缩为 <文件名>.gz 并删除原文件（先写临时文件，中途退出不会留下损坏的归档）"""
+        target = path.with_name(path.name + ".gz")
+        tmp_path = path.with_name(path.name + ".gz.tmp")
+        try:
+            original_size = path.stat().st_size
+            with open(path, "rb") as src, gzip.open(tmp_path, "wb", compresslevel=6) as dst:
+                shutil.copyfileobj(src, dst, 1024 * 1024)
+            os.replace(tmp_path, target)
+            os.remove(path)
+        except FileNotFoundError:
+            # 压缩前已被保留策略删除
+            tmp_path.unlink(missing_ok=True)
+            return None
+        self.stats["compressed"] += 1
+        self.stats["bytes_saved"] += original_size - target.stat().st_size
+        return target
+
+    def archive_previous_runs(self):
+        """执行保留策略，然后压缩保留下来的之前运行的未压缩日志，并标记异常退出的运行"""
+        self.prune_runs()
+        for run_dir in self._run_dirs():
+            if self._is_active(run_dir):
+                continue
+            meta = self._read_meta(run_dir)
+            if meta.get("status") == "running":
+                # 进程已不存在却没有记录结束：崩溃或被强制终止
+                meta["status"] = "interrupted"
+                self._write_meta(run_dir, meta)
+            for path in run_dir.iterdir():
+                if path.suffix == ".tmp":
+                    path.unlink(missing_ok=True)
+                elif path.is_file() and path.name != RUN_META_FILE and path.suffix != ".gz":
+                    self.compress(path)
+        self.enforce_budget()
+
+    # ===== 保留策略 =====
+
+    def _delete_run(self, run_dir: Path):
+        size = _dir_size(run_dir)
+        shutil.rmtree(run_dir, ignore_errors=True)
+        self.stats["deleted_runs"] += 1
+        self.stats["deleted_bytes"] += size
+        logger.info(f"🗑️ [日志管理] 删除旧运行日志 {run_dir.name} ({size / 1024:.1f} KB)")
+
+    def prune_runs(self):
+        """只保留最近 keep_runs 次运行（仍在运行的不删除）"""
+        run_dirs = self._run_dirs(newest_first=True)
+        for run_dir in run_dirs[self.keep_runs:]:
+            if not self._is_active(run_dir):
+                self._delete_run(run_dir)
+
+    def enforce_budget(self):
+        """总大小超过预算时，先删除最早的已结束运行，仍超出时删除活动运行中最早的已压缩分段"""
+        if self.max_total_bytes <= 0:
+            return
+        run_dirs = self._run_dirs()
+        sizes = {run_dir: _dir_size(run_dir) for run_dir in run_dirs}
+        total = sum(sizes.values())
+        if total <= self.max_total_bytes:
+            return
+
+        for run_dir in run_dirs:
+            if total <= self.max_total_bytes:
+                return
+            if not self._is_active(run_dir):
+                self._delete_run(run_dir)
+                total -= sizes[run_dir]
+
+        segments = []
+        for run_dir in run_dirs:
+            if run_dir.exists():
+                for path in run_dir.iterdir():
+                    if path.suffix == ".gz":
+                        stat = path.stat()
+                        segments.append((stat.st_mtime, stat.st_size, path))
+        for _, size, path in sorted(segments):
+            if total <= self.max_total_bytes:
+                return
+            path.unlink(missing_ok=True)
+            total -= size
+            self.stats["deleted_segments"] += 1
+            self.stats["deleted_bytes"] += size
+
+    def stop(self, timeout: float = 10.0):
+        """等待已提交的压缩完成（超时后剩余文件由下次启动归档）"""
+        worker = self._worker
+        if worker is not None and worker.is_alive():
+            self._queue.put(None)
+            worker.join(timeout)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {"run_id": self.run_id, "root": str(self.root), "pending": self._queue.qsize(), **self.stats}
+
+
+class ManagedRotatingFileHandler(RotatingFileHandler):
+    """按大小或时间轮转；轮转出的分段命名为 <文件名>.<时间>.log，交给日志管理器后台压缩"""
+
+    def __init__(self, filename: str, manager: LogManager, max_bytes: int = 0, max_age: float = 0,
+                 backup_count: int = 0, encoding: Optional[str] = "utf-8"):
+        """
+        Args:
+            max_bytes: 单个分段的大小上限，0 表示不按大小轮转
+            max_age: 单个分段的最长时间（秒），0 表示不按时间轮转
+            backup_count: 保留的历史分段数，0 表示不限制（由磁盘预算控制）
+        """
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count, encoding=encoding)
+        self.manager = manager
+        self.max_age = max_age
+        self._opened_at = time.time()
+        self._sequence = 0
+
+    def shouldRollover(self, record: logging.LogRecord) -> bool:
+        if self.max_age > 0 and time.time() - self._opened_at >= self.max_age:
+            return True
+        return bool(super().shouldRollover(record))
+
+    def _segment_prefix(self) -> str:
+        return os.path.splitext(self.baseFilename)[0] + "."
+
+    def doRollover(self):
+        if self.stream:
+            self.stream.close()
+            self.stream = None
+
+        if os.path.exists(self.baseFilename) and os.path.getsize(self.baseFilename) > 0:
+            self._sequence += 1
+            segment = f"{self._segment_prefix()}{datetime.now().strftime('%Y%m%d-%H%M%S')}-{self._sequence:03d}.log"
+            os.replace(self.baseFilename, segment)
+            self.manager.compress_async(segment)
+            self._prune_segments()
+
+        if not self.delay:
+            self.stream = self._open()
+        self._opened_at = time.time()
+
+    def _prune_segments(self):
+        if self.backupCount <= 0:
+            return
+        # 只匹配 doRollover 生成的 <文件名>.<时间>-<序号>.log[.gz]，同目录下其他同名前缀的日志（如子进程日志）不受影响；
+        # 分段名中的时间可排序，压缩中的 .gz.tmp 不统计
+        pattern = re.compile(re.escape(os.path.basename(self._segment_prefix())) + r"\d{8}-\d{6}-\d{3,}\.log(\.gz)?$")
+        directory = os.path.dirname(self.baseFilename)
+        segments = sorted(
+            os.path.join(directory, name) for name in os.listdir(directory) if pattern.match(name)
+        )
+        for path in segments[:-self.backupCount]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+_manager: Optional[LogManager] = None
+_manager_lock = threading.Lock()
+
+
+def _reinit_after_fork():
+    """子进程：父进程的后台线程没有被复制，重置锁和任务队列，需要时重新启动后台线程"""
+    global _manager_lock
+    _manager_lock = threading.Lock()
+    if _manager is not None:
+        _manager._lock = threading.Lock()
+        _manager._queue = queue.Queue()
+        _manager._worker = None
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reinit_after_fork)
+
+
+def default_log_root() -> str:
+    return os.getenv("LOG_ROOT") or os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "logs")
+
+
+def get_log_manager() -> LogManager:
+    """进程内共享的日志管理器（按环境变量配置）"""
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = LogManager(
+                default_log_root(),
+                keep_runs=int(os.getenv("LOG_KEEP_RUNS", str(DEFAULT_KEEP_RUNS))),
+                max_total_bytes=int(os.getenv("LOG_MAX_TOTAL_SIZE", str(DEFAULT_MAX_TOTAL_SIZE)))
+            )
+            atexit.register(_manager.stop)
+        return _manager
+
+
+def main():
+    """命令行入口：查看最近的运行（python -m log_management）"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="RnAgent日志管理器")
+    parser.add_argument("--root", type=str, help="日志根目录")
+    parser.add_argument("--json", action="store_true", help="以JSON格式输出")
+    args = parser.parse_args()
+
+    manager = LogManager(args.root or default_log_root())
+    runs = manager.list_runs()
+    if args.json:
+        print(json.dumps(runs, ensure_ascii=False, indent=2))
+        return
+
+    if not runs:
+        print(f"📭 {manager.runs_dir} 下没有运行记录")
+        return
+    print(f"📚 最近 {len(runs)} 次运行 ({manager.runs_dir}):")
+    for run in runs:
+        print(f"  {run['run_id']}  {run.get('status', '?'):<12} {run['bytes'] / 1024:>10.1f} KB  "
+              f"{run.get('started_at', '')} → {run.get('ended_at', '')}")
+        for name in run["files"]:
+            print(f"      {name}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+RnAgent可观测性模块
+提供跨前端、智能体核心和MCP后端的请求追踪和Prometheus指标
+"""
+
+from .metrics import (
+    CONTENT_TYPE as METRICS_CONTENT_TYPE,
+    FIGURE_RENDER,
+    HTTP_LATENCY,
+    HTTP_REQUESTS,
+    LLM_CALLS,
+    LLM_LATENCY,
+    LLM_TOKENS,
+    REGISTRY,
+    REPL_EXECUTIONS,
+    REPL_LATENCY,
+    TOOL_CALLS,
+    TOOL_LATENCY,
+    http_route,
+    observe_http_request,
+    register_cache_metrics,
+    render_metrics,
+    start_metrics_server,
+)
+from .tracing import (
+    REQUEST_ID_HEADER,
+    continue_trace,
+    get_request_id,
+    get_tracer,
+    init_tracing,
+    inject_headers,
+    span,
+    traced,
+)
+
+__all__ = [
+    'METRICS_CONTENT_TYPE',
+    'FIGURE_RENDER',
+    'HTTP_LATENCY',
+    'HTTP_REQUESTS',
+    'LLM_CALLS',
+    'LLM_LATENCY',
+    'LLM_TOKENS',
+    'REGISTRY',
+    'REPL_EXECUTIONS',
+    'REPL_LATENCY',
+    'TOOL_CALLS',
+    'TOOL_LATENCY',
+    'http_route',
+    'observe_http_request',
+    'register_cache_metrics',
+    'render_metrics',
+    'start_metrics_server',
+    'REQUEST_ID_HEADER',
+    'continue_trace',
+    'get_request_id',
+    'get_tracer',
+    'init_tracing',
+    'inject_headers',
+    'span',
+    'traced',
+]
@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+"""
+RnAgent 可观测性 - Prometheus指标
+不依赖 prometheus_client：计数器、仪表和直方图在进程内累加，
+/metrics 接口按 Prometheus 文本格式（0.0.4）输出；
+已有的 get_stats() 统计通过回调指标在抓取时读取，不需要改动原有组件
+"""
+
+import math
+import time
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Sequence, Tuple, Union
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# 覆盖毫秒级的缓存命中到数分钟的完整分析
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+LabelValues = Tuple[str, ...]
+Sample = Tuple[str, Dict[str, str], float]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if math.isnan(value):
+        return "NaN"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(str(v))}"' for k, v in labels.items()) + "}"
+
+
+class _Metric:
+    """指标基类：按标签值分别保存数值"""
+
+    type = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, Any]) -> LabelValues:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"指标 {self.name} 需要标签 {self.labelnames}，实际为 {tuple(labels)}")
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def _labels(self, key: LabelValues) -> Dict[str, str]:
+        return dict(zip(self.labelnames, key))
+
+    def samples(self) -> Iterable[Sample]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """只增不减的计数器"""
+
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def samples(self) -> Iterable[Sample]:
+        with self._lock:
+            items = list(self._values.items())
+        return [(f"{self.name}_total", self._labels(k), v) for k, v in items]
+
+
+class Gauge(_Metric):
+    """可增可减的当前值"""
+
+    type = "gauge"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+    def samples(self) -> Iterable[Sample]:
+        with self._lock:
+            items = list(self._values.items())
+        return [(self.name, self._labels(k), v) for k, v in items]
+
+
+class Histogram(_Metric):
+    """延迟直方图（累积桶 + 总和 + 次数），p95等分位数由Prometheus端计算"""
+
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # 标签值 -> [各桶计数..., 总和, 次数]（桶计数不累积，输出时再累加）
+        self._values: Dict[LabelValues, List[float]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                index = i
+                break
+        with self._lock:
+            data = self._values.get(key)
+            if data is None:
+                data = self._values[key] = [0.0] * (len(self.buckets) + 3)
+            data[index] += 1
+            data[-2] += value
+            data[-1] += 1
+
+    @contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        """记录代码块耗时（秒），异常时同样记录"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self) -> Iterable[Sample]:
+        with self._lock:
+            items = [(k, list(v)) for k, v in self._values.items()]
+        result: List[Sample] = []
+        for key, data in items:
+            labels = self._labels(key)
+            cumulative = 0.0
+            for bound, count in zip(self.buckets + (math.inf,), data):
+                cumulative += count
+                result.append((f"{self.name}_bucket", dict(labels, le=_format_value(bound)), cumulative))
+            result.append((f"{self.name}_sum", labels, data[-2]))
+            result.append((f"{self.name}_count", labels, data[-1]))
+        return result
+
+
+class CallbackMetric(_Metric):
+    """抓取时调用回调读取数值，用于接入已有的 get_stats() 统计
+
+    回调返回单个数值（无标签），或 {标签值元组: 数值}
+    """
+
+    def __init__(self, name: str, help: str, type: str,
+                 callback: Callable[[], Union[float, Dict[LabelValues, float]]],
+                 labelnames: Sequence[str] = ()):
+        super().__init__(name, help, labelnames)
+        self.type = type
+        self.callback = callback
+
+    def samples(self) -> Iterable[Sample]:
+        values = self.callback()
+        sample_name = f"{self.name}_total" if self.type == "counter" else self.name
+        if not isinstance(values, dict):
+            return [(sample_name, {}, float(values))]
+        return [(sample_name, self._labels(tuple(str(v) for v in key)), float(value))
+                for key, value in values.items()]
+
+
+class MetricsRegistry:
+    """指标注册表；同名指标重复注册时返回已有对象"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+        self.collect_errors = 0
+
+    def _register(self, metric: _Metric, replace: bool = False) -> Any:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None and not replace:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, help, labelnames))
+
+    def gauge(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help, labelnames, buckets))
+
+    def callback(self, name: str, help: str, callback: Callable[[], Any],
+                 labelnames: Sequence[str] = (), type: str = "gauge") -> CallbackMetric:
+        """注册回调指标（同名时替换为新的回调）"""
+        return self._register(CallbackMetric(name, help, type, callback, labelnames), replace=True)
+
+    def render(self) -> str:
+        """Prometheus文本格式；单个回调出错时跳过该指标，不影响其他指标"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+
+        lines: List[str] = []
+        for metric in metrics:
+            try:
+                samples = list(metric.samples())
+            except Exception as e:
+                self.collect_errors += 1
+                lines.append(f"# 采集 {metric.name} 失败: {_escape(str(e))}")
+                continue
+            lines.append(f"# HELP {metric.name} {_escape(metric.help)}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for sample_name, labels, value in samples:
+                lines.append(f"{sample_name}{_format_labels(labels)} {_format_value(value)}")
+        lines.append("")
+        return "\n".join(lines)
+
+
+REGISTRY = MetricsRegistry()
+
+
+def render_metrics() -> str:
+    return REGISTRY.render()
+
+
+# ===== 各服务共用的指标（名称一致，便于按服务汇总和告警） =====
+
+HTTP_REQUESTS = REGISTRY.counter(
+    "rna_http_requests", "HTTP请求数", ("method", "route", "status"))
+HTTP_LATENCY = REGISTRY.histogram(
+    "rna_http_request_duration_seconds", "HTTP请求耗时", ("method", "route"))
+TOOL_CALLS = REGISTRY.counter(
+    "rna_tool_calls", "MCP工具调用次数", ("tool", "status"))
+TOOL_LATENCY = REGISTRY.histogram(
+    "rna_tool_call_duration_seconds", "MCP工具调用耗时", ("tool",))
+LLM_CALLS = REGISTRY.counter(
+    "rna_llm_calls", "大模型调用次数", ("model", "status"))
+LLM_LATENCY = REGISTRY.histogram(
+    "rna_llm_call_duration_seconds", "大模型调用耗时", ("model",))
+LLM_TOKENS = REGISTRY.counter(
+    "rna_llm_tokens", "大模型token用量", ("model", "direction"))
+REPL_EXECUTIONS = REGISTRY.counter(
+    "rna_repl_executions", "Python代码执行次数", ("mode", "status"))
+REPL_LATENCY = REGISTRY.histogram(
+    "rna_repl_execution_duration_seconds", "Python代码执行耗时", ("mode",))
+FIGURE_RENDER = REGISTRY.histogram(
+    "rna_figure_render_duration_seconds", "图表渲染和保存耗时", ("kind",))
+
+
+def http_route(scope: Dict[str, Any]) -> str:
+    """请求匹配到的路由模板（如 /api/jobs/{job_id}），避免按原始路径产生过多标签值"""
+    route = scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
+
+
+def observe_http_request(method: str, scope: Dict[str, Any], seconds: float, status: int):
+    """记录一次HTTP请求的耗时和状态码
+
+    需在请求处理完成后调用：路由匹配之后 scope 中才有 route，之前调用会全部记为 unmatched
+    """
+    route = http_route(scope)
+    HTTP_LATENCY.observe(seconds, method=method, route=route)
+    HTTP_REQUESTS.inc(method=method, route=route, status=status)
+
+
+def register_cache_metrics(tiers: Callable[[], Dict[str, Dict[str, Any]]]):
+    """按缓存层级导出命中/未命中次数；tiers 返回 {层级: 含 hits/misses 的统计字典}"""
+    def collect(field: str) -> Dict[LabelValues, float]:
+        return {(tier,): stats.get(field, 0) for tier, stats in tiers().items()}
+
+    REGISTRY.callback("rna_cache_hits", "缓存命中次数", lambda: collect("hits"), ("tier",), type="counter")
+    REGISTRY.callback("rna_cache_misses", "缓存未命中次数", lambda: collect("misses"), ("tier",), type="counter")
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render_metrics().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port: int, host: str = "0.0.0.0") -> ThreadingHTTPServer:
+    """在后台线程中单独提供 /metrics（用于无法挂载自定义路由的服务）"""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="rna-metrics", daemon=True).start()
+    return server
@@ -0,0 +1,453 @@
+#!/usr/bin/env python3
+"""
+RnAgent 可观测性 - 分阶段耗时追踪
+前端、智能体核心和MCP后端共用：每个请求一个追踪ID（同时作为请求ID），
+通过 X-Request-ID / traceparent 请求头在各层之间传递；每个阶段记录一个span，
+包含墙钟耗时、线程CPU时间、RSS变化和传输字节数，导出为本地JSONL文件
+或发送到兼容OpenTelemetry的采集器（OTLP/HTTP JSON）
+
+环境变量：
+    RNA_TRACE_EXPORTER   none（默认）| jsonl | otlp | jsonl,otlp
+    RNA_TRACE_FILE       JSONL文件路径，默认为当前运行日志目录下的 traces.jsonl
+    OTEL_EXPORTER_OTLP_ENDPOINT  采集器地址，默认 http://localhost:4318
+"""
+
+import os
+import json
+import time
+import queue
+import atexit
+import asyncio
+import functools
+import threading
+import urllib.request
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, List, Mapping, MutableMapping, Optional
+
+try:
+    import psutil
+    _process = psutil.Process(os.getpid())
+except ImportError:
+    psutil = None
+    _process = None
+
+REQUEST_ID_HEADER = "X-Request-ID"
+TRACEPARENT_HEADER = "traceparent"
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def _rss_bytes() -> Optional[int]:
+    """当前进程常驻内存（字节），无法获取时返回None"""
+    if _process is not None:
+        try:
+            return _process.memory_info().rss
+        except Exception:
+            return None
+    try:
+        with open("/proc/self/statm", "rb") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _new_trace_id() -> str:
+    return os.urandom(16).hex()
+
+
+def _new_span_id() -> str:
+    return os.urandom(8).hex()
+
+
+def _is_hex(value: str, length: int) -> bool:
+    if len(value) != length:
+        return False
+    try:
+        int(value, 16)
+    except ValueError:
+        return False
+    return True
+
+
+class SpanContext:
+    """跨进程传递的追踪上下文（来自请求头的远程父span）"""
+
+    __slots__ = ("trace_id", "span_id", "request_id")
+
+    def __init__(self, trace_id: str, span_id: Optional[str], request_id: str):
+        self.trace_id = trace_id
+        self.span_id = span_id
+        self.request_id = request_id
+
+
+class Span(SpanContext):
+    """一个阶段的耗时记录"""
+
+    __slots__ = ("name", "service", "parent_id", "start_time", "attributes", "status",
+                 "error", "duration_ms", "cpu_ms", "rss_delta_kb", "_t0", "_cpu0", "_rss0")
+
+    recording = True
+
+    def __init__(self, name: str, service: str, parent: Optional[SpanContext],
+                 request_id: Optional[str], attributes: Dict[str, Any]):
+        if parent is not None:
+            trace_id, parent_id, request_id = parent.trace_id, parent.span_id, parent.request_id
+        else:
+            trace_id = request_id if request_id and _is_hex(request_id, 32) else _new_trace_id()
+            parent_id = None
+            request_id = request_id or trace_id
+        super().__init__(trace_id, _new_span_id(), request_id)
+        self.name = name
+        self.service = service
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.status = "ok"
+        self.error: Optional[str] = None
+        self.duration_ms = 0.0
+        self.cpu_ms = 0.0
+        self.rss_delta_kb: Optional[float] = None
+        self.start_time = time.time()
+        self._t0 = time.perf_counter()
+        self._cpu0 = time.thread_time()
+        self._rss0 = _rss_bytes()
+
+    def set(self, **attributes):
+        """添加属性（如模型名、工具名、消息数）"""
+        self.attributes.update(attributes)
+
+    def add_bytes(self, sent: int = 0, received: int = 0):
+        """累加本阶段发送/接收的字节数"""
+        if sent:
+            self.attributes["bytes_sent"] = self.attributes.get("bytes_sent", 0) + sent
+        if received:
+            self.attributes["bytes_received"] = self.attributes.get("bytes_received", 0) + received
+
+    def _finish(self):
+        self.duration_ms = (time.perf_counter() - self._t0) * 1000
+        # 线程CPU时间：跨越await时包含同一事件循环线程上其他任务的CPU时间
+        self.cpu_ms = (time.thread_time() - self._cpu0) * 1000
+        rss = _rss_bytes()
+        if rss is not None and self._rss0 is not None:
+            self.rss_delta_kb = (rss - self._rss0) / 1024
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "request_id": self.request_id,
+            "service": self.service,
+            "name": self.name,
+            "start_time": self.start_time,
+            "duration_ms": round(self.duration_ms, 3),
+            "cpu_ms": round(self.cpu_ms, 3),
+            "rss_delta_kb": round(self.rss_delta_kb, 1) if self.rss_delta_kb is not None else None,
+            "status": self.status,
+            "error": self.error,
+            "attributes": self.attributes
+        }
+
+
+class _NoopSpan:
+    """追踪关闭时使用，所有操作为空"""
+
+    recording = False
+    trace_id = span_id = request_id = None
+
+    def set(self, **attributes):
+        pass
+
+    def add_bytes(self, sent: int = 0, received: int = 0):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+# 当前span（或来自请求头的远程上下文）和当前请求ID
+_current: ContextVar[Optional[SpanContext]] = ContextVar("rna_current_span", default=None)
+_request_id: ContextVar[Optional[str]] = ContextVar("rna_request_id", default=None)
+
+
+class JsonlExporter:
+    """每个span写一行JSON，多个服务可以写同一个文件"""
+
+    def __init__(self, path: str):
+        self.path = os.path.abspath(path)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._lock = threading.Lock()
+
+    def export(self, spans: List[Span]):
+        lines = "".join(json.dumps(s.to_dict(), ensure_ascii=False, default=str) + "\n" for s in spans)
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(lines)
+
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+class OTLPHttpExporter:
+    """以OTLP/HTTP JSON格式发送到OpenTelemetry采集器（不依赖opentelemetry SDK）"""
+
+    def __init__(self, endpoint: str, timeout: float = 5.0):
+        endpoint = endpoint.rstrip("/")
+        self.url = endpoint if endpoint.endswith("/v1/traces") else f"{endpoint}/v1/traces"
+        self.timeout = timeout
+
+    def _encode(self, spans: List[Span]) -> bytes:
+        by_service: Dict[str, List[Dict[str, Any]]] = {}
+        for s in spans:
+            attributes = dict(s.attributes, request_id=s.request_id, cpu_ms=round(s.cpu_ms, 3))
+            if s.rss_delta_kb is not None:
+                attributes["rss_delta_kb"] = round(s.rss_delta_kb, 1)
+            start_ns = int(s.start_time * 1e9)
+            item = {
+                "traceId": s.trace_id,
+                "spanId": s.span_id,
+                "name": s.name,
+                "kind": 1,
+                "startTimeUnixNano": str(start_ns),
+                "endTimeUnixNano": str(start_ns + int(s.duration_ms * 1e6)),
+                "attributes": [{"key": k, "value": _otlp_value(v)}
+                               for k, v in attributes.items() if v is not None],
+                "status": {"code": 2, "message": s.error or ""} if s.status == "error" else {"code": 1}
+            }
+            if s.parent_id:
+                item["parentSpanId"] = s.parent_id
+            by_service.setdefault(s.service, []).append(item)
+
+        payload = {"resourceSpans": [
+            {
+                "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": service}}]},
+                "scopeSpans": [{"scope": {"name": "rna.observability"}, "spans": items}]
+            }
+            for service, items in by_service.items()
+        ]}
+        return json.dumps(payload, default=str).encode("utf-8")
+
+    def export(self, spans: List[Span]):
+        request = urllib.request.Request(
+            self.url, data=self._encode(spans), headers={"Content-Type": "application/json"}, method="POST"
+        )
+        with urllib.request.urlopen(request, timeout=self.timeout):
+            pass
+
+
+class Tracer:
+    """span记录器
+
+    结束的span放入有界队列，由后台线程批量导出，请求路径上只有一次入队操作；
+    队列满时丢弃新span（计入 dropped），不阻塞请求
+    """
+
+    def __init__(self, service: str, exporters: Optional[List[Any]] = None,
+                 queue_size: int = 10000, batch_size: int = 256, flush_interval: float = 2.0):
+        self.service = service
+        self.exporters = exporters or []
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.exported = 0
+        self.dropped = 0
+        self.export_errors = 0
+        self._queue: "queue.Queue[Span]" = queue.Queue(maxsize=queue_size)
+        self._thread: Optional[threading.Thread] = None
+        if self.exporters:
+            self._thread = threading.Thread(target=self._run, name="rna-trace-export", daemon=True)
+            self._thread.start()
+            atexit.register(self.flush)
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.exporters)
+
+    @contextmanager
+    def span(self, name: str, **attributes) -> Iterator[Any]:
+        """记录一个阶段；异常会标记到span上并继续抛出"""
+        if not self.exporters:
+            yield NOOP_SPAN
+            return
+
+        _span = Span(name, self.service, _current.get(), _request_id.get(), attributes)
+        token = _current.set(_span)
+        rid_token = _request_id.set(_span.request_id)
+        try:
+            yield _span
+        except BaseException as e:
+            _span.status = "error"
+            _span.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            _request_id.reset(rid_token)
+            _current.reset(token)
+            _span._finish()
+            try:
+                self._queue.put_nowait(_span)
+            except queue.Full:
+                self.dropped += 1
+
+    def _drain(self, first: Span) -> List[Span]:
+        batch = [first]
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _export(self, batch: List[Span]):
+        for exporter in self.exporters:
+            try:
+                exporter.export(batch)
+            except Exception as e:
+                self.export_errors += 1
+                if self.export_errors in (1, 10, 100) or self.export_errors % 1000 == 0:
+                    print(f"⚠️ [追踪] 导出span失败（{type(exporter).__name__}，第 {self.export_errors} 次）: {e}")
+        self.exported += len(batch)
+
+    def _run(self):
+        while True:
+            try:
+                first = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            self._export(self._drain(first))
+
+    def flush(self):
+        """导出队列中剩余的span（进程退出时调用）"""
+        while True:
+            try:
+                first = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            self._export(self._drain(first))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "service": self.service,
+            "enabled": self.enabled,
+            "exporters": [type(e).__name__ for e in self.exporters],
+            "queued": self._queue.qsize(),
+            "exported": self.exported,
+            "dropped": self.dropped,
+            "export_errors": self.export_errors
+        }
+
+
+_tracer: Optional[Tracer] = None
+
+
+def init_tracing(service: str) -> Tracer:
+    """按环境变量创建本进程的全局追踪器（每个服务启动时调用一次）"""
+    global _tracer
+    if _tracer is not None:
+        return _tracer
+
+    exporters: List[Any] = []
+    kinds = {k.strip().lower() for k in os.getenv("RNA_TRACE_EXPORTER", "none").split(",")}
+    if "jsonl" in kinds:
+        path = os.getenv("RNA_TRACE_FILE")
+        if not path:
+            from log_management.async_logging import default_log_dir
+            path = os.path.join(default_log_dir(), "traces.jsonl")
+        exporters.append(JsonlExporter(path))
+    if "otlp" in kinds:
+        exporters.append(OTLPHttpExporter(os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT", "http://localhost:4318")))
+
+    _tracer = Tracer(service, exporters)
+    if exporters:
+        print(f"🔭 [追踪] {service} 已启用span导出: {', '.join(type(e).__name__ for e in exporters)}")
+    return _tracer
+
+
+def get_tracer() -> Tracer:
+    """获取全局追踪器；未初始化时返回不导出的追踪器"""
+    global _tracer
+    if _tracer is None:
+        _tracer = Tracer("rna")
+    return _tracer
+
+
+def span(name: str, **attributes):
+    """在全局追踪器上记录一个阶段：with span("llm.call", model=...) as s: ..."""
+    return get_tracer().span(name, **attributes)
+
+
+def traced(name: Optional[str] = None) -> Callable:
+    """把函数（同步或异步）整体记录为一个span"""
+    def decorator(func):
+        span_name = name or func.__qualname__
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(span_name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def get_request_id() -> Optional[str]:
+    """当前请求ID（未在请求上下文中时返回None）"""
+    return _request_id.get()
+
+
+def inject_headers(headers: Optional[MutableMapping[str, str]] = None) -> MutableMapping[str, str]:
+    """把当前请求ID和span写入出站请求头"""
+    headers = {} if headers is None else headers
+    current = _current.get()
+    request_id = _request_id.get()
+    if request_id:
+        headers[REQUEST_ID_HEADER] = request_id
+    if current is not None and current.span_id:
+        headers[TRACEPARENT_HEADER] = f"00-{current.trace_id}-{current.span_id}-01"
+    return headers
+
+
+def _header(headers: Mapping[str, str], name: str) -> Optional[str]:
+    value = headers.get(name)
+    if value is None:
+        value = headers.get(name.lower())
+    return value
+
+
+@contextmanager
+def continue_trace(headers: Optional[Mapping[str, str]] = None) -> Iterator[str]:
+    """服务入口使用：从入站请求头恢复请求ID和父span，没有时生成新的请求ID
+
+    产出本次请求的请求ID
+    """
+    headers = headers or {}
+    request_id = _header(headers, REQUEST_ID_HEADER) or None
+    parent: Optional[SpanContext] = None
+
+    traceparent = _header(headers, TRACEPARENT_HEADER)
+    if traceparent:
+        parts = traceparent.split("-")
+        if len(parts) == 4 and _is_hex(parts[1], 32) and _is_hex(parts[2], 16):
+            parent = SpanContext(parts[1], parts[2], request_id or parts[1])
+
+    if request_id is None:
+        request_id = parent.trace_id if parent is not None else _new_trace_id()
+    if parent is None:
+        parent = SpanContext(request_id if _is_hex(request_id, 32) else _new_trace_id(), None, request_id)
+
+    token = _current.set(parent)
+    rid_token = _request_id.set(request_id)
+    try:
+        yield request_id
+    finally:
+        _request_id.reset(rid_token)
+        _current.reset(token)
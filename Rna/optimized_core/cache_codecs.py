@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+RNA项目优化版本 - 磁盘缓存压缩编解码器
+提供 zlib / zstd / lz4 三种可插拔编解码器，zstd和lz4为可选依赖，
+未安装时自动降级；"auto" 按数据类型分别选择（稠密数组优先lz4，其余优先zstd）
+"""
+
+import os
+import io
+import zlib
+from typing import BinaryIO, Dict, Optional
+
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    ZSTD_AVAILABLE = False
+
+try:
+    import lz4.frame
+    LZ4_AVAILABLE = True
+except ImportError:
+    LZ4_AVAILABLE = False
+
+CHUNK_SIZE = 1024 * 1024
+# 超过该大小的数据使用多线程压缩（仅zstd支持）
+MULTITHREAD_MIN_SIZE = 8 * 1024 * 1024
+
+
+class Codec:
+    """编解码器基类：按块流式压缩文件，解压到内存"""
+    name = "none"
+
+    def compress_stream(self, src: BinaryIO, dst: BinaryIO, size: int):
+        while True:
+            chunk = src.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            dst.write(chunk)
+
+    def decompress(self, src: BinaryIO) -> bytes:
+        return src.read()
+
+    def compress_to(self, path: str, dst_path: str):
+        """把文件压缩写入 dst_path"""
+        size = os.path.getsize(path)
+        with open(path, 'rb') as src, open(dst_path, 'wb') as dst:
+            self.compress_stream(src, dst, size)
+
+    def compress_file(self, path: str):
+        """原地压缩文件（写入临时文件后替换）"""
+        tmp_path = f"{path}.{self.name}"
+        self.compress_to(path, tmp_path)
+        os.replace(tmp_path, path)
+
+    def read_file(self, path: str) -> bytes:
+        with open(path, 'rb') as f:
+            return self.decompress(f)
+
+
+class ZlibCodec(Codec):
+    name = "zlib"
+
+    def __init__(self, level: int = 6):
+        self.level = max(1, min(level, 9))
+
+    def compress_stream(self, src, dst, size):
+        compressor = zlib.compressobj(self.level)
+        while True:
+            chunk = src.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            dst.write(compressor.compress(chunk))
+        dst.write(compressor.flush())
+
+    def decompress(self, src):
+        return zlib.decompress(src.read())
+
+
+class ZstdCodec(Codec):
+    name = "zstd"
+
+    def __init__(self, level: int = 3):
+        self.level = level
+
+    def compress_stream(self, src, dst, size):
+        # 大数据使用全部CPU核心并行压缩
+        threads = -1 if size >= MULTITHREAD_MIN_SIZE else 0
+        compressor = zstandard.ZstdCompressor(level=self.level, threads=threads)
+        compressor.copy_stream(src, dst, size=size)
+
+    def decompress(self, src):
+        output = io.BytesIO()
+        zstandard.ZstdDecompressor().copy_stream(src, output)
+        return output.getvalue()
+
+
+class Lz4Codec(Codec):
+    name = "lz4"
+
+    def __init__(self, level: int = 0):
+        self.level = level
+
+    def compress_stream(self, src, dst, size):
+        with lz4.frame.LZ4FrameCompressor(compression_level=self.level) as compressor:
+            dst.write(compressor.begin(source_size=size))
+            while True:
+                chunk = src.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                dst.write(compressor.compress(chunk))
+            dst.write(compressor.flush())
+
+    def decompress(self, src):
+        return lz4.frame.decompress(src.read())
+
+
+def available_codecs() -> Dict[str, bool]:
+    """各编解码器是否可用"""
+    return {"none": True, "zlib": True, "zstd": ZSTD_AVAILABLE, "lz4": LZ4_AVAILABLE}
+
+
+def auto_codec(kind: str, level: Optional[int] = None) -> Codec:
+    """"auto" 模式下按数据类型选择编解码器
+
+    - "array"：稠密数值数组，优先lz4（压缩和解压接近内存带宽，读取时解压开销小）
+    - "data"：pickle对象和稀疏矩阵分量，优先zstd（压缩率更高）
+    可选依赖都未安装时使用zlib，数组使用最低级别
+    """
+    if kind == "array":
+        if LZ4_AVAILABLE:
+            return Lz4Codec(0)
+        if ZSTD_AVAILABLE:
+            return ZstdCodec(1)
+        return ZlibCodec(1)
+    if ZSTD_AVAILABLE:
+        return ZstdCodec(level if level is not None else 3)
+    if LZ4_AVAILABLE:
+        return Lz4Codec(level if level is not None else 0)
+    return ZlibCodec(level if level is not None else 6)
+
+
+def get_codec(name: str, level: Optional[int] = None) -> Codec:
+    """按名称创建编解码器；"auto" 返回通用数据使用的编解码器（见 auto_codec）"""
+    if name == "auto":
+        return auto_codec("data", level)
+
+    if name == "zstd":
+        if not ZSTD_AVAILABLE:
+            raise ValueError("zstd编解码器需要安装 zstandard")
+        return ZstdCodec(level if level is not None else 3)
+    if name == "lz4":
+        if not LZ4_AVAILABLE:
+            raise ValueError("lz4编解码器需要安装 lz4")
+        return Lz4Codec(level if level is not None else 0)
+    if name == "zlib":
+        return ZlibCodec(level if level is not None else 6)
+    if name == "none":
+        return Codec()
+    raise ValueError(f"未知的编解码器: {name}")
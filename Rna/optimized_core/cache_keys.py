@@ -0,0 +1,360 @@
+#!/usr/bin/env python3
+"""
+RNA项目优化版本 - 缓存键生成
+按内容为NumPy数组、稀疏矩阵、pandas对象和AnnData计算稳定指纹，
+替代 json.dumps(default=str) 的字符串化方式（大数组会被截断成相同的repr）
+"""
+
+import sys
+import hashlib
+import threading
+import weakref
+from typing import Any, Callable, Dict, List, Tuple
+
+try:
+    import xxhash
+
+    def _new_hasher():
+        return xxhash.xxh3_128()
+
+    HASH_ALGORITHM = "xxh3_128"
+except ImportError:
+    def _new_hasher():
+        return hashlib.blake2b(digest_size=16)
+
+    HASH_ALGORITHM = "blake2b"
+
+# AnnData内容采样点数：用于低成本地发现原地修改（如log1p、normalize_total）
+_SAMPLE_POINTS = 4096
+
+# 自定义类型指纹函数：(类型, 函数)，函数返回任意可指纹化的对象
+_custom_fingerprinters: List[Tuple[type, Callable[[Any], Any]]] = []
+
+# AnnData指纹缓存：id(adata) -> (代码执行代数, 结构令牌, 指纹)
+_anndata_fingerprints: Dict[int, Tuple[int, tuple, str]] = {}
+_anndata_lock = threading.Lock()
+
+# 代码执行代数：执行器每执行一段代码加一，之前缓存的AnnData指纹随之失效。
+# 采样令牌发现不了未采样位置的原地修改（如 adata.X[i, j] = v），只在两次代码执行之间复用指纹
+_generation = 0
+
+
+def register_fingerprint(obj_type: type, fingerprint_func: Callable[[Any], Any]):
+    """为自定义类型注册指纹函数
+
+    Args:
+        obj_type: 对象类型（包含子类）
+        fingerprint_func: 接收对象，返回可用于计算指纹的替代值（如元组或字符串）
+    """
+    _custom_fingerprinters.insert(0, (obj_type, fingerprint_func))
+
+
+def fingerprint(obj: Any) -> str:
+    """计算对象的内容指纹（十六进制字符串）"""
+    hasher = _new_hasher()
+    _update(hasher, obj)
+    return hasher.hexdigest()
+
+
+def make_key(func_name: str, args: tuple, kwargs: dict) -> str:
+    """根据函数名和调用参数生成缓存键"""
+    hasher = _new_hasher()
+    _update(hasher, func_name)
+    _update(hasher, tuple(args))
+    _update(hasher, dict(kwargs))
+    return hasher.hexdigest()
+
+
+def invalidate_fingerprint(adata: Any):
+    """显式丢弃AnnData的缓存指纹（在代码执行之外原地修改adata后调用）"""
+    _forget_fingerprint(id(adata))
+
+
+def bump_generation():
+    """标记可能发生了原地修改：之后的AnnData指纹全部重新计算（执行器在每次执行代码后调用）"""
+    global _generation
+    with _anndata_lock:
+        _generation += 1
+
+
+def _tag(hasher, tag: str):
+    hasher.update(b"\x00" + tag.encode() + b"\x00")
+
+
+def _is_ndarray(obj: Any) -> bool:
+    np = sys.modules.get("numpy")
+    return np is not None and isinstance(obj, np.ndarray)
+
+
+def _is_sparse(obj: Any) -> bool:
+    sparse = sys.modules.get("scipy.sparse")
+    return sparse is not None and sparse.issparse(obj)
+
+
+def _is_pandas(obj: Any) -> bool:
+    return type(obj).__module__.startswith("pandas") and hasattr(obj, "memory_usage")
+
+
+def _is_anndata(obj: Any) -> bool:
+    return type(obj).__name__ == "AnnData" and hasattr(obj, "obsm")
+
+
+def _update(hasher, obj: Any):
+    """把对象内容流式写入哈希器"""
+    if obj is None or isinstance(obj, (bool, int, float, complex)):
+        _tag(hasher, type(obj).__name__)
+        hasher.update(repr(obj).encode())
+    elif isinstance(obj, str):
+        _tag(hasher, "str")
+        hasher.update(obj.encode("utf-8", "surrogatepass"))
+    elif isinstance(obj, (bytes, bytearray, memoryview)):
+        _tag(hasher, "bytes")
+        hasher.update(obj)
+    elif isinstance(obj, (list, tuple)):
+        _tag(hasher, f"{type(obj).__name__}:{len(obj)}")
+        for item in obj:
+            _update(hasher, item)
+    elif isinstance(obj, dict):
+        _tag(hasher, f"dict:{len(obj)}")
+        for key, value in sorted(obj.items(), key=lambda kv: repr(kv[0])):
+            _update(hasher, key)
+            _update(hasher, value)
+    elif isinstance(obj, (set, frozenset)):
+        _tag(hasher, f"set:{len(obj)}")
+        for item_fp in sorted(fingerprint(item) for item in obj):
+            hasher.update(item_fp.encode())
+    elif _is_ndarray(obj):
+        _update_ndarray(hasher, obj)
+    elif _is_sparse(obj):
+        _update_sparse(hasher, obj)
+    elif _is_anndata(obj):
+        _tag(hasher, "anndata")
+        hasher.update(_anndata_fingerprint(obj).encode())
+    elif _is_pandas(obj):
+        _update_pandas(hasher, obj)
+    else:
+        for obj_type, fingerprint_func in _custom_fingerprinters:
+            if isinstance(obj, obj_type):
+                _tag(hasher, f"custom:{obj_type.__module__}.{obj_type.__qualname__}")
+                _update(hasher, fingerprint_func(obj))
+                return
+
+        if callable(obj) and hasattr(obj, "__qualname__"):
+            _tag(hasher, "callable")
+            hasher.update(f"{getattr(obj, '__module__', '')}.{obj.__qualname__}".encode())
+        elif type(obj).__repr__ is object.__repr__ and hasattr(obj, "__dict__"):
+            # 默认repr包含内存地址，改为按属性计算
+            _tag(hasher, f"object:{type(obj).__module__}.{type(obj).__qualname__}")
+            _update(hasher, vars(obj))
+        else:
+            _tag(hasher, f"repr:{type(obj).__qualname__}")
+            hasher.update(repr(obj).encode())
+
+
+def _update_ndarray(hasher, array):
+    import numpy as np
+
+    _tag(hasher, f"ndarray:{array.dtype.str}:{array.shape}")
+    if array.dtype.hasobject:
+        for item in array.ravel():
+            _update(hasher, item)
+        return
+    if not array.flags.c_contiguous:
+        array = np.ascontiguousarray(array)
+    # 直接哈希底层缓冲区，不做字符串化
+    hasher.update(memoryview(array.reshape(-1)).cast("B"))
+
+
+def _update_sparse(hasher, matrix):
+    _tag(hasher, f"sparse:{matrix.format}:{matrix.shape}")
+    for attr in ("data", "indices", "indptr", "row", "col", "offsets"):
+        component = getattr(matrix, attr, None)
+        if component is not None and _is_ndarray(component):
+            _tag(hasher, attr)
+            _update_ndarray(hasher, component)
+
+
+def _update_pandas(hasher, obj):
+    import pandas as pd
+
+    _tag(hasher, f"pandas:{type(obj).__name__}:{getattr(obj, 'shape', '')}")
+    if isinstance(obj, pd.DataFrame):
+        _update(hasher, [str(c) for c in obj.columns])
+        _update(hasher, [str(t) for t in obj.dtypes])
+    elif isinstance(obj, pd.Series):
+        _update(hasher, str(obj.name))
+        _update(hasher, str(obj.dtype))
+    try:
+        if isinstance(obj, pd.Index):
+            hashed = pd.util.hash_array(obj.to_numpy())
+        else:
+            hashed = pd.util.hash_pandas_object(obj, index=True).to_numpy()
+        _update_ndarray(hasher, hashed)
+    except TypeError:
+        # 含不可哈希元素（如列表）的列
+        hasher.update(obj.to_json().encode())
+
+
+def _sample_indices(size: int):
+    import numpy as np
+
+    return np.linspace(0, size - 1, num=min(_SAMPLE_POINTS, size), dtype=np.int64)
+
+
+def _sample_digest(values) -> bytes:
+    if values.dtype.hasobject:
+        raw = repr(values.tolist()).encode("utf-8", "surrogatepass")
+    else:
+        raw = values.tobytes()
+    return hashlib.blake2b(raw, digest_size=8).digest()
+
+
+def _array_token(array) -> tuple:
+    """数组/稀疏矩阵/DataFrame的低成本令牌：对象、缓冲区地址和采样内容"""
+    import numpy as np
+
+    if _is_sparse(array):
+        data = array.data if hasattr(array, "data") else None
+        token = (array.format, array.shape, getattr(array, "nnz", None), id(array))
+        if _is_ndarray(data):
+            token += (data.__array_interface__["data"][0],
+                      _sample_digest(data[_sample_indices(data.size)]) if data.size else b"")
+        return token
+    if _is_ndarray(array):
+        sample = b""
+        if array.size:
+            # 按多维下标采样，非连续数组也不会整体拷贝
+            flat = _sample_indices(array.size)
+            sample = _sample_digest(array[np.unravel_index(flat, array.shape)] if array.ndim else array)
+        return ("dense", array.shape, array.dtype.str, id(array), array.__array_interface__["data"][0], sample)
+    if _is_pandas(array) and hasattr(array, "iloc"):
+        return _frame_token(array)
+    return (type(array).__name__, id(array))
+
+
+def _frame_token(frame) -> tuple:
+    """DataFrame/Series的令牌：列名、类型和采样行的值（原地覆盖已有列时也会变化）"""
+    import pandas as pd
+
+    token = (type(frame).__name__, id(frame), frame.shape,
+             tuple(str(c) for c in getattr(frame, "columns", ())),
+             tuple(str(t) for t in frame.dtypes) if hasattr(frame, "columns") else str(frame.dtype))
+    if not len(frame):
+        return token
+    sample = frame.iloc[_sample_indices(len(frame))]
+    try:
+        raw = pd.util.hash_pandas_object(sample, index=True).to_numpy().tobytes()
+    except TypeError:
+        # 含不可哈希元素（如列表）的列
+        raw = sample.to_json().encode()
+    return token + (hashlib.blake2b(raw, digest_size=8).digest(),)
+
+
+def _backed_token(adata) -> tuple:
+    """backed模式的X保存在文件中：按文件路径、大小和修改时间标识，不读取X"""
+    import os
+
+    filename = str(adata.filename)
+    try:
+        stat = os.stat(filename)
+        return ("backed", filename, stat.st_size, stat.st_mtime_ns)
+    except OSError:
+        return ("backed", filename)
+
+
+def _structure_token(adata) -> tuple:
+    """AnnData的低成本令牌：结构、缓冲区地址或采样内容变化时令牌随之变化
+
+    obs/var按列采样值，obsm/layers等按数组采样，uns整体计算指纹（通常很小，且常被原地修改）；
+    backed模式不读取X
+    """
+    if getattr(adata, "isbacked", False):
+        x_token = _backed_token(adata)
+    else:
+        x_token = _array_token(adata.X)
+
+    raw = adata.raw
+    return (
+        adata.shape,
+        x_token,
+        _frame_token(adata.obs),
+        _frame_token(adata.var),
+        tuple((k, _array_token(v)) for k, v in adata.obsm.items()),
+        tuple((k, _array_token(v)) for k, v in adata.varm.items()),
+        tuple((k, _array_token(v)) for k, v in adata.layers.items()),
+        tuple((k, _array_token(v)) for k, v in adata.obsp.items()),
+        fingerprint(dict(adata.uns)),
+        (raw.shape, _frame_token(raw.var),
+         None if getattr(adata, "isbacked", False) else _array_token(raw.X)) if raw is not None else None
+    )
+
+
+def _full_anndata_fingerprint(adata) -> str:
+    hasher = _new_hasher()
+    _update(hasher, adata.shape)
+    _tag(hasher, "X")
+    if getattr(adata, "isbacked", False):
+        _update(hasher, _backed_token(adata))
+    else:
+        _update(hasher, adata.X)
+    _tag(hasher, "obs")
+    _update(hasher, adata.obs)
+    _tag(hasher, "var")
+    _update(hasher, adata.var)
+    for attr in ("obsm", "varm", "layers", "obsp", "varp"):
+        mapping = getattr(adata, attr)
+        _tag(hasher, attr)
+        _update(hasher, {k: mapping[k] for k in mapping.keys()})
+    _tag(hasher, "uns")
+    _update(hasher, dict(adata.uns))
+    if adata.raw is not None:
+        _tag(hasher, "raw")
+        if not getattr(adata, "isbacked", False):
+            _update(hasher, adata.raw.X)
+        _update(hasher, adata.raw.var)
+    return hasher.hexdigest()
+
+
+def _anndata_fingerprint(adata) -> str:
+    """AnnData指纹；非视图对象的指纹在同一执行代数内按结构令牌缓存
+
+    代码执行后（bump_generation）或令牌变化（替换了数组、采样内容变化）时重新计算完整指纹
+    """
+    if getattr(adata, "is_view", False):
+        # 视图的属性访问会生成新对象，无法可靠缓存
+        return _full_anndata_fingerprint(adata)
+
+    obj_id = id(adata)
+    with _anndata_lock:
+        generation = _generation
+        cached = _anndata_fingerprints.get(obj_id)
+    token = _structure_token(adata)
+    if cached is not None and cached[0] == generation and cached[1] == token:
+        return cached[2]
+
+    value = _full_anndata_fingerprint(adata)
+    with _anndata_lock:
+        is_new = obj_id not in _anndata_fingerprints
+        _anndata_fingerprints[obj_id] = (generation, token, value)
+    if is_new:
+        try:
+            # 对象被回收时删除缓存，避免id复用导致误命中
+            weakref.finalize(adata, _forget_fingerprint, obj_id)
+        except TypeError:
+            _forget_fingerprint(obj_id)
+    return value
+
+
+def _forget_fingerprint(obj_id: int):
+    with _anndata_lock:
+        _anndata_fingerprints.pop(obj_id, None)
+
+
+def fingerprint_cache_stats() -> Dict[str, Any]:
+    """指纹缓存统计"""
+    with _anndata_lock:
+        return {
+            "algorithm": HASH_ALGORITHM,
+            "cached_anndata_fingerprints": len(_anndata_fingerprints),
+            "generation": _generation
+        }
@@ -4,40 +4,139 @@ RNA项目优化版本 - 智能缓存管理系统
 """
 
 import os
+import sys
 import pickle
-import hashlib
+import sqlite3
+import shutil
+import tempfile
 import time
 import psutil
+import io
 import json
+import zlib
+import asyncio
+import inspect
+from collections import OrderedDict
 from pathlib import Path
-from typing import Any, Dict, Optional, Tuple, List
+from typing import Any, Dict, Optional, Tuple, List, Callable, Awaitable
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime, timedelta
 from functools import wraps
+from contextlib import contextmanager
+import threading
 from threading import Lock
 import weakref
 import gc
 
 from config import get_config
+from cache_keys import make_key, fingerprint_cache_stats
+from cache_codecs import Codec, auto_codec, get_codec
+from memory_monitor import MemoryPressureMonitor
+
+def _is_memory_mapped(array: Any) -> bool:
+    """数组（或其视图的底层缓冲区）是否来自内存映射文件"""
+    while array is not None:
+        if type(array).__name__ in ("memmap", "mmap"):
+            return True
+        array = getattr(array, "base", None)
+    return False
+
+
+def estimate_size(obj: Any, _seen: Optional[set] = None) -> int:
+    """估算对象占用的内存（字节）
+
+    针对NumPy数组、SciPy稀疏矩阵、pandas对象和AnnData做深度统计，
+    __sizeof__ 对这些对象只会返回对象头的大小
+    """
+    if _seen is None:
+        _seen = set()
+    obj_id = id(obj)
+    if obj_id in _seen:
+        return 0
+    _seen.add(obj_id)
+
+    if obj is None or isinstance(obj, (bool, int, float, complex, str, bytes, bytearray)):
+        return sys.getsizeof(obj)
+
+    # pandas DataFrame / Series / Index（需在NumPy分支之前：Series和Index也有 nbytes/dtype/shape，
+    # 但对object/字符串列只统计指针大小）
+    if hasattr(obj, "memory_usage") and type(obj).__module__.startswith("pandas"):
+        try:
+            usage = obj.memory_usage(deep=True)
+            return int(usage.sum()) if hasattr(usage, "sum") else int(usage)
+        except Exception:
+            return sys.getsizeof(obj)
+
+    # NumPy数组（内存映射数组的数据在页缓存中，不计入内存预算）
+    if hasattr(obj, "nbytes") and hasattr(obj, "dtype") and hasattr(obj, "shape"):
+        if _is_memory_mapped(obj):
+            return sys.getsizeof(obj)
+        return int(obj.nbytes) + 128
+
+    # SciPy稀疏矩阵
+    if hasattr(obj, "nnz") and hasattr(obj, "format") and hasattr(obj, "tocsr"):
+        size = 128
+        for attr in ("data", "indices", "indptr", "row", "col", "offsets"):
+            component = getattr(obj, attr, None)
+            if component is not None and hasattr(component, "nbytes") and not _is_memory_mapped(component):
+                size += int(component.nbytes)
+        return size
+
+    # AnnData（视图会持有父对象，按父对象计算，避免访问 view.X 触发拷贝；
+    # backed模式的X保存在磁盘上，访问 .X 会整体读入内存，因此不计入）
+    if hasattr(obj, "obs") and hasattr(obj, "var") and hasattr(obj, "obsm") and hasattr(obj, "X"):
+        if getattr(obj, "is_view", False) and getattr(obj, "_adata_ref", None) is not None:
+            return estimate_size(obj._adata_ref, _seen)
+        size = estimate_size(obj.obs, _seen) + estimate_size(obj.var, _seen)
+        if not getattr(obj, "isbacked", False):
+            size += estimate_size(obj.X, _seen)
+        for attr in ("obsm", "varm", "layers", "obsp", "varp"):
+            mapping = getattr(obj, attr, None)
+            if mapping is not None:
+                size += sum(estimate_size(v, _seen) for v in mapping.values())
+        size += estimate_size(getattr(obj, "uns", None), _seen)
+        raw = getattr(obj, "raw", None)
+        if raw is not None:
+            size += estimate_size(raw.X, _seen) + estimate_size(raw.var, _seen)
+        return size
+
+    if isinstance(obj, dict):
+        return sys.getsizeof(obj) + sum(
+            estimate_size(k, _seen) + estimate_size(v, _seen) for k, v in obj.items()
+        )
+
+    if isinstance(obj, (list, tuple, set, frozenset)):
+        size = sys.getsizeof(obj)
+        items = list(obj) if not isinstance(obj, (list, tuple)) else obj
+        if len(items) > 1000:
+            # 大容器抽样估算，避免逐个遍历
+            sample = items[:100]
+            sample_size = sum(estimate_size(item, _seen) for item in sample)
+            return size + sample_size * len(items) // len(sample)
+        return size + sum(estimate_size(item, _seen) for item in items)
+
+    size = sys.getsizeof(obj)
+    if hasattr(obj, "__dict__"):
+        size += estimate_size(vars(obj), _seen)
+    return size
+
 
 class CacheEntry:
     """缓存条目"""
     
-    def __init__(self, value: Any, ttl: int = 3600):
+    def __init__(self, value: Any, ttl: int = 3600, size: Optional[int] = None):
         self.value = value
         self.created_time = time.time()
         self.access_time = time.time()
         self.access_count = 1
         self.ttl = ttl
-        self.size = self._calculate_size(value)
+        self.size = size if size is not None else self._calculate_size(value)
     
     def _calculate_size(self, obj: Any) -> int:
-        """计算对象大小（估算）"""
+        """计算对象大小（深度估算）"""
         try:
-            if hasattr(obj, '__sizeof__'):
-                return obj.__sizeof__()
-            else:
-                return len(pickle.dumps(obj))
-        except:
+            return estimate_size(obj)
+        except Exception:
             return 1024  # 默认1KB
     
     def is_expired(self) -> bool:
@@ -49,87 +148,201 @@ class CacheEntry:
         self.access_time = time.time()
         self.access_count += 1
 
+class FrequencySketch:
+    """TinyLFU访问频率估计（Count-Min Sketch + 周期性衰减）"""
+
+    def __init__(self, width: int = 4096, depth: int = 4):
+        self.width = width
+        self.depth = depth
+        self._tables = [[0] * width for _ in range(depth)]
+        self._additions = 0
+        self._reset_threshold = width * 10
+
+    def _indexes(self, key: str):
+        for seed in range(self.depth):
+            yield seed, hash((seed, key)) % self.width
+
+    def increment(self, key: str):
+        """记录一次访问"""
+        for row, index in self._indexes(key):
+            if self._tables[row][index] < 15:  # 4位计数器上限
+                self._tables[row][index] += 1
+        self._additions += 1
+        if self._additions >= self._reset_threshold:
+            self._age()
+
+    def frequency(self, key: str) -> int:
+        """估计访问频率"""
+        return min(self._tables[row][index] for row, index in self._indexes(key))
+
+    def _age(self):
+        """计数减半，让旧的热点逐渐冷却"""
+        for table in self._tables:
+            for i in range(self.width):
+                table[i] >>= 1
+        self._additions //= 2
+
 class InMemoryCache:
-    """内存缓存管理器"""
+    """内存缓存管理器（O(1) LRU，可选TinyLFU准入）"""
     
-    def __init__(self, max_size: int = 512 * 1024 * 1024):  # 512MB
-        self._cache: Dict[str, CacheEntry] = {}
+    def __init__(self, max_size: int = 512 * 1024 * 1024, admission_policy: str = "lru"):  # 512MB
+        # 按访问顺序排列：头部最久未使用，尾部最近使用
+        self._cache: "OrderedDict[str, CacheEntry]" = OrderedDict()
         self._lock = Lock()
         self.max_size = max_size
         self.current_size = 0
+        self.admission_policy = admission_policy
+        self._sketch = FrequencySketch() if admission_policy == "tinylfu" else None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.rejections = 0
+        # 锁竞争统计
+        self.lock_acquisitions = 0
+        self.lock_wait_time = 0.0
+        self.max_lock_wait = 0.0
+        
+    @contextmanager
+    def _locked(self):
+        """获取锁并记录等待时间"""
+        wait_start = time.perf_counter()
+        self._lock.acquire()
+        wait_time = time.perf_counter() - wait_start
+        self.lock_acquisitions += 1
+        self.lock_wait_time += wait_time
+        if wait_time > self.max_lock_wait:
+            self.max_lock_wait = wait_time
+        try:
+            yield
+        finally:
+            self._lock.release()
         
     def _generate_key(self, func_name: str, args: tuple, kwargs: dict) -> str:
-        """生成缓存键"""
-        key_data = {
-            'func': func_name,
-            'args': args,
-            'kwargs': kwargs
-        }
-        key_str = json.dumps(key_data, sort_keys=True, default=str)
-        return hashlib.md5(key_str.encode()).hexdigest()
+        """生成缓存键（按参数内容计算指纹，见 cache_keys）"""
+        return make_key(func_name, args, kwargs)
     
     def get(self, key: str) -> Optional[Any]:
         """获取缓存值"""
-        with self._lock:
-            if key in self._cache:
-                entry = self._cache[key]
-                if entry.is_expired():
-                    del self._cache[key]
-                    self.current_size -= entry.size
-                    return None
-                else:
-                    entry.touch()
-                    return entry.value
-        return None
+        with self._locked():
+            if self._sketch is not None:
+                self._sketch.increment(key)
+
+            entry = self._cache.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            if entry.is_expired():
+                del self._cache[key]
+                self.current_size -= entry.size
+                self.misses += 1
+                return None
+
+            self._cache.move_to_end(key)
+            entry.touch()
+            self.hits += 1
+            return entry.value
     
-    def set(self, key: str, value: Any, ttl: int = 3600):
+    def set(self, key: str, value: Any, ttl: int = 3600, size: Optional[int] = None):
         """设置缓存值"""
-        with self._lock:
-            entry = CacheEntry(value, ttl)
-            
-            # 检查内存使用率
+        # 大小估算可能很耗时，在锁外完成
+        entry = CacheEntry(value, ttl, size)
+
+        with self._locked():
+            # 单个条目超过总预算时不缓存（已有的旧条目保留）
+            if entry.size > self.max_size:
+                self.rejections += 1
+                return
+
+            # 先做准入判断，被拒绝时不影响已有的旧条目；已在缓存中的键更新时无需再次准入
+            old_entry = self._cache.get(key)
+            old_size = old_entry.size if old_entry is not None else 0
+            if old_entry is None and self._should_evict(entry.size) and not self._admit(key, entry.size):
+                self.rejections += 1
+                return
+
+            if old_entry is not None:
+                del self._cache[key]
+                self.current_size -= old_size
             if self._should_evict(entry.size):
                 self._evict_entries(entry.size)
             
-            # 如果键已存在，更新大小
-            if key in self._cache:
-                self.current_size -= self._cache[key].size
-            
             self._cache[key] = entry
             self.current_size += entry.size
     
+    def _admit(self, key: str, required_size: int) -> bool:
+        """TinyLFU准入：新条目的访问频率需高于所有将被淘汰的条目（调用方需持有锁）"""
+        if self._sketch is None or not self._cache:
+            return True
+        frequency = self._sketch.frequency(key)
+        target_size = self.max_size - required_size
+        remaining = self.current_size
+        # 与 _evict_entries 相同的顺序：从头部依次淘汰，直到腾出足够空间
+        for victim_key, victim in self._cache.items():
+            if remaining <= target_size:
+                break
+            if self._sketch.frequency(victim_key) >= frequency:
+                return False
+            remaining -= victim.size
+        return True
+    
     def _should_evict(self, new_size: int) -> bool:
         """判断是否需要清理缓存"""
         return (self.current_size + new_size) > self.max_size
     
-    def _evict_entries(self, required_size: int):
-        """清理缓存条目（LRU策略）"""
-        # 按访问时间排序，优先清理最久未访问的
-        sorted_items = sorted(
-            self._cache.items(),
-            key=lambda x: x[1].access_time
-        )
-        
-        freed_size = 0
-        for key, entry in sorted_items:
-            if freed_size >= required_size:
-                break
-            
-            del self._cache[key]
-            freed_size += entry.size
+    def _evict_entries(self, required_size: int) -> List[Tuple[str, CacheEntry]]:
+        """清理缓存条目（LRU策略，调用方需持有锁）
+
+        从头部依次淘汰，直到腾出 required_size 字节的空间
+        """
+        evicted = []
+        target_size = self.max_size - required_size
+        while self._cache and self.current_size > target_size:
+            key, entry = self._cache.popitem(last=False)
             self.current_size -= entry.size
+            self.evictions += 1
+            evicted.append((key, entry))
+        return evicted
+    
+    def evict(self, size: int) -> List[Tuple[str, CacheEntry]]:
+        """主动淘汰至少 size 字节的最久未使用条目"""
+        with self._locked():
+            evicted = []
+            freed_size = 0
+            while self._cache and freed_size < size:
+                key, entry = self._cache.popitem(last=False)
+                self.current_size -= entry.size
+                self.evictions += 1
+                freed_size += entry.size
+                evicted.append((key, entry))
+            return evicted
     
+    def resize(self, max_size: int) -> List[Tuple[str, CacheEntry]]:
+        """调整预算，超出部分按LRU淘汰并返回被淘汰的条目"""
+        with self._locked():
+            self.max_size = max_size
+            return self._evict_entries(0)
+
+    def pop(self, key: str) -> Optional[CacheEntry]:
+        """移除并返回条目（不存在时返回None）"""
+        with self._locked():
+            entry = self._cache.pop(key, None)
+            if entry is not None:
+                self.current_size -= entry.size
+            return entry
+
     def clear(self):
         """清空缓存"""
-        with self._lock:
+        with self._locked():
             self._cache.clear()
             self.current_size = 0
     
     def stats(self) -> Dict[str, Any]:
         """获取缓存统计信息"""
-        with self._lock:
+        with self._locked():
             total_entries = len(self._cache)
             total_accesses = sum(entry.access_count for entry in self._cache.values())
+            total_lookups = self.hits + self.misses
             
             return {
                 "total_entries": total_entries,
@@ -137,217 +350,987 @@ class InMemoryCache:
                 "max_size_mb": round(self.max_size / (1024 * 1024), 2),
                 "memory_usage_percent": round((self.current_size / self.max_size) * 100, 2),
                 "total_accesses": total_accesses,
-                "avg_accesses_per_entry": round(total_accesses / max(total_entries, 1), 2)
+                "avg_accesses_per_entry": round(total_accesses / max(total_entries, 1), 2),
+                "admission_policy": self.admission_policy,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / max(total_lookups, 1), 4),
+                "evictions": self.evictions,
+                "rejections": self.rejections,
+                "lock_acquisitions": self.lock_acquisitions,
+                "lock_wait_ms": round(self.lock_wait_time * 1000, 3),
+                "max_lock_wait_ms": round(self.max_lock_wait * 1000, 3)
             }
 
+class ShardedCache:
+    """分片内存缓存：按键哈希分配到多个独立加锁的LRU分片，降低并发请求间的锁竞争
+
+    小条目按分片平均分配预算；超过单个分片预算的大条目（整个AnnData、大矩阵）进入共享的大对象层，
+    按全局预算准入。两层合计超出全局预算时，先按LRU淘汰大对象层，再按比例淘汰各分片
+    """
+
+    def __init__(self, max_size: int = 512 * 1024 * 1024, num_shards: int = 16,
+                 admission_policy: str = "lru"):
+        self.num_shards = max(1, num_shards)
+        self._max_size = max_size
+        self._shard_size = max_size // self.num_shards
+        self._shards = [
+            InMemoryCache(max_size=self._shard_size, admission_policy=admission_policy)
+            for _ in range(self.num_shards)
+        ]
+        self._large = InMemoryCache(max_size=max_size, admission_policy=admission_policy)
+        self._budget_lock = Lock()
+
+    def _shard(self, key: str) -> InMemoryCache:
+        return self._shards[zlib.crc32(key.encode()) % self.num_shards]
+
+    def _generate_key(self, func_name: str, args: tuple, kwargs: dict) -> str:
+        """生成缓存键"""
+        return self._shards[0]._generate_key(func_name, args, kwargs)
+
+    @property
+    def max_size(self) -> int:
+        return self._max_size
+
+    @property
+    def current_size(self) -> int:
+        return sum(shard.current_size for shard in self._shards) + self._large.current_size
+
+    def get(self, key: str) -> Optional[Any]:
+        """获取缓存值（先查分片，再查大对象层）"""
+        value = self._shard(key).get(key)
+        if value is None and self._large.current_size > 0:
+            value = self._large.get(key)
+        return value
+
+    def set(self, key: str, value: Any, ttl: int = 3600):
+        """设置缓存值（大小在分片锁外计算）"""
+        try:
+            size = estimate_size(value)
+        except Exception:
+            size = 1024
+        shard = self._shard(key)
+        if size > self._shard_size:
+            shard.pop(key)
+            self._large.set(key, value, ttl, size)
+            self._enforce_budget()
+        else:
+            self._large.pop(key)
+            shard.set(key, value, ttl, size)
+            if self._large.current_size > 0:
+                self._enforce_budget()
+
+    def _enforce_budget(self) -> List[Tuple[str, CacheEntry]]:
+        """两层合计超出全局预算时淘汰超出部分：先大对象层，再按比例淘汰各分片"""
+        evicted: List[Tuple[str, CacheEntry]] = []
+        with self._budget_lock:
+            excess = self.current_size - self._max_size
+            if excess > 0 and self._large.current_size > 0:
+                evicted.extend(self._large.evict(excess))
+                excess = self.current_size - self._max_size
+            if excess > 0:
+                evicted.extend(self._evict_shards(excess))
+        return evicted
+
+    def resize(self, max_size: int) -> List[Tuple[str, CacheEntry]]:
+        """按分片平均分配新预算，返回被淘汰的条目"""
+        self._max_size = max_size
+        self._shard_size = max_size // self.num_shards
+        evicted = []
+        for shard in self._shards:
+            evicted.extend(shard.resize(self._shard_size))
+        evicted.extend(self._large.resize(max_size))
+        evicted.extend(self._enforce_budget())
+        return evicted
+
+    def _evict_shards(self, size: int) -> List[Tuple[str, CacheEntry]]:
+        total_size = sum(shard.current_size for shard in self._shards)
+        evicted = []
+        if total_size <= 0:
+            return evicted
+        for shard in self._shards:
+            share = -(-size * shard.current_size // total_size)
+            if share > 0:
+                evicted.extend(shard.evict(share))
+        return evicted
+
+    def evict(self, size: int) -> List[Tuple[str, CacheEntry]]:
+        """按各层当前占用比例淘汰共 size 字节"""
+        total_size = self.current_size
+        if total_size <= 0:
+            return []
+        large_share = size * self._large.current_size // total_size
+        evicted = self._large.evict(large_share) if large_share > 0 else []
+        evicted.extend(self._evict_shards(size - large_share))
+        return evicted
+
+    def clear(self):
+        """清空缓存"""
+        for shard in self._shards:
+            shard.clear()
+        self._large.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """获取缓存统计信息（汇总 + 各分片 + 大对象层）"""
+        shard_stats = [shard.stats() for shard in self._shards]
+        large = self._large.stats()
+        total_entries = sum(s["total_entries"] for s in shard_stats) + large["total_entries"]
+        total_accesses = sum(s["total_accesses"] for s in shard_stats) + large["total_accesses"]
+        # 大对象层只在分片未命中后查询：其命中已在分片中计为一次未命中，其未命中与分片重复
+        hits = sum(s["hits"] for s in shard_stats) + large["hits"]
+        misses = sum(s["misses"] for s in shard_stats) - large["hits"]
+        current_size = self.current_size
+        max_size = self.max_size
+
+        return {
+            "total_entries": total_entries,
+            "current_size_mb": round(current_size / (1024 * 1024), 2),
+            "max_size_mb": round(max_size / (1024 * 1024), 2),
+            "memory_usage_percent": round((current_size / max(max_size, 1)) * 100, 2),
+            "total_accesses": total_accesses,
+            "avg_accesses_per_entry": round(total_accesses / max(total_entries, 1), 2),
+            "admission_policy": self._shards[0].admission_policy,
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": round(hits / max(hits + misses, 1), 4),
+            "evictions": sum(s["evictions"] for s in shard_stats) + large["evictions"],
+            "rejections": sum(s["rejections"] for s in shard_stats) + large["rejections"],
+            "num_shards": self.num_shards,
+            "large_objects": {
+                "entries": large["total_entries"],
+                "size_mb": large["current_size_mb"],
+                "hits": large["hits"],
+                "evictions": large["evictions"],
+                "rejections": large["rejections"]
+            },
+            "lock_wait_ms": round(sum(s["lock_wait_ms"] for s in shard_stats), 3),
+            "max_lock_wait_ms": max(s["max_lock_wait_ms"] for s in shard_stats),
+            "shards": [
+                {
+                    "entries": s["total_entries"],
+                    "size_mb": s["current_size_mb"],
+                    "hits": s["hits"],
+                    "misses": s["misses"],
+                    "lock_acquisitions": s["lock_acquisitions"],
+                    "lock_wait_ms": s["lock_wait_ms"],
+                    "max_lock_wait_ms": s["max_lock_wait_ms"]
+                }
+                for s in shard_stats
+            ]
+        }
+
+def _payload_format(value: Any, zero_copy_threshold: int) -> str:
+    """按对象类型和大小选择磁盘格式
+
+    大型NumPy数组和SciPy稀疏矩阵保存为原始.npy缓冲区，AnnData保存为h5ad，
+    读取时分别使用内存映射和backed模式；其余对象使用pickle
+    """
+    if type(value).__name__ == "AnnData" and hasattr(value, "write_h5ad"):
+        return "h5ad"
+    # 只接受精确类型：pandas Series/Index、np.matrix、csr_array 等按缓冲区保存后读回会变成其他类型
+    np = sys.modules.get("numpy")
+    if np is not None and type(value) in (np.ndarray, np.memmap):
+        if not value.dtype.hasobject and value.nbytes >= zero_copy_threshold:
+            return "npy"
+        return "pickle"
+    sp = sys.modules.get("scipy.sparse")
+    if sp is not None and type(value) in (sp.csr_matrix, sp.csc_matrix):
+        if estimate_size(value) >= zero_copy_threshold:
+            return "sparse"
+    return "pickle"
+
+
 class DiskCache:
-    """磁盘缓存管理器"""
-    
-    def __init__(self, cache_dir: str):
+    """磁盘缓存管理器
+
+    元数据（过期时间、大小、访问统计、格式）集中保存在SQLite索引中，
+    数据文件通过临时目录+rename原子写入，按总大小预算进行LRU淘汰；
+    按条目选择压缩：h5ad不压缩；codec="auto" 时稠密数组用lz4、pickle和稀疏矩阵用zstd，
+    数组压缩节省不足 ARRAY_MIN_SAVING 时保留原始格式，仍以内存映射读取
+    """
+
+    INDEX_FILE = "index.sqlite"
+    ACCESS_FLUSH_THRESHOLD = 64  # 累积多少次命中后批量写回访问统计
+    ARRAY_MIN_SAVING = 0.1  # 数组压缩至少节省的比例，否则不值得放弃内存映射
+    PAYLOAD_SUFFIXES = {
+        "pickle": ".cache",
+        "npy": ".npy",
+        "sparse": ".sparse",
+        "h5ad": ".h5ad"
+    }
+
+    def __init__(self, cache_dir: str, max_size: Optional[int] = None,
+                 zero_copy_threshold: int = 1024 * 1024, codec: str = "none",
+                 compression_level: Optional[int] = None,
+                 compression_min_size: int = 64 * 1024, compress_arrays: bool = True):
         self.cache_dir = Path(cache_dir)
         self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_size = max_size
+        self.zero_copy_threshold = zero_copy_threshold
+        self.compression_min_size = compression_min_size
+        self.compress_arrays = compress_arrays
+        self.codec_name = codec
+        try:
+            self._codec = get_codec(codec, compression_level)
+        except ValueError as e:
+            print(f"⚠️ {e}，磁盘缓存不启用压缩")
+            self.codec_name = "none"
+            self._codec = get_codec("none")
+        # 稠密数组的编解码器：auto 时单独选择解压更快的，否则与其他数据相同
+        self._array_codec = auto_codec("array") if self.codec_name == "auto" else self._codec
+        self._decoders: Dict[str, Codec] = {
+            "none": get_codec("none"), self._array_codec.name: self._array_codec, self._codec.name: self._codec
+        }
+        self._codec_timings: Dict[str, Dict[str, float]] = {}
         self._lock = Lock()
-    
-    def _get_file_path(self, key: str) -> Path:
-        """获取缓存文件路径"""
-        return self.cache_dir / f"{key}.cache"
-    
-    def _get_meta_path(self, key: str) -> Path:
-        """获取元数据文件路径"""
-        return self.cache_dir / f"{key}.meta"
-    
+        self._pending_access: Dict[str, Tuple[int, float]] = {}
+        self._removal_listeners: List[Callable[[Optional[List[str]]], None]] = []
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._db = sqlite3.connect(
+            str(self.cache_dir / self.INDEX_FILE),
+            timeout=30,
+            check_same_thread=False,
+            isolation_level=None
+        )
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            """CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                created_time REAL NOT NULL,
+                expires_at REAL NOT NULL,
+                access_time REAL NOT NULL,
+                access_count INTEGER NOT NULL DEFAULT 0
+            )"""
+        )
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(entries)")}
+        for column, definition in (
+            ("format", "TEXT NOT NULL DEFAULT 'pickle'"),
+            ("codec", "TEXT NOT NULL DEFAULT 'none'"),
+            ("raw_size", "INTEGER")
+        ):
+            if column not in columns:
+                self._db.execute(f"ALTER TABLE entries ADD COLUMN {column} {definition}")
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_entries_access ON entries(access_time)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_entries_expires ON entries(expires_at)")
+        self._remove_legacy_files()
+
+    def _get_file_path(self, key: str, fmt: str = "pickle") -> Path:
+        """获取缓存数据路径（sparse格式为目录）"""
+        return self.cache_dir / f"{key}{self.PAYLOAD_SUFFIXES[fmt]}"
+
+    def _unlink_payload(self, key: str, fmt: Optional[str] = None):
+        """删除数据文件；已被内存映射的文件在POSIX上仍可被读取方继续使用"""
+        formats = [fmt] if fmt else list(self.PAYLOAD_SUFFIXES)
+        for name in formats:
+            path = self._get_file_path(key, name)
+            try:
+                if path.is_dir():
+                    shutil.rmtree(path)
+                else:
+                    path.unlink(missing_ok=True)
+            except OSError:
+                pass
+
+    def _write_payload(self, directory: Path, key: str, value: Any, fmt: str) -> Path:
+        """把数据写入临时目录，返回写好的路径"""
+        path = directory / self._get_file_path(key, fmt).name
+        if fmt == "npy":
+            import numpy as np
+            np.save(path, value, allow_pickle=False)
+        elif fmt == "sparse":
+            import numpy as np
+            path.mkdir()
+            for attr in ("data", "indices", "indptr"):
+                np.save(path / f"{attr}.npy", getattr(value, attr), allow_pickle=False)
+            with open(path / "meta.json", 'w') as f:
+                json.dump({"format": value.format, "shape": list(value.shape)}, f)
+        elif fmt == "h5ad":
+            value.write_h5ad(path)
+        else:
+            with open(path, 'wb') as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        return path
+
+    def _select_codec(self, fmt: str, size: int) -> Codec:
+        """按数据格式和大小选择编解码器"""
+        if fmt == "h5ad" or size < self.compression_min_size:
+            return self._decoders["none"]
+        if fmt in ("npy", "sparse") and not self.compress_arrays:
+            return self._decoders["none"]
+        return self._array_codec if fmt == "npy" else self._codec
+
+    def _decoder(self, name: str) -> Codec:
+        # 条目可能由之前配置的其他编解码器写入
+        if name not in self._decoders:
+            self._decoders[name] = get_codec(name)
+        return self._decoders[name]
+
+    def _record_timing(self, codec: str, operation: str, seconds: float):
+        with self._lock:
+            timing = self._codec_timings.setdefault(codec, {
+                "encode_count": 0, "encode_seconds": 0.0,
+                "decode_count": 0, "decode_seconds": 0.0
+            })
+            timing[f"{operation}_count"] += 1
+            timing[f"{operation}_seconds"] += seconds
+
+    def _compress_payload(self, path: Path, codec: Codec, min_saving: float = 0.0) -> bool:
+        """原地压缩已写好的数据文件（sparse目录逐个压缩分量）
+
+        节省的比例不足 min_saving 时丢弃压缩结果、保留原文件，返回False
+        """
+        start = time.perf_counter()
+        files = sorted(path.glob("*.npy")) if path.is_dir() else [path]
+        compressed = []
+        for file_path in files:
+            tmp_path = f"{file_path}.{codec.name}"
+            codec.compress_to(str(file_path), tmp_path)
+            compressed.append((file_path, tmp_path))
+        self._record_timing(codec.name, "encode", time.perf_counter() - start)
+
+        raw_size = sum(os.path.getsize(file_path) for file_path, _ in compressed)
+        packed_size = sum(os.path.getsize(tmp_path) for _, tmp_path in compressed)
+        if packed_size > raw_size * (1 - min_saving):
+            for _, tmp_path in compressed:
+                os.remove(tmp_path)
+            return False
+        for file_path, tmp_path in compressed:
+            os.replace(tmp_path, file_path)
+        return True
+
+    def _load_array(self, path: Path, codec: Codec):
+        import numpy as np
+        if codec.name == "none":
+            return np.load(path, mmap_mode='r', allow_pickle=False)
+        return np.load(io.BytesIO(codec.read_file(str(path))), allow_pickle=False)
+
+    def _read_payload(self, key: str, fmt: str, codec_name: str = "none") -> Any:
+        """读取数据；未压缩的大型数组以只读内存映射返回，只有实际访问的页才会读入内存"""
+        path = self._get_file_path(key, fmt)
+        codec = self._decoder(codec_name)
+        start = time.perf_counter()
+
+        if fmt == "npy":
+            value = self._load_array(path, codec)
+        elif fmt == "sparse":
+            import scipy.sparse as sp
+            with open(path / "meta.json", 'r') as f:
+                meta = json.load(f)
+            components = tuple(
+                self._load_array(path / f"{attr}.npy", codec)
+                for attr in ("data", "indices", "indptr")
+            )
+            matrix_cls = sp.csr_matrix if meta["format"] == "csr" else sp.csc_matrix
+            value = matrix_cls(components, shape=tuple(meta["shape"]), copy=False)
+        elif fmt == "h5ad":
+            import anndata
+            return anndata.read_h5ad(path, backed='r')
+        elif codec.name == "none":
+            with open(path, 'rb') as f:
+                return pickle.load(f)
+        else:
+            value = pickle.loads(codec.read_file(str(path)))
+
+        if codec.name != "none":
+            self._record_timing(codec.name, "decode", time.perf_counter() - start)
+        return value
+
+    @staticmethod
+    def _path_size(path: Path) -> int:
+        if path.is_dir():
+            return sum(f.stat().st_size for f in path.rglob("*") if f.is_file())
+        return path.stat().st_size
+
+    def _remove_legacy_files(self):
+        """清理旧版本按键保存的.meta元数据（其缓存键格式已不兼容）"""
+        for meta_path in self.cache_dir.glob("*.meta"):
+            try:
+                self._unlink_payload(meta_path.stem, "pickle")
+                meta_path.unlink()
+            except OSError:
+                pass
+
+    def add_removal_listener(self, listener: Callable[[Optional[List[str]]], None]):
+        """注册条目删除监听者：listener(被删除的键列表)，清空整个缓存时参数为None
+
+        淘汰、过期清理和读取失败时的删除都会通知，在执行删除的线程中调用
+        """
+        self._removal_listeners.append(listener)
+
+    def _notify_removed(self, keys: Optional[List[str]]):
+        if keys is not None and not keys:
+            return
+        for listener in self._removal_listeners:
+            try:
+                listener(keys)
+            except Exception as e:
+                print(f"⚠️ 磁盘缓存删除通知失败: {e}")
+
     def get(self, key: str) -> Optional[Any]:
         """从磁盘获取缓存"""
-        file_path = self._get_file_path(key)
-        meta_path = self._get_meta_path(key)
-        
-        if not file_path.exists() or not meta_path.exists():
+        with self._lock:
+            row = self._db.execute(
+                "SELECT expires_at, format, codec FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+
+        if row is None:
+            self.misses += 1
             return None
-        
+
+        if time.time() > row[0]:
+            self._remove(key)
+            self.misses += 1
+            return None
+
         try:
-            # 检查元数据
-            with open(meta_path, 'r') as f:
-                meta = json.load(f)
-            
-            # 检查是否过期
-            if time.time() > meta['expires_at']:
-                self._remove_cache_files(key)
-                return None
-            
-            # 读取缓存数据
-            with open(file_path, 'rb') as f:
-                value = pickle.load(f)
-            
-            # 更新访问时间
-            meta['access_time'] = time.time()
-            meta['access_count'] += 1
-            with open(meta_path, 'w') as f:
-                json.dump(meta, f)
-            
-            return value
-            
+            value = self._read_payload(key, row[1], row[2])
+        except FileNotFoundError:
+            self._remove(key)
+            self.misses += 1
+            return None
         except Exception as e:
             print(f"读取磁盘缓存失败: {e}")
-            self._remove_cache_files(key)
+            self._remove(key)
+            self.misses += 1
             return None
-    
+
+        self.hits += 1
+        self._record_access(key)
+        return value
+
+    def _record_access(self, key: str):
+        """缓冲访问统计，达到阈值后批量写回索引"""
+        with self._lock:
+            count, _ = self._pending_access.get(key, (0, 0.0))
+            self._pending_access[key] = (count + 1, time.time())
+            if len(self._pending_access) >= self.ACCESS_FLUSH_THRESHOLD:
+                self._flush_access_locked()
+
+    def _flush_access_locked(self):
+        """写回缓冲的访问统计（调用方需持有锁）"""
+        if not self._pending_access:
+            return
+        updates = [(t, c, k) for k, (c, t) in self._pending_access.items()]
+        self._pending_access.clear()
+        self._db.executemany(
+            "UPDATE entries SET access_time = MAX(access_time, ?), "
+            "access_count = access_count + ? WHERE key = ?",
+            updates
+        )
+
     def set(self, key: str, value: Any, ttl: int = 3600):
         """保存到磁盘缓存"""
-        file_path = self._get_file_path(key)
-        meta_path = self._get_meta_path(key)
-        
+        tmp_dir = None
+
         try:
+            fmt = _payload_format(value, self.zero_copy_threshold)
+            tmp_dir = Path(tempfile.mkdtemp(dir=self.cache_dir, prefix=f".{key}.", suffix=".tmp"))
+            try:
+                written = self._write_payload(tmp_dir, key, value, fmt)
+            except Exception as e:
+                if fmt == "pickle":
+                    raise
+                # 类型化格式写入失败（如uns中含无法写入h5ad的对象），回退到pickle
+                print(f"⚠️ {fmt}格式写入失败，回退到pickle: {e}")
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+                tmp_dir = Path(tempfile.mkdtemp(dir=self.cache_dir, prefix=f".{key}.", suffix=".tmp"))
+                fmt = "pickle"
+                written = self._write_payload(tmp_dir, key, value, fmt)
+            raw_size = self._path_size(written)
+            codec = self._select_codec(fmt, raw_size)
+            if codec.name != "none":
+                # 可内存映射的格式只在压缩收益明显时压缩（如随机浮点嵌入基本无法压缩）
+                min_saving = self.ARRAY_MIN_SAVING if fmt in ("npy", "sparse") else 0.0
+                if not self._compress_payload(written, codec, min_saving):
+                    codec = self._decoders["none"]
+            size = self._path_size(written)
+
+            if self.max_size is not None and size > self.max_size:
+                return
+
             with self._lock:
-                # 保存数据
-                with open(file_path, 'wb') as f:
-                    pickle.dump(value, f)
-                
-                # 保存元数据
-                meta = {
-                    'created_time': time.time(),
-                    'access_time': time.time(),
-                    'access_count': 1,
-                    'expires_at': time.time() + ttl,
-                    'ttl': ttl
-                }
-                with open(meta_path, 'w') as f:
-                    json.dump(meta, f)
-                    
+                previous = self._db.execute(
+                    "SELECT format FROM entries WHERE key = ?", (key,)
+                ).fetchone()
+            if previous is not None:
+                self._unlink_payload(key, previous[0])
+
+            # rename是原子操作，读取方不会看到写了一半的文件
+            final_path = self._get_file_path(key, fmt)
+            if final_path.is_dir():
+                shutil.rmtree(final_path)
+            os.replace(written, final_path)
+
+            now = time.time()
+            with self._lock:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO entries "
+                    "(key, size, created_time, expires_at, access_time, access_count, "
+                    "format, codec, raw_size) VALUES (?, ?, ?, ?, ?, 0, ?, ?, ?)",
+                    (key, size, now, now + ttl, now, fmt, codec.name, raw_size)
+                )
+                self._pending_access.pop(key, None)
+
+            self._enforce_budget()
+
         except Exception as e:
             print(f"保存磁盘缓存失败: {e}")
-            self._remove_cache_files(key)
-    
-    def _remove_cache_files(self, key: str):
-        """删除缓存文件"""
-        file_path = self._get_file_path(key)
-        meta_path = self._get_meta_path(key)
-        
+        finally:
+            if tmp_dir is not None:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    def _enforce_budget(self):
+        """总大小超过预算时按最近访问时间淘汰"""
+        if self.max_size is None:
+            return
+
+        with self._lock:
+            total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+            if total <= self.max_size:
+                return
+
+            self._flush_access_locked()
+            victims = []
+            for key, size, fmt in self._db.execute(
+                "SELECT key, size, format FROM entries ORDER BY access_time ASC"
+            ):
+                if total <= self.max_size:
+                    break
+                victims.append((key, fmt))
+                total -= size
+
+            self._db.executemany("DELETE FROM entries WHERE key = ?", [(k,) for k, _ in victims])
+            self.evictions += len(victims)
+
+        for key, fmt in victims:
+            self._unlink_payload(key, fmt)
+        self._notify_removed([key for key, _ in victims])
+
+    def _remove(self, key: str):
+        """删除索引记录和数据文件"""
         try:
-            if file_path.exists():
-                file_path.unlink()
-            if meta_path.exists():
-                meta_path.unlink()
+            with self._lock:
+                self._db.execute("DELETE FROM entries WHERE key = ?", (key,))
+                self._pending_access.pop(key, None)
+            self._unlink_payload(key)
         except Exception as e:
             print(f"删除缓存文件失败: {e}")
-    
+        self._notify_removed([key])
+
     def clear(self):
         """清空磁盘缓存"""
         try:
-            for file_path in self.cache_dir.glob("*.cache"):
-                file_path.unlink()
-            for file_path in self.cache_dir.glob("*.meta"):
-                file_path.unlink()
+            with self._lock:
+                self._db.execute("DELETE FROM entries")
+                self._pending_access.clear()
+            for suffix in self.PAYLOAD_SUFFIXES.values():
+                for path in self.cache_dir.glob(f"*{suffix}"):
+                    if path.is_dir():
+                        shutil.rmtree(path, ignore_errors=True)
+                    else:
+                        path.unlink(missing_ok=True)
         except Exception as e:
             print(f"清空磁盘缓存失败: {e}")
-    
+        self._notify_removed(None)
+
     def cleanup_expired(self):
-        """清理过期的缓存文件"""
+        """清理过期缓存以及写入中断遗留的临时文件"""
         current_time = time.time()
-        
-        for meta_path in self.cache_dir.glob("*.meta"):
+
+        with self._lock:
+            self._flush_access_locked()
+            expired = self._db.execute(
+                "SELECT key, format FROM entries WHERE expires_at < ?", (current_time,)
+            ).fetchall()
+            self._db.executemany("DELETE FROM entries WHERE key = ?", [(k,) for k, _ in expired])
+
+        for key, fmt in expired:
+            self._unlink_payload(key, fmt)
+        self._notify_removed([key for key, _ in expired])
+
+        for tmp_path in self.cache_dir.glob(".*.tmp"):
             try:
-                with open(meta_path, 'r') as f:
-                    meta = json.load(f)
-                
-                if current_time > meta['expires_at']:
-                    key = meta_path.stem
-                    self._remove_cache_files(key)
-                    
-            except Exception as e:
-                print(f"清理过期缓存失败: {e}")
-                # 删除损坏的文件
-                try:
-                    meta_path.unlink()
-                except:
-                    pass
+                if current_time - tmp_path.stat().st_mtime > 3600:
+                    shutil.rmtree(tmp_path, ignore_errors=True)
+            except OSError:
+                pass
+
+    def stats(self) -> Dict[str, Any]:
+        """磁盘缓存统计（直接读取索引，不扫描目录）"""
+        with self._lock:
+            self._flush_access_locked()
+            count, total = self._db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries"
+            ).fetchone()
+            formats = dict(self._db.execute(
+                "SELECT format, COUNT(*) FROM entries GROUP BY format"
+            ).fetchall())
+            codec_rows = self._db.execute(
+                "SELECT codec, COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(raw_size), 0) "
+                "FROM entries GROUP BY codec"
+            ).fetchall()
+            timings = {name: dict(t) for name, t in self._codec_timings.items()}
+
+        compression = {}
+        for name, entries, stored, raw in codec_rows:
+            timing = timings.get(name, {})
+            compression[name] = {
+                "entries": entries,
+                "stored_mb": round(stored / (1024 * 1024), 2),
+                "raw_mb": round(raw / (1024 * 1024), 2),
+                "ratio": round(raw / stored, 2) if stored else 1.0
+            }
+        for name, timing in timings.items():
+            codec_stats = compression.setdefault(name, {"entries": 0})
+            for operation in ("encode", "decode"):
+                calls = timing[f"{operation}_count"]
+                codec_stats[f"{operation}_count"] = int(calls)
+                codec_stats[f"avg_{operation}_ms"] = round(
+                    timing[f"{operation}_seconds"] / calls * 1000, 2
+                ) if calls else 0.0
+
+        lookups = self.hits + self.misses
+        return {
+            "total_files": count,
+            "total_size_mb": round(total / (1024 * 1024), 2),
+            "max_size_mb": round(self.max_size / (1024 * 1024), 2) if self.max_size else None,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "formats": formats,
+            "codec": self.codec_name,
+            "compression": compression
+        }
+
+    def close(self):
+        """写回访问统计并关闭索引"""
+        with self._lock:
+            self._flush_access_locked()
+            self._db.close()
+
+class SingleFlight:
+    """合并同一键的并发调用：第一个调用者执行，其余调用者等待它的结果"""
+
+    def __init__(self):
+        self._lock = Lock()
+        self._calls: Dict[str, Future] = {}
+        self.executions = 0
+        self.coalesced = 0
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            future = self._calls.get(key)
+            is_leader = future is None
+            if is_leader:
+                future = Future()
+                self._calls[key] = future
+                self.executions += 1
+            else:
+                self.coalesced += 1
+
+        if not is_leader:
+            return future.result()
+
+        try:
+            result = fn()
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "executions": self.executions,
+                "coalesced": self.coalesced,
+                "in_flight": len(self._calls)
+            }
+
+class _AsyncCall:
+    """AsyncSingleFlight中一次进行中的调用"""
+
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: "asyncio.Task"):
+        self.task = task
+        self.waiters = 0
+
+
+class AsyncSingleFlight:
+    """SingleFlight的协程版本，按事件循环区分等待中的调用
+
+    计算在独立的任务中执行，所有调用者（包括发起者）通过 shield 等待它：
+    任一调用者被取消都不影响计算和其他调用者；所有调用者都取消后才取消计算
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._calls: Dict[Tuple[int, str], _AsyncCall] = {}
+        self.executions = 0
+        self.coalesced = 0
+
+    async def do(self, key: str, coro_fn: Callable[[], Awaitable[Any]]) -> Any:
+        loop = asyncio.get_running_loop()
+        call_key = (id(loop), key)
+
+        with self._lock:
+            call = self._calls.get(call_key)
+            if call is None:
+                call = _AsyncCall(loop.create_task(coro_fn()))
+                call.task.add_done_callback(lambda task: self._finish(call_key, call))
+                self._calls[call_key] = call
+                self.executions += 1
+            else:
+                self.coalesced += 1
+            call.waiters += 1
+
+        try:
+            return await asyncio.shield(call.task)
+        except asyncio.CancelledError:
+            with self._lock:
+                abandoned = call.waiters == 1
+            if abandoned and not call.task.done():
+                call.task.cancel()
+            raise
+        finally:
+            with self._lock:
+                call.waiters -= 1
+
+    def _finish(self, call_key: Tuple[int, str], call: _AsyncCall):
+        with self._lock:
+            if self._calls.get(call_key) is call:
+                del self._calls[call_key]
+        # 没有等待者时也要消费异常，避免 "exception was never retrieved" 警告
+        if not call.task.cancelled():
+            call.task.exception()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "executions": self.executions,
+                "coalesced": self.coalesced,
+                "in_flight": len(self._calls)
+            }
 
 class CacheManager:
     """统一缓存管理器"""
     
     def __init__(self):
         self.config = get_config()
-        self.memory_cache = InMemoryCache()
-        self.disk_cache = DiskCache(self.config.get_cache_path())
-        self._cleanup_timer = None
+        self.memory_cache = ShardedCache(
+            max_size=self.config.cache.memory_cache_size,
+            num_shards=self.config.cache.cache_shards,
+            admission_policy=self.config.cache.admission_policy
+        )
+        self.disk_cache = DiskCache(
+            self.config.get_cache_path(),
+            max_size=self.config.data.max_cache_size,
+            codec=self.config.cache.disk_cache_codec,
+            compression_level=self.config.cache.compression_level,
+            compression_min_size=self.config.cache.compression_min_size,
+            compress_arrays=self.config.cache.compress_arrays
+        )
+        self._flight = SingleFlight()
+        self._async_flight = AsyncSingleFlight()
+        # 因内存压力被淘汰、已转存到磁盘的键；磁盘条目被淘汰、过期或删除时同步移除
+        self._spilled_keys: set = set()
+        self._spill_lock = Lock()
+        self.disk_cache.add_removal_listener(self._forget_spilled)
+        self._spill_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="cache-spill")
+        self.spilled = 0
+        self.monitor = MemoryPressureMonitor(
+            base_budget=self.config.cache.memory_cache_size,
+            on_budget_change=self._on_budget_change,
+            threshold=self.config.performance.memory_threshold,
+            process_limit=self.config.performance.process_memory_limit,
+            interval=self.config.performance.memory_check_interval
+        )
+        self.monitor.add_listener(self._on_pressure_change)
+        self._stop_event = threading.Event()
+        self._cleanup_thread: Optional[threading.Thread] = None
         self._start_cleanup_timer()
+        self.monitor.start()
     
-    def cache_result(self, ttl: int = 3600, use_disk: bool = False):
-        """缓存装饰器"""
+    def cache_result(self, ttl: int = 3600, use_disk: bool = False,
+                     key_func: Optional[Callable[..., Any]] = None):
+        """缓存装饰器
+
+        同一键的并发未命中只执行一次被装饰函数，其余调用者等待其结果；
+        协程函数会自动使用异步版本
+
+        Args:
+            key_func: 自定义键函数，接收与被装饰函数相同的参数，返回用于计算缓存键的值
+        """
         def decorator(func):
+            func_name = f"{func.__module__}.{func.__qualname__}"
+
+            def build_key(args, kwargs):
+                if key_func is not None:
+                    return self.memory_cache._generate_key(func_name, (key_func(*args, **kwargs),), {})
+                return self.memory_cache._generate_key(func_name, args, kwargs)
+
+            if inspect.iscoroutinefunction(func):
+                @wraps(func)
+                async def async_wrapper(*args, **kwargs):
+                    key = build_key(args, kwargs)
+
+                    result = self.memory_cache.get(key)
+                    if result is not None:
+                        return result
+
+                    async def compute():
+                        # 磁盘查找、反序列化和写入都是阻塞操作，放到线程中执行，不占用事件循环
+                        result = await asyncio.to_thread(self._lookup_after_miss, key, ttl, use_disk)
+                        if result is not None:
+                            return result
+                        result = await func(*args, **kwargs)
+                        await asyncio.to_thread(self._store, key, result, ttl, use_disk)
+                        return result
+
+                    return await self._async_flight.do(key, compute)
+                return async_wrapper
+
             @wraps(func)
             def wrapper(*args, **kwargs):
                 # 生成缓存键
-                key = self.memory_cache._generate_key(func.__name__, args, kwargs)
+                key = build_key(args, kwargs)
                 
                 # 先尝试内存缓存
                 result = self.memory_cache.get(key)
                 if result is not None:
                     return result
                 
-                # 再尝试磁盘缓存
-                if use_disk and self.config.cache.enable_data_cache:
-                    result = self.disk_cache.get(key)
+                def compute():
+                    result = self._lookup_after_miss(key, ttl, use_disk)
                     if result is not None:
-                        # 将结果放回内存缓存
-                        self.memory_cache.set(key, result, ttl)
                         return result
+                    # 缓存未命中，执行函数
+                    result = func(*args, **kwargs)
+                    self._store(key, result, ttl, use_disk)
+                    return result
                 
-                # 缓存未命中，执行函数
-                result = func(*args, **kwargs)
-                
-                # 保存到缓存
-                self.memory_cache.set(key, result, ttl)
-                if use_disk and self.config.cache.enable_data_cache:
-                    self.disk_cache.set(key, result, ttl)
-                
-                return result
+                return self._flight.do(key, compute)
             return wrapper
         return decorator
     
-    def _start_cleanup_timer(self):
-        """启动定期清理任务"""
-        import threading
+    def _lookup_after_miss(self, key: str, ttl: int, use_disk: bool) -> Optional[Any]:
+        """在single-flight内部再次查找缓存（上一个执行者可能刚写入）"""
+        result = self.memory_cache.get(key)
+        if result is not None:
+            return result
         
+        # 再尝试磁盘缓存（包括因内存压力转存到磁盘的条目）
+        with self._spill_lock:
+            spilled = key in self._spilled_keys
+        if (use_disk or spilled) and self.config.cache.enable_data_cache:
+            result = self.disk_cache.get(key)
+            if result is not None:
+                # 将结果放回内存缓存
+                self.memory_cache.set(key, result, ttl)
+                return result
+            if spilled:
+                # 转存写入失败，磁盘上没有该条目
+                self._forget_spilled([key])
+        return None
+    
+    def _store(self, key: str, result: Any, ttl: int, use_disk: bool):
+        """保存到缓存"""
+        self.memory_cache.set(key, result, ttl)
+        if use_disk and self.config.cache.enable_data_cache:
+            self.disk_cache.set(key, result, ttl)
+    
+    def _on_budget_change(self, budget: int):
+        """内存压力监控调整预算：淘汰超出部分并转存到磁盘"""
+        evicted = self.memory_cache.resize(budget)
+        if evicted:
+            self._spill(evicted)
+
+    def _on_pressure_change(self, old_level: str, new_level: str, sample: Dict[str, Any]):
+        if new_level == "critical":
+            gc.collect()
+
+    def _spill(self, evicted: List[Tuple[str, CacheEntry]]):
+        """在后台线程把被淘汰的未过期条目写入磁盘缓存"""
+        if not self.config.cache.enable_data_cache:
+            return
+
+        def spill_task():
+            for key, entry in evicted:
+                remaining = entry.ttl - (time.time() - entry.created_time)
+                if remaining <= 0:
+                    continue
+                # 先登记再写入：写入触发的预算淘汰若删掉了该条目，删除通知会把登记移除
+                with self._spill_lock:
+                    self._spilled_keys.add(key)
+                    self.spilled += 1
+                self.disk_cache.set(key, entry.value, int(remaining))
+
+        try:
+            self._spill_executor.submit(spill_task)
+        except RuntimeError:
+            # 已调用stop()，不再转存
+            pass
+
+    def _forget_spilled(self, keys: Optional[List[str]]):
+        """磁盘缓存删除条目后移除对应的转存记录（None表示磁盘缓存已清空）"""
+        with self._spill_lock:
+            if keys is None:
+                self._spilled_keys.clear()
+            else:
+                self._spilled_keys.difference_update(keys)
+
+    def _start_cleanup_timer(self):
+        """启动定期清理任务（调用stop()后退出）"""
         def cleanup_task():
-            while True:
-                time.sleep(self.config.cache.cache_cleanup_interval)
+            while not self._stop_event.wait(self.config.cache.cache_cleanup_interval):
                 self.cleanup()
-        
-        cleanup_thread = threading.Thread(target=cleanup_task, daemon=True)
-        cleanup_thread.start()
-    
+
+        self._cleanup_thread = threading.Thread(target=cleanup_task, name="cache-cleanup", daemon=True)
+        self._cleanup_thread.start()
+
     def cleanup(self):
-        """清理过期缓存"""
+        """清理过期缓存，并立即做一次内存压力检测"""
         try:
             # 清理磁盘缓存
             self.disk_cache.cleanup_expired()
-            
-            # 检查内存使用率
-            memory_percent = psutil.virtual_memory().percent
-            if memory_percent > self.config.performance.memory_threshold * 100:
-                # 内存使用率过高，清理部分内存缓存
-                self.memory_cache._evict_entries(self.memory_cache.current_size // 4)
-                gc.collect()  # 强制垃圾回收
-                
+            self.monitor.check()
         except Exception as e:
             print(f"缓存清理失败: {e}")
-    
+
+    def stop(self, timeout: float = 5.0):
+        """停止清理线程和内存压力监控，等待转存任务完成"""
+        self._stop_event.set()
+        self.monitor.stop(timeout)
+        if self._cleanup_thread is not None:
+            self._cleanup_thread.join(timeout)
+            self._cleanup_thread = None
+        self._spill_executor.shutdown(wait=True)
+
     def get_stats(self) -> Dict[str, Any]:
         """获取缓存统计信息"""
         memory_stats = self.memory_cache.stats()
-        
-        # 磁盘缓存统计
-        disk_files = list(self.disk_cache.cache_dir.glob("*.cache"))
-        disk_size = sum(f.stat().st_size for f in disk_files)
-        
         system_memory = psutil.virtual_memory()
         
         return {
             "memory_cache": memory_stats,
-            "disk_cache": {
-                "total_files": len(disk_files),
-                "total_size_mb": round(disk_size / (1024 * 1024), 2)
+            "key_fingerprints": fingerprint_cache_stats(),
+            "single_flight": {
+                "sync": self._flight.stats(),
+                "async": self._async_flight.stats()
             },
+            "disk_cache": self.disk_cache.stats(),
+            "memory_pressure": dict(self.monitor.stats(), spilled_entries=self.spilled,
+                                    spilled_on_disk=len(self._spilled_keys)),
             "system_memory": {
                 "total_gb": round(system_memory.total / (1024**3), 2),
                 "available_gb": round(system_memory.available / (1024**3), 2),
@@ -371,9 +1354,10 @@ def get_cache_manager() -> CacheManager:
     return _cache_manager
 
 # 便捷装饰器
-def cache_result(ttl: int = 3600, use_disk: bool = False):
+def cache_result(ttl: int = 3600, use_disk: bool = False,
+                 key_func: Optional[Callable[..., Any]] = None):
     """缓存结果装饰器"""
-    return get_cache_manager().cache_result(ttl, use_disk)
+    return get_cache_manager().cache_result(ttl, use_disk, key_func)
 
 if __name__ == "__main__":
     # 缓存系统测试
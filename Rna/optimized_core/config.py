@@ -18,6 +18,9 @@ class ServerConfig:
     mcp_port: int = 8000
     log_level: str = "INFO"
     max_workers: int = 4
+    ws_queue_size: int = 100  # 每个WebSocket客户端的发送队列长度，满时丢弃最旧消息
+    ws_compress_threshold: int = 64 * 1024  # 客户端开启压缩时，超过该大小的消息以zlib二进制帧发送
+    ws_send_timeout: float = 10.0  # 单条消息发送超时（秒），超时断开慢客户端
 
 @dataclass
 class DataConfig:
@@ -36,6 +39,12 @@ class PerformanceConfig:
     max_log_file_size: int = 100 * 1024 * 1024  # 100MB
     log_backup_count: int = 5
     memory_threshold: float = 0.8  # 80%内存使用率阈值
+    memory_check_interval: float = 2.0  # 内存压力采样间隔（秒）
+    process_memory_limit: int = 0  # 进程RSS上限（字节），0表示只看系统内存
+    job_workers: int = 2  # 后台分析作业的工作线程数
+    max_jobs: int = 1000  # 保留的作业记录数，超出时淘汰最早结束的作业
+    max_sessions: int = 16  # 同时保留的执行会话数，超出时淘汰最久未使用的会话
+    session_idle_timeout: int = 1800  # 会话空闲超时（秒），超时后adata转存到磁盘
 
 @dataclass
 class CacheConfig:
@@ -44,6 +53,14 @@ class CacheConfig:
     enable_plot_cache: bool = True
     enable_result_cache: bool = True
     cache_cleanup_interval: int = 3600  # 1小时清理一次
+    memory_cache_size: int = 512 * 1024 * 1024  # 内存缓存预算 512MB
+    admission_policy: str = "lru"  # "lru" 或 "tinylfu"
+    cache_shards: int = 16  # 内存缓存分片数（每个分片独立加锁）
+    step_cache_size: int = 512 * 1024 * 1024  # 分析步骤状态快照缓存预算 512MB
+    disk_cache_codec: str = "auto"  # "auto"（按数据类型选择）/ "none" / "zstd" / "lz4" / "zlib"
+    compression_level: Optional[int] = None  # 为空时使用各编解码器的默认级别
+    compression_min_size: int = 64 * 1024  # 小于该大小的条目不压缩
+    compress_arrays: bool = True  # 压缩节省不足10%的数组保留原始格式（内存映射读取），关闭后数组一律不压缩
 
 class Config:
     """统一配置管理器"""
@@ -64,20 +81,42 @@ class Config:
         self.server.mcp_port = int(os.getenv("MCP_PORT", "8000"))
         self.server.log_level = os.getenv("LOG_LEVEL", "INFO")
         self.server.max_workers = int(os.getenv("MAX_WORKERS", "4"))
+        self.server.ws_queue_size = int(os.getenv("WS_QUEUE_SIZE", str(self.server.ws_queue_size)))
+        self.server.ws_compress_threshold = int(os.getenv("WS_COMPRESS_THRESHOLD", str(self.server.ws_compress_threshold)))
+        self.server.ws_send_timeout = float(os.getenv("WS_SEND_TIMEOUT", str(self.server.ws_send_timeout)))
         
         # 数据配置
         self.data.pbmc3k_path = os.getenv("PBMC3K_PATH", self.data.pbmc3k_path)
         self.data.cache_dir = os.getenv("CACHE_DIR", "cache")
         self.data.plots_dir = os.getenv("PLOTS_DIR", "tmp/plots")
+        self.data.max_cache_size = int(os.getenv("MAX_CACHE_SIZE", str(self.data.max_cache_size)))
         
         # 性能配置
         self.performance.max_concurrent_requests = int(os.getenv("MAX_CONCURRENT_REQUESTS", "10"))
         self.performance.request_timeout = int(os.getenv("REQUEST_TIMEOUT", "300"))
+        self.performance.memory_threshold = float(os.getenv("MEMORY_THRESHOLD", str(self.performance.memory_threshold)))
+        self.performance.memory_check_interval = float(os.getenv("MEMORY_CHECK_INTERVAL", str(self.performance.memory_check_interval)))
+        self.performance.process_memory_limit = int(os.getenv("PROCESS_MEMORY_LIMIT", str(self.performance.process_memory_limit)))
+        self.performance.job_workers = int(os.getenv("JOB_WORKERS", str(self.performance.job_workers)))
+        self.performance.max_jobs = int(os.getenv("MAX_JOBS", str(self.performance.max_jobs)))
+        self.performance.max_sessions = int(os.getenv("MAX_SESSIONS", str(self.performance.max_sessions)))
+        self.performance.session_idle_timeout = int(os.getenv("SESSION_IDLE_TIMEOUT", str(self.performance.session_idle_timeout)))
+        self.performance.max_log_file_size = int(os.getenv("MAX_LOG_FILE_SIZE", str(self.performance.max_log_file_size)))
+        self.performance.log_backup_count = int(os.getenv("LOG_BACKUP_COUNT", str(self.performance.log_backup_count)))
         
         # 缓存配置
         self.cache.enable_data_cache = os.getenv("ENABLE_DATA_CACHE", "true").lower() == "true"
         self.cache.enable_plot_cache = os.getenv("ENABLE_PLOT_CACHE", "true").lower() == "true"
         self.cache.enable_result_cache = os.getenv("ENABLE_RESULT_CACHE", "true").lower() == "true"
+        self.cache.memory_cache_size = int(os.getenv("MEMORY_CACHE_SIZE", str(self.cache.memory_cache_size)))
+        self.cache.admission_policy = os.getenv("CACHE_ADMISSION_POLICY", self.cache.admission_policy)
+        self.cache.cache_shards = int(os.getenv("CACHE_SHARDS", str(self.cache.cache_shards)))
+        self.cache.step_cache_size = int(os.getenv("STEP_CACHE_SIZE", str(self.cache.step_cache_size)))
+        self.cache.disk_cache_codec = os.getenv("DISK_CACHE_CODEC", self.cache.disk_cache_codec)
+        if os.getenv("DISK_CACHE_COMPRESSION_LEVEL"):
+            self.cache.compression_level = int(os.getenv("DISK_CACHE_COMPRESSION_LEVEL"))
+        self.cache.compression_min_size = int(os.getenv("DISK_CACHE_COMPRESSION_MIN_SIZE", str(self.cache.compression_min_size)))
+        self.cache.compress_arrays = os.getenv("DISK_CACHE_COMPRESS_ARRAYS", "true").lower() == "true"
     
     def _ensure_directories(self):
         """确保必要的目录存在"""
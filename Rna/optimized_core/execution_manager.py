@@ -6,31 +6,180 @@ RNA项目优化版本 - 执行环境管理器
 
 import os
 import sys
+import glob
 import time
 import threading
 import traceback
 import json
+import asyncio
+from concurrent.futures import Future, ThreadPoolExecutor
+from collections import OrderedDict
 from io import StringIO
-from typing import Dict, Any, Optional, List, Tuple
-from contextlib import redirect_stdout, redirect_stderr
+from typing import Dict, Any, Iterator, Optional, List, Tuple
+from contextlib import contextmanager, redirect_stdout, redirect_stderr
 from datetime import datetime
-import matplotlib
-matplotlib.use('Agg')  # 使用非交互式后端
-import matplotlib.pyplot as plt
+
+from config import get_config
+from cache_keys import bump_generation
+from fork_server import SpawnError
+
+
+class ExecutorSaturated(Exception):
+    """在途任务已达上限"""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"执行队列已满，请 {retry_after} 秒后重试")
+        self.retry_after = retry_after
+
+
+class BoundedExecutor:
+    """有界执行器：线程池 + 在途任务上限，队列满时立即拒绝而不是无限排队
+
+    让异步服务器把耗时的同步分析代码移出事件循环线程
+    """
+
+    def __init__(self, max_workers: int = 4, max_pending: int = 10):
+        self.max_workers = max_workers
+        self.max_pending = max(max_pending, max_workers)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="rna-exec")
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._stats_lock = threading.Lock()
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.total_duration = 0.0
+
+    def submit(self, fn, *args, **kwargs) -> Future:
+        """提交任务；在途任务（执行中+排队中）达到上限时抛出 ExecutorSaturated"""
+        if not self._slots.acquire(blocking=False):
+            with self._stats_lock:
+                self.rejected += 1
+            raise ExecutorSaturated(self.retry_after())
+
+        with self._stats_lock:
+            self.in_flight += 1
+
+        def timed():
+            start = time.time()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                with self._stats_lock:
+                    self.total_duration += time.time() - start
+
+        try:
+            future = self._executor.submit(timed)
+        except Exception:
+            self._release(None)
+            raise
+        # 超时只是不再等待结果，名额在任务真正结束（或排队时被取消）后才归还
+        future.add_done_callback(self._release)
+        return future
+
+    def _release(self, future: Optional[Future]):
+        with self._stats_lock:
+            self.in_flight -= 1
+            if future is not None and not future.cancelled():
+                self.completed += 1
+        self._slots.release()
+
+    async def run(self, fn, *args, timeout: Optional[float] = None, **kwargs) -> Any:
+        """在线程池中执行并等待结果，超时抛出 asyncio.TimeoutError"""
+        future = self.submit(fn, *args, **kwargs)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+        except asyncio.TimeoutError:
+            with self._stats_lock:
+                self.timeouts += 1
+            raise
+
+    def retry_after(self) -> int:
+        """根据平均执行时间估算重试等待秒数"""
+        with self._stats_lock:
+            avg = self.total_duration / self.completed if self.completed else 1.0
+            waves = max(self.in_flight, 1) / self.max_workers
+        return max(1, int(avg * waves + 0.5))
+
+    def stats(self) -> Dict[str, Any]:
+        """执行器统计"""
+        with self._stats_lock:
+            return {
+                "max_workers": self.max_workers,
+                "max_pending": self.max_pending,
+                "in_flight": self.in_flight,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "timeouts": self.timeouts,
+                "avg_duration": round(self.total_duration / self.completed, 3) if self.completed else 0.0
+            }
+
+    def shutdown(self, wait: bool = False):
+        self._executor.shutdown(wait=wait, cancel_futures=True)
+
+class ExecutionSession:
+    """会话执行环境：本进程内的独立命名空间，或Fork服务器中的独立工作进程"""
+
+    def __init__(self, session_id: Optional[str], namespace: Optional[Dict[str, Any]] = None,
+                 worker=None):
+        self.session_id = session_id
+        self.namespace = namespace
+        self.worker = worker
+        # 同一会话的请求串行执行，不同会话互不阻塞
+        self.lock = threading.Lock()
+        self.created_time = time.time()
+        self.last_used = self.created_time
+        self.executions = 0
+        self.closed = False
+
+    @property
+    def forked(self) -> bool:
+        return self.worker is not None
+
+    @property
+    def alive(self) -> bool:
+        """会话可用：未被淘汰/关闭，Fork会话的工作进程仍在运行"""
+        return not self.closed and not (self.forked and self.worker.closed)
+
 
 class ExecutionManager:
-    """优化的执行管理器"""
+    """优化的执行管理器
+
+    - 不指定 session_id 时使用默认执行环境（与之前的单例行为一致）
+    - 每个 session_id 拥有独立的命名空间，从预热好的基础命名空间浅拷贝而来，无需重复导入模块
+    - 挂接Fork会话服务器后，每个会话在独立的工作进程中执行，多个会话可同时利用多核；
+      否则会话在本进程内执行，命名空间隔离但执行串行（pyplot和标准输出是进程级全局状态）
+    - 会话数超过上限或空闲超时时淘汰最久未使用的会话，其adata转存为h5ad，再次访问时自动恢复
+    - 构造时不导入scanpy等重量级模块：首次执行代码时初始化，或由服务器启动后调用 warm_up 在后台预热
+    """
     
-    def __init__(self):
+    def __init__(self, max_sessions: int = 16, session_idle_timeout: float = 1800,
+                 spill_dir: str = "cache/sessions", execution_timeout: Optional[float] = None):
+        """
+        Args:
+            execution_timeout: Fork会话单次执行的超时（秒），超时的工作进程被终止，下次访问时重新创建
+        """
         self.initialized = False
+        self.execution_timeout = execution_timeout
         self.lock = threading.Lock()
         self.globals_dict = {}
+        self.max_sessions = max_sessions
+        self.session_idle_timeout = session_idle_timeout
+        self.spill_dir = spill_dir
+        self.fork_server = None
+        self._base_namespace: Dict[str, Any] = {}
+        self._sessions: "OrderedDict[str, ExecutionSession]" = OrderedDict()
+        self._sessions_lock = threading.Lock()
         self.stats = {
             "total_executions": 0,
             "total_execution_time": 0.0,
-            "cache_hits": 0
+            "cache_hits": 0,
+            "sessions_created": 0,
+            "sessions_evicted": 0,
+            "sessions_restored": 0
         }
-        self._init_environment()
+        self.init_time: Optional[float] = None
+        self._default_session = ExecutionSession(None, namespace=self.globals_dict)
     
     def _init_environment(self):
         """初始化执行环境"""
@@ -45,6 +194,8 @@ class ExecutionManager:
             start_time = time.time()
             
             init_code = """
+import matplotlib
+matplotlib.use('Agg')  # 使用非交互式后端
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
@@ -63,19 +214,202 @@ print("✅ RNA分析环境初始化完成")
             
             try:
                 exec(init_code, self.globals_dict)
+                # 预热后的基础命名空间：新会话浅拷贝即可获得已导入的模块
+                self._base_namespace = dict(self.globals_dict)
                 self.initialized = True
-                init_time = time.time() - start_time
-                print(f"✅ [执行环境] 初始化完成，耗时: {init_time:.2f}s")
+                self.init_time = time.time() - start_time
+                print(f"✅ [执行环境] 初始化完成，耗时: {self.init_time:.2f}s")
             except Exception as e:
                 print(f"❌ [执行环境] 初始化失败: {e}")
                 raise
+
+    def warm_up(self) -> float:
+        """预热执行环境（导入scanpy等模块），返回初始化耗时；已初始化时立即返回"""
+        self._init_environment()
+        return self.init_time or 0.0
+
+    def attach_fork_server(self, fork_server):
+        """挂接已启动的Fork会话服务器，之后新建的会话在独立工作进程中执行"""
+        self.fork_server = fork_server
+        print(f"🧩 [执行环境] 会话使用Fork工作进程执行")
+
+    def _spill_path(self, session_id: str) -> str:
+        safe_id = "".join(c if c.isalnum() or c in "-_" else "_" for c in session_id)
+        return os.path.join(self.spill_dir, f"{safe_id}.h5ad")
+
+    def _create_session(self, session_id: str) -> ExecutionSession:
+        worker = None
+        if self.fork_server is not None:
+            try:
+                worker = self.fork_server.get_or_spawn(session_id)
+            except SpawnError as e:
+                # 模板进程已退出或fork失败，会话回退到本进程内执行
+                print(f"⚠️ [执行环境] {e}，会话 {session_id} 在进程内执行")
+        if worker is not None:
+            session = ExecutionSession(session_id, worker=worker)
+        else:
+            session = ExecutionSession(session_id, namespace=dict(self._base_namespace))
+
+        # 恢复之前被淘汰时转存的adata
+        spill_path = self._spill_path(session_id)
+        if os.path.exists(spill_path):
+            result = self._run_in_session(session, f"adata = sc.read_h5ad({spill_path!r})")
+            if result["success"]:
+                os.remove(spill_path)
+                self.stats["sessions_restored"] += 1
+                print(f"♻️ [执行环境] 会话 {session_id} 已从磁盘恢复adata")
+            else:
+                print(f"⚠️ [执行环境] 会话 {session_id} 恢复adata失败: {result['error']}")
+        return session
+
+    def _get_session(self, session_id: Optional[str]) -> ExecutionSession:
+        """获取会话，不存在时创建；必要时先淘汰空闲或最久未使用的会话"""
+        # 预热尚未完成时在这里等待（初始化持有执行锁）
+        self._init_environment()
+        if session_id is None:
+            return self._default_session
+
+        now = time.time()
+        evicted: List[ExecutionSession] = []
+        with self._sessions_lock:
+            session = self._sessions.get(session_id)
+            if session is not None and session.alive:
+                self._sessions.move_to_end(session_id)
+                session.last_used = now
+                return session
+            if session is not None:
+                # 工作进程已退出（崩溃或执行超时被终止），状态无法恢复，重新创建
+                print(f"⚠️ [执行环境] 会话 {session_id} 的工作进程已退出，重新创建")
+                del self._sessions[session_id]
+            for sid, idle_session in list(self._sessions.items()):
+                if now - idle_session.last_used > self.session_idle_timeout:
+                    evicted.append(self._sessions.pop(sid))
+            while len(self._sessions) >= self.max_sessions:
+                evicted.append(self._sessions.popitem(last=False)[1])
+
+        # 先转存再创建，新会话的工作进程不会挤掉尚未转存的旧会话
+        for old_session in evicted:
+            self._evict_session(old_session)
+
+        # 创建（可能包含从磁盘恢复adata）不占用会话表锁，其他会话不受影响
+        session = self._create_session(session_id)
+        with self._sessions_lock:
+            existing = self._sessions.get(session_id)
+            if existing is None:
+                self._sessions[session_id] = session
+                self.stats["sessions_created"] += 1
+                return session
+        # 并发请求已创建了同一会话
+        if session.forked:
+            session.worker.close()
+        return existing
+
+    def _evict_session(self, session: ExecutionSession):
+        """把会话的adata转存到磁盘并释放会话"""
+        self.stats["sessions_evicted"] += 1
+        with session.lock:
+            try:
+                if not session.alive:
+                    # 工作进程已退出，没有可转存的状态
+                    return
+                os.makedirs(self.spill_dir, exist_ok=True)
+                spill_path = self._spill_path(session.session_id)
+                result = self._run_in_session(
+                    session,
+                    f"if 'adata' in globals():\n    adata.write_h5ad({spill_path!r})"
+                )
+                if not result["success"]:
+                    print(f"⚠️ [执行环境] 会话 {session.session_id} 转存adata失败: {result['error']}")
+                elif os.path.exists(spill_path):
+                    print(f"💾 [执行环境] 会话 {session.session_id} 已淘汰，adata转存至 {spill_path}")
+            finally:
+                session.closed = True
+                if session.forked:
+                    session.worker.close()
+                session.namespace = None
+
+    @contextmanager
+    def _locked_session(self, session_id: Optional[str]) -> Iterator[ExecutionSession]:
+        """获取会话并持有其锁
+
+        _get_session 返回后会话可能被并发淘汰或关闭（淘汰时已转存adata）；
+        此时重新获取，新会话会自动从磁盘恢复，而不是让请求失败
+        """
+        for _ in range(3):
+            session = self._get_session(session_id)
+            session.lock.acquire()
+            if session.alive:
+                break
+            session.lock.release()
+        else:
+            raise RuntimeError(f"会话不可用: {session_id}")
+        try:
+            yield session
+        finally:
+            session.lock.release()
+
+    def cleanup_idle_sessions(self) -> int:
+        """淘汰空闲超时的会话，返回淘汰数量"""
+        now = time.time()
+        with self._sessions_lock:
+            idle = [sid for sid, s in self._sessions.items() if now - s.last_used > self.session_idle_timeout]
+            evicted = [self._sessions.pop(sid) for sid in idle]
+        for session in evicted:
+            self._evict_session(session)
+        return len(evicted)
+
+    def close_session(self, session_id: str, spill: bool = False) -> bool:
+        """关闭会话；spill为True时先转存adata，下次访问自动恢复"""
+        with self._sessions_lock:
+            session = self._sessions.pop(session_id, None)
+        if session is None:
+            return False
+        if spill:
+            self._evict_session(session)
+        else:
+            with session.lock:
+                session.closed = True
+                if session.forked:
+                    session.worker.close()
+                session.namespace = None
+        return True
     
-    def execute_code(self, code: str) -> Dict[str, Any]:
-        """执行代码"""
+    def _run_in_session(self, session: ExecutionSession, code: str) -> Dict[str, Any]:
+        """在会话中执行代码（调用方需持有会话锁）"""
+        if not session.forked and session.namespace is None:
+            raise RuntimeError(f"会话已被淘汰: {session.session_id}")
+        if session.forked:
+            try:
+                result = session.worker.execute(code, timeout=self.execution_timeout)
+            except TimeoutError as e:
+                # 工作进程已被终止，下次访问该会话时重新创建
+                return {"success": False, "stdout": "", "stderr": str(e), "error": str(e),
+                        "plots": [], "execution_time": self.execution_timeout or 0.0}
+            # 工作进程返回绝对路径，统一为与本进程执行一致的相对路径
+            result["plots"] = [os.path.relpath(p) for p in result["plots"]]
+            return result
+        # 本进程执行共享pyplot和标准输出，需要全局串行
+        with self.lock:
+            return self._execute_with_capture(code, session.namespace)
+
+    def execute_code(self, code: str, session_id: Optional[str] = None) -> Dict[str, Any]:
+        """执行代码
+
+        Args:
+            code: 要执行的代码
+            session_id: 会话ID，为空时使用默认执行环境
+        """
+        with self._locked_session(session_id) as session:
+            result = self._run_in_session(session, code)
+            session.executions += 1
+            session.last_used = time.time()
+
         with self.lock:
-            return self._execute_with_capture(code)
+            self.stats["total_executions"] += 1
+            self.stats["total_execution_time"] += result["execution_time"]
+        return result
     
-    def _execute_with_capture(self, code: str) -> Dict[str, Any]:
+    def _execute_with_capture(self, code: str, namespace: Dict[str, Any]) -> Dict[str, Any]:
         """执行代码并捕获输出"""
         start_time = time.time()
         
@@ -86,16 +420,16 @@ print("✅ RNA分析环境初始化完成")
         
         try:
             with redirect_stdout(stdout_capture), redirect_stderr(stderr_capture):
-                exec(code, self.globals_dict)
+                exec(code, namespace)
             plot_paths = self._save_plots()
         except Exception as e:
             error_msg = str(e)
             stderr_capture.write(f"\nError: {error_msg}\n")
             stderr_capture.write(traceback.format_exc())
+        # 代码可能原地修改了adata（报错前的部分修改也算），缓存的指纹不再可信
+        bump_generation()
         
         execution_time = time.time() - start_time
-        self.stats["total_executions"] += 1
-        self.stats["total_execution_time"] += execution_time
         
         return {
             "success": error_msg is None,
@@ -110,6 +444,11 @@ print("✅ RNA分析环境初始化完成")
         """保存matplotlib图表"""
         plot_paths = []
         
+        # 没有导入过pyplot的代码不可能生成图表
+        plt = sys.modules.get("matplotlib.pyplot")
+        if plt is None:
+            return plot_paths
+        
         try:
             fig_nums = plt.get_fignums()
             if fig_nums:
@@ -130,18 +469,150 @@ print("✅ RNA分析环境初始化完成")
         
         return plot_paths
     
+    def get_variable(self, name: str, default: Any = None, session_id: Optional[str] = None) -> Any:
+        """读取执行环境中的变量（Fork工作进程中的变量通过pickle传回）"""
+        with self._locked_session(session_id) as session:
+            if session.forked:
+                value = session.worker.get_variable(name)
+                return default if value is None else value
+            return session.namespace.get(name, default)
+
+    def set_variable(self, name: str, value: Any, session_id: Optional[str] = None):
+        """写入执行环境中的变量"""
+        with self._locked_session(session_id) as session:
+            if session.forked:
+                session.worker.set_variable(name, value)
+            else:
+                session.namespace[name] = value
+
+    def is_forked(self, session_id: Optional[str] = None) -> bool:
+        """会话是否在Fork工作进程中执行；只查询已有会话，不存在或已失效时返回False（不会创建或Fork会话）"""
+        if session_id is None:
+            return self._default_session.forked
+        with self._sessions_lock:
+            session = self._sessions.get(session_id)
+        return session is not None and session.alive and session.forked
+
+    def fingerprint_variable(self, name: str, session_id: Optional[str] = None) -> Optional[str]:
+        """变量的内容指纹（变量不存在时为None）；Fork会话在工作进程中计算，只传回指纹"""
+        with self._locked_session(session_id) as session:
+            if session.forked:
+                return session.worker.fingerprint_variable(name)
+            value = session.namespace.get(name)
+        from cache_keys import fingerprint
+        return fingerprint(value) if value is not None else None
+
+    def snapshot_variable(self, name: str, key: str, session_id: Optional[str] = None) -> Optional[str]:
+        """在Fork会话的工作进程中保存变量快照，返回变量指纹（仅用于Fork会话）"""
+        with self._locked_session(session_id) as session:
+            if not session.forked:
+                raise RuntimeError(f"会话不在Fork工作进程中执行: {session_id}")
+            return session.worker.snapshot_variable(name, key)
+
+    def restore_snapshot(self, name: str, key: str, session_id: Optional[str] = None) -> bool:
+        """用Fork会话工作进程中的快照替换变量，快照不存在时返回False（仅用于Fork会话）"""
+        with self._locked_session(session_id) as session:
+            if not session.forked:
+                raise RuntimeError(f"会话不在Fork工作进程中执行: {session_id}")
+            return session.worker.restore_snapshot(name, key)
+
+    def share_adata(self, obsm_keys: Optional[List[str]] = None, obs_keys: Optional[List[str]] = None,
+                    include_X: bool = False, session_id: Optional[str] = None) -> Dict[str, Any]:
+        """把会话中的adata导出到共享内存，返回可传给其他进程的句柄字典
+
+        Fork会话在其工作进程中导出（共享内存归工作进程所有），只传回句柄
+        """
+        from shared_anndata import share_anndata
+
+        with self._locked_session(session_id) as session:
+            if session.forked:
+                export = session.worker.execute(
+                    "if 'adata' not in globals():\n"
+                    "    raise ValueError('当前执行环境中没有adata，请先加载数据')\n"
+                    "from shared_anndata import share_anndata as _share_anndata\n"
+                    f"_shared_handle = _share_anndata(adata, obsm_keys={obsm_keys!r}, obs_keys={obs_keys!r}, "
+                    f"include_X={include_X!r}).to_dict()",
+                    timeout=self.execution_timeout
+                )
+                if not export["success"]:
+                    raise ValueError(export["error"])
+                return session.worker.get_variable("_shared_handle")
+
+            adata = session.namespace.get('adata')
+            if adata is None:
+                raise ValueError("当前执行环境中没有adata，请先加载数据")
+            return share_anndata(adata, obsm_keys=obsm_keys, obs_keys=obs_keys, include_X=include_X).to_dict()
+
+    def release_shared(self, handle_id: str, session_id: Optional[str] = None) -> bool:
+        """释放共享内存句柄（Fork会话的句柄在其工作进程中释放）"""
+        from shared_anndata import release_shared
+
+        if session_id is not None:
+            with self._sessions_lock:
+                session = self._sessions.get(session_id)
+            if session is not None and session.forked:
+                if not session.alive:
+                    # 工作进程退出时其共享内存已随之释放
+                    return False
+                with session.lock:
+                    result = session.worker.execute(
+                        "from shared_anndata import release_shared as _release_shared\n"
+                        f"_release_shared({handle_id!r})"
+                    )
+                return result["success"]
+        return release_shared(handle_id)
+
+    def render_embedding(self, basis: str = "X_umap", color: Optional[str] = "leiden",
+                         timeout: Optional[float] = None, session_id: Optional[str] = None) -> str:
+        """在独立绘图进程中绘制会话adata的嵌入图，数据通过共享内存传递而非pickle"""
+        from shared_anndata import render_embedding_plot, get_plot_executor
+
+        handle = self.share_adata(obsm_keys=[basis], obs_keys=[color] if color else [], session_id=session_id)
+        try:
+            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S_%f')
+            output_path = f"tmp/plots/{basis.lower()}_{color or 'none'}_{timestamp}.png"
+            future = get_plot_executor().submit(render_embedding_plot, handle, basis, color, output_path)
+            return future.result(timeout=timeout)
+        finally:
+            self.release_shared(handle["handle_id"], session_id)
+
     def get_stats(self) -> Dict[str, Any]:
         """获取统计信息"""
         return {
             "initialized": self.initialized,
+            "init_time": self.init_time,
             "globals_count": len(self.globals_dict),
             "has_adata": 'adata' in self.globals_dict,
+            "sessions": self.get_session_stats(),
             "execution_stats": self.stats,
             "avg_execution_time": (
                 self.stats["total_execution_time"] / max(self.stats["total_executions"], 1)
             )
         }
 
+    def get_session_stats(self) -> Dict[str, Any]:
+        """会话统计"""
+        with self._sessions_lock:
+            sessions = list(self._sessions.values())
+        now = time.time()
+        spilled = len(glob.glob(os.path.join(self.spill_dir, "*.h5ad")))
+        return {
+            "active": len(sessions),
+            "max_sessions": self.max_sessions,
+            "forked": sum(1 for s in sessions if s.forked),
+            "spilled": spilled,
+            "idle_timeout": self.session_idle_timeout,
+            "sessions": [
+                {
+                    "session_id": s.session_id,
+                    "forked": s.forked,
+                    "executions": s.executions,
+                    "idle_seconds": round(now - s.last_used, 1)
+                }
+                for s in sessions
+            ]
+        }
+
 # 全局实例
 _execution_manager = None
 
@@ -149,7 +620,13 @@ def get_execution_manager() -> ExecutionManager:
     """获取全局执行管理器实例"""
     global _execution_manager
     if _execution_manager is None:
-        _execution_manager = ExecutionManager()
+        config = get_config()
+        _execution_manager = ExecutionManager(
+            max_sessions=config.performance.max_sessions,
+            session_idle_timeout=config.performance.session_idle_timeout,
+            spill_dir=config.get_cache_path("sessions"),
+            execution_timeout=config.performance.request_timeout
+        )
     return _execution_manager
 
 if __name__ == "__main__":
@@ -0,0 +1,538 @@
+#!/usr/bin/env python3
+"""
+RNA项目优化版本 - Fork会话服务器
+模板进程预先导入scanpy并加载参考数据集，每个新会话从模板fork出写时复制的工作进程，
+新会话无需重复导入和加载数据即可获得就绪的adata
+"""
+
+import os
+import gc
+import sys
+import time
+import signal
+import socket
+import threading
+import traceback
+import multiprocessing
+from io import StringIO
+from collections import OrderedDict
+from contextlib import redirect_stdout, redirect_stderr
+from datetime import datetime
+from multiprocessing import reduction
+from multiprocessing.connection import Connection
+from typing import Dict, Any, Optional, List
+
+from cache_keys import bump_generation
+
+# 模板进程的默认初始化代码（与ExecutionManager保持一致）
+DEFAULT_INIT_CODE = """
+import matplotlib
+matplotlib.use('Agg')
+import numpy as np
+import pandas as pd
+import matplotlib.pyplot as plt
+import seaborn as sns
+import scanpy as sc
+import warnings
+warnings.filterwarnings('ignore')
+
+sc.settings.verbosity = 1
+sc.settings.set_figure_params(dpi=80, dpi_save=150)
+plt.rcParams['figure.figsize'] = (8, 6)
+plt.ioff()
+plt.show = lambda *args, **kwargs: None
+"""
+
+
+def build_preload_code(data_path: str) -> str:
+    """生成在模板进程中预加载10X数据集的代码"""
+    return f"""
+adata = sc.read_10x_mtx({data_path!r}, var_names='gene_symbols', cache=True)
+adata.var_names_make_unique()
+"""
+
+
+def execute_in_namespace(namespace: Dict[str, Any], code: str, plots_dir: str) -> Dict[str, Any]:
+    """在给定命名空间中执行代码，捕获输出并保存生成的图表"""
+    start_time = time.time()
+
+    stdout_capture = StringIO()
+    stderr_capture = StringIO()
+    plot_paths: List[str] = []
+    error_msg = None
+
+    try:
+        with redirect_stdout(stdout_capture), redirect_stderr(stderr_capture):
+            exec(code, namespace)
+    except Exception as e:
+        error_msg = str(e)
+        stderr_capture.write(f"\nError: {error_msg}\n")
+        stderr_capture.write(traceback.format_exc())
+    # 代码可能原地修改了adata（报错前的部分修改也算），缓存的指纹不再可信
+    bump_generation()
+
+    # 图表即使在代码报错时也要清理，避免泄漏到下一次执行
+    plt = sys.modules.get("matplotlib.pyplot")
+    if plt is not None:
+        try:
+            fig_nums = plt.get_fignums()
+            if fig_nums:
+                os.makedirs(plots_dir, exist_ok=True)
+                for i, fig_num in enumerate(fig_nums):
+                    fig = plt.figure(fig_num)
+                    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S_%f')
+                    file_path = os.path.join(plots_dir, f"plot_{timestamp}_{os.getpid()}_{i}.png")
+                    fig.set_size_inches(10.0, 6.0)
+                    fig.savefig(file_path, bbox_inches='tight', dpi=150)
+                    plot_paths.append(file_path)
+                plt.close('all')
+        except Exception as e:
+            stderr_capture.write(f"\n保存图表时出错: {e}\n")
+
+    # 命中图表缓存的代码不会生成新图表，而是登记已有图片的路径
+    plot_cache = sys.modules.get("plot_cache")
+    if plot_cache is not None:
+        plot_paths.extend(plot_cache.drain_cached_plots())
+
+    return {
+        "success": error_msg is None,
+        "stdout": stdout_capture.getvalue(),
+        "stderr": stderr_capture.getvalue(),
+        "error": error_msg,
+        "plots": plot_paths,
+        "execution_time": time.time() - start_time
+    }
+
+
+class _SnapshotStore:
+    """工作进程内的状态快照（步骤缓存）：快照和指纹都留在工作进程中，不经pickle传回服务器"""
+
+    def __init__(self, budget: int):
+        self.budget = budget
+        self._cache = None
+
+    def _store(self):
+        if self._cache is None:
+            # 模板进程由服务器fork而来，这些模块已在 sys.modules 中
+            from cache_manager import InMemoryCache
+            self._cache = InMemoryCache(max_size=self.budget)
+        return self._cache
+
+    @staticmethod
+    def fingerprint(value: Any) -> Optional[str]:
+        from cache_keys import fingerprint
+        return fingerprint(value) if value is not None else None
+
+    def save(self, key: str, value: Any) -> Optional[str]:
+        """保存变量的拷贝，返回其指纹；变量不存在或未启用快照时只返回指纹"""
+        if value is None:
+            return None
+        if self.budget > 0:
+            self._store().set(key, value.copy() if hasattr(value, "copy") else value)
+        return self.fingerprint(value)
+
+    def restore(self, key: str) -> Any:
+        """取出快照的拷贝（后续步骤的原地修改不影响快照），不存在时返回None"""
+        if self.budget <= 0:
+            return None
+        value = self._store().get(key)
+        return value.copy() if value is not None and hasattr(value, "copy") else value
+
+
+def _worker_main(conn: Connection, namespace: Dict[str, Any], plots_dir: str, snapshot_budget: int = 0):
+    """会话工作进程主循环（运行在fork出的子进程中）"""
+    snapshots = _SnapshotStore(snapshot_budget)
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, OSError):
+            break
+
+        op = message[0]
+        try:
+            if op == "exec":
+                conn.send(execute_in_namespace(namespace, message[1], plots_dir))
+            elif op == "get":
+                conn.send(("ok", namespace.get(message[1])))
+            elif op == "set":
+                namespace[message[1]] = message[2]
+                conn.send(("ok", None))
+            elif op == "fingerprint":
+                conn.send(("ok", snapshots.fingerprint(namespace.get(message[1]))))
+            elif op == "snapshot":
+                conn.send(("ok", snapshots.save(message[2], namespace.get(message[1]))))
+            elif op == "restore":
+                value = snapshots.restore(message[2])
+                if value is not None:
+                    namespace[message[1]] = value
+                conn.send(("ok", value is not None))
+            elif op == "close":
+                break
+            else:
+                conn.send(("error", f"未知操作: {op}"))
+        except Exception as e:
+            # 例如变量无法pickle时，把错误返回给调用方而不是让进程退出
+            try:
+                conn.send(("error", repr(e)))
+            except Exception:
+                break
+
+    conn.close()
+
+
+def _template_main(conn: Connection, init_code: str, preload_code: str, plots_dir: str,
+                   snapshot_budget: int = 0):
+    """模板进程主循环：完成预热后按需fork会话工作进程"""
+    # 自动回收退出的子进程，避免僵尸进程
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+
+    start_time = time.time()
+    namespace: Dict[str, Any] = {"__name__": "__main__", "__builtins__": __builtins__}
+    try:
+        with redirect_stdout(StringIO()):
+            exec(init_code, namespace)
+            if preload_code:
+                exec(preload_code, namespace)
+    except Exception as e:
+        conn.send(("failed", f"{e}\n{traceback.format_exc()}"))
+        conn.close()
+        return
+
+    # 冻结当前所有对象，避免子进程中的GC扫描触碰共享页面导致写时复制
+    gc.collect()
+    gc.freeze()
+
+    adata = namespace.get("adata")
+    conn.send(("ready", {
+        "init_time": time.time() - start_time,
+        "has_adata": adata is not None,
+        "adata_shape": tuple(adata.shape) if adata is not None else None
+    }))
+
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, OSError):
+            break
+
+        op = message[0]
+        if op == "spawn":
+            destination_pid = message[1]
+            parent_end = child_end = None
+            try:
+                parent_end, child_end = socket.socketpair()
+                pid = os.fork()
+            except OSError as e:
+                # EAGAIN/ENOMEM等：模板进程继续服务，由请求方回退到进程内执行
+                for end in (parent_end, child_end):
+                    if end is not None:
+                        end.close()
+                conn.send(("error", f"fork会话工作进程失败: {e}"))
+                continue
+            if pid == 0:
+                # 子进程：只保留自己的会话连接
+                exit_code = 0
+                try:
+                    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+                    conn.close()
+                    parent_end.close()
+                    _worker_main(Connection(child_end.detach()), namespace, plots_dir, snapshot_budget)
+                except BaseException:
+                    exit_code = 1
+                finally:
+                    os._exit(exit_code)
+
+            child_end.close()
+            conn.send(("spawned", pid))
+            reduction.send_handle(conn, parent_end.fileno(), destination_pid)
+            parent_end.close()
+        elif op == "stop":
+            break
+
+    conn.close()
+
+
+class SpawnError(RuntimeError):
+    """无法创建会话工作进程（模板进程已退出或fork失败），调用方应回退到进程内执行"""
+
+
+class ForkedWorker:
+    """会话工作进程句柄"""
+
+    def __init__(self, session_id: str, pid: int, conn: Connection):
+        self.session_id = session_id
+        self.pid = pid
+        self._conn = conn
+        self._lock = threading.Lock()
+        self.created_time = time.time()
+        self.last_used = self.created_time
+        self.closed = False
+
+    def _request(self, message: tuple, timeout: Optional[float] = None):
+        with self._lock:
+            if self.closed:
+                raise RuntimeError(f"会话工作进程已关闭: {self.session_id}")
+            self.last_used = time.time()
+            try:
+                self._conn.send(message)
+                if timeout is None or self._conn.poll(timeout):
+                    return self._conn.recv()
+            except (EOFError, OSError) as e:
+                self._terminate()
+                raise RuntimeError(f"会话工作进程异常退出: {self.session_id}") from e
+            # 超时的工作进程状态不可知，直接终止（TimeoutError是OSError的子类，需在try之外抛出）
+            self._terminate()
+            raise TimeoutError(f"会话 {self.session_id} 执行超时 ({timeout}s)")
+
+    def execute(self, code: str, timeout: Optional[float] = None) -> Dict[str, Any]:
+        """在会话进程中执行代码"""
+        return self._request(("exec", code), timeout)
+
+    def get_variable(self, name: str) -> Any:
+        """读取会话命名空间中的变量（通过pickle传输）"""
+        status, value = self._request(("get", name))
+        if status != "ok":
+            raise RuntimeError(value)
+        return value
+
+    def set_variable(self, name: str, value: Any):
+        """设置会话命名空间中的变量（通过pickle传输）"""
+        status, error = self._request(("set", name, value))
+        if status != "ok":
+            raise RuntimeError(error)
+
+    def fingerprint_variable(self, name: str) -> Optional[str]:
+        """在会话进程中计算变量的内容指纹，只传回指纹字符串"""
+        status, value = self._request(("fingerprint", name))
+        if status != "ok":
+            raise RuntimeError(value)
+        return value
+
+    def snapshot_variable(self, name: str, key: str) -> Optional[str]:
+        """在会话进程中保存变量的快照，返回变量的指纹"""
+        status, value = self._request(("snapshot", name, key))
+        if status != "ok":
+            raise RuntimeError(value)
+        return value
+
+    def restore_snapshot(self, name: str, key: str) -> bool:
+        """用会话进程中保存的快照替换变量；快照不存在（未保存或已淘汰）时返回False"""
+        status, value = self._request(("restore", name, key))
+        if status != "ok":
+            raise RuntimeError(value)
+        return value
+
+    def _terminate(self):
+        self.closed = True
+        try:
+            self._conn.close()
+        except OSError:
+            pass
+        try:
+            os.kill(self.pid, signal.SIGTERM)
+        except (ProcessLookupError, PermissionError):
+            pass
+
+    def close(self):
+        """关闭会话进程"""
+        with self._lock:
+            if self.closed:
+                return
+            try:
+                self._conn.send(("close",))
+            except (EOFError, OSError):
+                pass
+            self._terminate()
+
+
+class ForkServer:
+    """Fork会话服务器：维护一个预热的模板进程并为每个会话fork工作进程"""
+
+    def __init__(self, init_code: str = DEFAULT_INIT_CODE, preload_code: str = "",
+                 plots_dir: str = "tmp/plots", max_sessions: int = 16, snapshot_budget: int = 0):
+        """
+        Args:
+            snapshot_budget: 每个会话工作进程中步骤快照的内存预算（字节），0 表示不保存快照
+        """
+        self.init_code = init_code
+        self.snapshot_budget = snapshot_budget
+        self.preload_code = preload_code
+        self.plots_dir = os.path.abspath(plots_dir)
+        self.max_sessions = max_sessions
+        self._process = None
+        self._conn: Optional[Connection] = None
+        self._lock = threading.Lock()
+        self._workers: "OrderedDict[str, ForkedWorker]" = OrderedDict()
+        self.template_info: Dict[str, Any] = {}
+        self.stats = {
+            "total_spawns": 0,
+            "total_spawn_time": 0.0,
+            "evicted_sessions": 0,
+            "spawn_failures": 0
+        }
+
+    @staticmethod
+    def is_supported() -> bool:
+        """当前平台是否支持fork"""
+        return hasattr(os, "fork") and "fork" in multiprocessing.get_all_start_methods()
+
+    @property
+    def running(self) -> bool:
+        return self._conn is not None and self._process is not None and self._process.is_alive()
+
+    def start(self, timeout: float = 600):
+        """启动模板进程并等待预热完成
+
+        必须在服务器创建线程之前调用：模板进程由当前进程fork而来
+        """
+        if self.running:
+            return
+        if not self.is_supported():
+            raise RuntimeError("当前平台不支持fork，无法启动Fork会话服务器")
+
+        print("🔧 [Fork服务器] 启动模板进程并预加载数据...")
+        ctx = multiprocessing.get_context("fork")
+        parent_conn, child_conn = ctx.Pipe(duplex=True)
+        self._process = ctx.Process(
+            target=_template_main,
+            args=(child_conn, self.init_code, self.preload_code, self.plots_dir, self.snapshot_budget),
+            name="rna-fork-template",
+            daemon=True
+        )
+        self._process.start()
+        child_conn.close()
+        self._conn = parent_conn
+
+        if not parent_conn.poll(timeout):
+            self.stop()
+            raise TimeoutError(f"模板进程预热超时 ({timeout}s)")
+        status, info = parent_conn.recv()
+        if status != "ready":
+            self.stop()
+            raise RuntimeError(f"模板进程初始化失败: {info}")
+
+        self.template_info = info
+        print(f"✅ [Fork服务器] 模板进程就绪 (pid={self._process.pid})，预热耗时: {info['init_time']:.2f}s")
+
+    def _spawn_locked(self, session_id: str) -> ForkedWorker:
+        start_time = time.time()
+        try:
+            self._conn.send(("spawn", os.getpid()))
+            status, value = self._conn.recv()
+            if status == "spawned":
+                fd = reduction.recv_handle(self._conn)
+        except (EOFError, OSError) as e:
+            # 模板进程已退出：不能从多线程的服务进程重新fork模板，标记停止，之后的会话在进程内执行
+            self._template_lost_locked()
+            raise SpawnError(f"Fork模板进程已退出，无法创建会话 {session_id}") from e
+        if status != "spawned":
+            self.stats["spawn_failures"] += 1
+            raise SpawnError(value)
+        worker = ForkedWorker(session_id, value, Connection(fd))
+
+        self.stats["total_spawns"] += 1
+        self.stats["total_spawn_time"] += time.time() - start_time
+        return worker
+
+    def _template_lost_locked(self):
+        self.stats["spawn_failures"] += 1
+        print(f"⚠️ [Fork服务器] 模板进程已退出 (pid={self._process.pid if self._process else None})，"
+              f"新会话改为在进程内执行，已有会话不受影响")
+        try:
+            self._conn.close()
+        except OSError:
+            pass
+        self._conn = None
+        if self._process is not None and self._process.is_alive():
+            self._process.terminate()
+
+    def get_or_spawn(self, session_id: str) -> ForkedWorker:
+        """获取会话工作进程，不存在时从模板fork一个
+
+        模板进程已退出或fork失败时抛出 SpawnError；已有的会话工作进程不依赖模板，仍可继续使用
+        """
+        evicted: List[ForkedWorker] = []
+        with self._lock:
+            worker = self._workers.get(session_id)
+            if worker is not None and not worker.closed:
+                self._workers.move_to_end(session_id)
+                return worker
+
+            if self._conn is None:
+                raise SpawnError("Fork会话服务器未启动")
+
+            worker = self._spawn_locked(session_id)
+            self._workers[session_id] = worker
+
+            # 超出会话上限时关闭最久未使用的会话
+            while len(self._workers) > self.max_sessions:
+                _, old_worker = self._workers.popitem(last=False)
+                evicted.append(old_worker)
+                self.stats["evicted_sessions"] += 1
+
+        for old_worker in evicted:
+            old_worker.close()
+        return worker
+
+    def respawn(self, session_id: str) -> ForkedWorker:
+        """丢弃会话当前状态，从模板重新fork（相当于重新加载数据）"""
+        self.close_session(session_id)
+        return self.get_or_spawn(session_id)
+
+    def close_session(self, session_id: str) -> bool:
+        """关闭会话工作进程"""
+        with self._lock:
+            worker = self._workers.pop(session_id, None)
+        if worker is None:
+            return False
+        worker.close()
+        return True
+
+    def stop(self):
+        """关闭所有会话和模板进程"""
+        with self._lock:
+            workers = list(self._workers.values())
+            self._workers.clear()
+        for worker in workers:
+            worker.close()
+
+        if self._conn is not None:
+            try:
+                self._conn.send(("stop",))
+            except (EOFError, OSError):
+                pass
+            self._conn.close()
+            self._conn = None
+        if self._process is not None:
+            self._process.join(timeout=5)
+            if self._process.is_alive():
+                self._process.terminate()
+            self._process = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取统计信息"""
+        with self._lock:
+            active_sessions = [sid for sid, w in self._workers.items() if not w.closed]
+        return {
+            "running": self.running,
+            "template_pid": self._process.pid if self._process is not None else None,
+            "template_info": self.template_info,
+            "active_sessions": len(active_sessions),
+            "max_sessions": self.max_sessions,
+            "spawn_stats": self.stats,
+            "avg_spawn_time_ms": round(
+                self.stats["total_spawn_time"] / max(self.stats["total_spawns"], 1) * 1000, 2
+            )
+        }
+
+
+if __name__ == "__main__":
+    # 测试（不依赖scanpy）
+    server = ForkServer(init_code="import math\nbase = [1, 2, 3]", plots_dir="tmp/plots")
+    server.start()
+    worker_a = server.get_or_spawn("a")
+    worker_b = server.get_or_spawn("b")
+    print(worker_a.execute("base.append(4); print(base)")["stdout"].strip())
+    print(worker_b.execute("print(base)")["stdout"].strip())
+    print("统计信息:", server.get_stats())
+    server.stop()
@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+"""
+RNA项目优化版本 - 异步作业管理
+耗时分析以作业形式提交：立即返回作业ID，在后台线程池中执行，
+状态和结果持久化到磁盘，断线重连后仍可查询
+"""
+
+import os
+import json
+import time
+import uuid
+import threading
+import tempfile
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field, asdict, replace
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from cache_keys import make_key
+
+# 作业状态
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+ACTIVE_STATES = (QUEUED, RUNNING)
+
+
+class JobCancelled(Exception):
+    """作业已被取消（在进度汇报点抛出）"""
+
+
+@dataclass
+class Job:
+    """作业记录"""
+    job_id: str
+    kind: str
+    params: Dict[str, Any]
+    dedup_key: str
+    status: str = QUEUED
+    progress: float = 0.0
+    message: str = ""
+    result: Any = None
+    error: Optional[str] = None
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    session_id: Optional[str] = None
+
+    def to_dict(self, include_result: bool = False) -> Dict[str, Any]:
+        data = asdict(self)
+        if not include_result:
+            data.pop("result")
+        return data
+
+
+class JobContext:
+    """传给作业函数的上下文：汇报进度并检查取消"""
+
+    def __init__(self, manager: "JobManager", job: Job):
+        self._manager = manager
+        self.job = job
+        self.cancel_event = threading.Event()
+
+    @property
+    def params(self) -> Dict[str, Any]:
+        return self.job.params
+
+    def report(self, progress: float, message: str = ""):
+        """汇报进度（0~1）；作业已被取消时抛出 JobCancelled"""
+        if self.cancel_event.is_set():
+            raise JobCancelled()
+        self.job.progress = max(0.0, min(progress, 1.0))
+        self.job.message = message
+        self._manager._updated(self.job)
+
+
+class JobManager:
+    """作业管理器
+
+    - 相同类型和参数的作业在排队/执行期间只会运行一次，重复提交返回已有作业
+    - 取消：排队中的作业直接取消，执行中的作业在下一个进度汇报点停止
+    - 每次状态变化都写入 jobs_dir/<job_id>.json 并通知 on_update 回调；
+      写盘和回调在 _lock 之外进行，使用锁内复制的快照，慢磁盘或回调不会阻塞查询
+    - 已结束的作业超过保留时间或总数超过 max_jobs 时从内存和磁盘中淘汰（最早结束的先淘汰）
+    """
+
+    def __init__(self, jobs_dir: str, max_workers: int = 2,
+                 on_update: Optional[Callable[[Job], None]] = None,
+                 retention: int = 7 * 24 * 3600, max_jobs: int = 1000):
+        self.jobs_dir = Path(jobs_dir)
+        self.jobs_dir.mkdir(parents=True, exist_ok=True)
+        self.on_update = on_update
+        self.retention = retention
+        self.max_jobs = max_jobs
+        self._handlers: Dict[str, Callable[[JobContext], Any]] = {}
+        self._jobs: Dict[str, Job] = {}
+        self._contexts: Dict[str, JobContext] = {}
+        self._futures: Dict[str, Future] = {}
+        self._active_by_key: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        # 保证同一作业的快照按复制顺序写盘，较旧的状态不会覆盖较新的状态
+        self._persist_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="rna-job")
+        self.deduplicated = 0
+        self.evicted = 0
+        self._load()
+
+    def register(self, kind: str, handler: Callable[[JobContext], Any]):
+        """注册作业类型；handler 接收 JobContext，返回可JSON序列化的结果"""
+        self._handlers[kind] = handler
+
+    def submit(self, kind: str, params: Optional[Dict[str, Any]] = None,
+               session_id: Optional[str] = None) -> Tuple[Job, bool]:
+        """提交作业
+
+        Returns:
+            (作业, 是否复用了已有的相同作业)
+        """
+        if kind not in self._handlers:
+            raise ValueError(f"未知的作业类型: {kind}")
+        params = params or {}
+        dedup_key = make_key("job", (kind, params, session_id), {})
+
+        with self._lock:
+            existing_id = self._active_by_key.get(dedup_key)
+            if existing_id is not None:
+                self.deduplicated += 1
+                return self._jobs[existing_id], True
+
+            job = Job(job_id=uuid.uuid4().hex, kind=kind, params=params,
+                      dedup_key=dedup_key, session_id=session_id)
+            context = JobContext(self, job)
+            self._jobs[job.job_id] = job
+            self._contexts[job.job_id] = context
+            self._active_by_key[dedup_key] = job.job_id
+            expired = self._evict_locked()
+
+        self._remove_files(expired)
+        # 先写入排队状态再提交执行，执行线程的更新不会被排队状态覆盖
+        self._updated(job)
+        with self._lock:
+            # 在锁内登记future，保证 _finish 清理时它已存在
+            self._futures[job.job_id] = self._executor.submit(self._run, context)
+        return job, False
+
+    def _run(self, context: JobContext):
+        job = context.job
+        if context.cancel_event.is_set():
+            job.status = CANCELLED
+            job.message = "作业已取消"
+            self._finish(job)
+            return
+
+        job.status = RUNNING
+        job.started_at = time.time()
+        self._updated(job)
+
+        try:
+            job.result = self._handlers[job.kind](context)
+            job.status = SUCCEEDED
+            job.progress = 1.0
+        except JobCancelled:
+            job.status = CANCELLED
+            job.message = "作业已取消"
+        except Exception as e:
+            job.status = FAILED
+            job.error = str(e)
+        finally:
+            self._finish(job)
+
+    def _finish(self, job: Job):
+        job.finished_at = time.time()
+        with self._lock:
+            if self._active_by_key.get(job.dedup_key) == job.job_id:
+                del self._active_by_key[job.dedup_key]
+            self._contexts.pop(job.job_id, None)
+            self._futures.pop(job.job_id, None)
+        self._updated(job)
+        with self._lock:
+            expired = self._evict_locked()
+        self._remove_files(expired)
+
+    def cancel(self, job_id: str) -> Optional[Job]:
+        """取消作业；返回None表示作业不存在"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            context = self._contexts.get(job_id)
+            future = self._futures.get(job_id)
+        if job is None or job.status not in ACTIVE_STATES:
+            return job
+
+        if context is not None:
+            context.cancel_event.set()
+        if future is not None and future.cancel():
+            # 尚未开始执行
+            job.status = CANCELLED
+            job.message = "作业已取消"
+            self._finish(job)
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list_jobs(self, session_id: Optional[str] = None, limit: int = 50) -> List[Job]:
+        """按创建时间倒序列出作业"""
+        with self._lock:
+            jobs = [j for j in self._jobs.values() if session_id is None or j.session_id == session_id]
+        jobs.sort(key=lambda j: j.created_at, reverse=True)
+        return jobs[:limit]
+
+    def _updated(self, job: Job):
+        """写盘并通知状态变化（调用方不得持有 _lock，回调中可以查询或提交作业）"""
+        with self._persist_lock:
+            with self._lock:
+                snapshot = replace(job)
+            self._persist(snapshot)
+        if self.on_update is not None:
+            try:
+                self.on_update(snapshot)
+            except Exception as e:
+                print(f"⚠️ 作业状态推送失败: {e}")
+
+    def _evict_locked(self) -> List[str]:
+        """从内存中移除超过保留时间或超出数量上限的已结束作业，返回需删除记录文件的作业ID"""
+        now = time.time()
+        finished = sorted((j for j in self._jobs.values() if j.finished_at is not None),
+                          key=lambda j: j.finished_at)
+        overflow = max(0, len(self._jobs) - self.max_jobs)
+        evicted = []
+        for job in finished:
+            if len(evicted) >= overflow and now - job.finished_at <= self.retention:
+                break
+            del self._jobs[job.job_id]
+            evicted.append(job.job_id)
+        self.evicted += len(evicted)
+        return evicted
+
+    def _remove_files(self, job_ids: List[str]):
+        for job_id in job_ids:
+            (self.jobs_dir / f"{job_id}.json").unlink(missing_ok=True)
+
+    def _persist(self, job: Job):
+        """原子写入作业状态"""
+        path = self.jobs_dir / f"{job.job_id}.json"
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.jobs_dir, prefix=f".{job.job_id}.", suffix=".tmp")
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(job.to_dict(include_result=True), f, ensure_ascii=False, default=str)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            print(f"⚠️ 保存作业状态失败: {e}")
+
+    def _load(self):
+        """加载历史作业；上次进程退出时未完成的作业标记为失败，过期或超出数量上限的作业删除"""
+        now = time.time()
+        for path in self.jobs_dir.glob("*.json"):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    job = Job(**json.load(f))
+            except Exception as e:
+                print(f"⚠️ 读取作业记录失败 {path.name}: {e}")
+                continue
+
+            if job.finished_at is not None and now - job.finished_at > self.retention:
+                path.unlink(missing_ok=True)
+                continue
+            if job.status in ACTIVE_STATES:
+                job.status = FAILED
+                job.error = "服务重启，作业被中断"
+                job.finished_at = now
+                self._persist(job)
+            self._jobs[job.job_id] = job
+        self._remove_files(self._evict_locked())
+
+    def stats(self) -> Dict[str, Any]:
+        """作业统计"""
+        with self._lock:
+            counts: Dict[str, int] = {}
+            for job in self._jobs.values():
+                counts[job.status] = counts.get(job.status, 0) + 1
+            return {
+                "total": len(self._jobs),
+                "by_status": counts,
+                "active": len(self._active_by_key),
+                "deduplicated": self.deduplicated,
+                "evicted": self.evicted
+            }
+
+    def shutdown(self):
+        """停止接收作业，取消排队中的作业"""
+        for job in self.list_jobs(limit=len(self._jobs)):
+            if job.status in ACTIVE_STATES:
+                self.cancel(job.job_id)
+        self._executor.shutdown(wait=False, cancel_futures=True)
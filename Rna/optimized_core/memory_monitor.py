@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+RNA项目优化版本 - 内存压力监控
+按系统内存使用率和进程RSS持续调整内存缓存预算，
+压力等级变化时通知监听者
+"""
+
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import psutil
+
+# 压力等级（由低到高）
+PRESSURE_LEVELS = ("normal", "elevated", "critical")
+
+
+class MemoryPressureMonitor:
+    """内存压力监控器
+
+    - normal: 使用完整的缓存预算
+    - elevated: 系统内存超过阈值（或进程RSS接近上限），预算随压力线性收缩
+    - critical: 预算降到最低值
+    """
+
+    def __init__(self, base_budget: int, on_budget_change: Callable[[int], None],
+                 threshold: float = 0.8, critical_threshold: Optional[float] = None,
+                 process_limit: int = 0, min_budget_ratio: float = 0.1,
+                 interval: float = 2.0):
+        """
+        Args:
+            base_budget: 无压力时的缓存预算（字节）
+            on_budget_change: 预算变化时的回调，参数为新预算
+            threshold: 系统内存使用率进入elevated的阈值
+            critical_threshold: 进入critical的阈值（默认 threshold + 0.1，最高0.95）
+            process_limit: 进程RSS上限（字节），0表示不限制
+            min_budget_ratio: critical时保留的预算比例
+            interval: 采样间隔（秒）
+        """
+        self.base_budget = base_budget
+        self.on_budget_change = on_budget_change
+        self.threshold = threshold
+        self.critical_threshold = critical_threshold or min(threshold + 0.1, 0.95)
+        self.process_limit = process_limit
+        self.min_budget_ratio = min_budget_ratio
+        self.interval = interval
+
+        self.level = "normal"
+        self.budget = base_budget
+        self.last_sample: Dict[str, Any] = {}
+        self.level_changes = 0
+        self._listeners: List[Callable[[str, str, Dict[str, Any]], None]] = []
+        self._process = psutil.Process(os.getpid())
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def add_listener(self, listener: Callable[[str, str, Dict[str, Any]], None]):
+        """注册压力等级变化监听者：listener(旧等级, 新等级, 采样数据)"""
+        self._listeners.append(listener)
+
+    def start(self):
+        """启动后台采样线程"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="memory-pressure-monitor", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        """停止采样线程"""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                self.check()
+            except Exception as e:
+                print(f"⚠️ 内存压力检测失败: {e}")
+
+    def _pressure(self, system_ratio: float, rss: int) -> float:
+        """把系统使用率和进程RSS统一换算为系统使用率尺度上的压力值"""
+        pressure = system_ratio
+        if self.process_limit > 0:
+            # RSS达到上限的75%开始收缩，达到90%视为critical
+            process_ratio = rss / self.process_limit
+            span = self.critical_threshold - self.threshold
+            pressure = max(pressure, self.threshold + (process_ratio - 0.75) / 0.15 * span)
+        return pressure
+
+    def check(self) -> Dict[str, Any]:
+        """采样一次并按需调整预算"""
+        memory = psutil.virtual_memory()
+        rss = self._process.memory_info().rss
+        pressure = self._pressure(memory.percent / 100, rss)
+
+        if pressure >= self.critical_threshold:
+            level = "critical"
+            ratio = self.min_budget_ratio
+        elif pressure >= self.threshold:
+            level = "elevated"
+            span = self.critical_threshold - self.threshold
+            ratio = max(self.min_budget_ratio, 1.0 - (pressure - self.threshold) / span)
+        else:
+            level = "normal"
+            ratio = 1.0
+
+        # 预算不超过当前可用内存的一半
+        budget = int(min(self.base_budget * ratio, memory.available * 0.5))
+        budget = max(budget, int(self.base_budget * self.min_budget_ratio))
+
+        sample = {
+            "timestamp": time.time(),
+            "system_used_percent": memory.percent,
+            "available_mb": round(memory.available / (1024 * 1024), 2),
+            "process_rss_mb": round(rss / (1024 * 1024), 2),
+            "pressure": round(pressure, 4),
+            "level": level,
+            "budget_mb": round(budget / (1024 * 1024), 2)
+        }
+        self.last_sample = sample
+
+        if budget != self.budget:
+            self.budget = budget
+            self.on_budget_change(budget)
+
+        if level != self.level:
+            old_level, self.level = self.level, level
+            self.level_changes += 1
+            self._notify(old_level, level, sample)
+
+        return sample
+
+    def _notify(self, old_level: str, new_level: str, sample: Dict[str, Any]):
+        rising = PRESSURE_LEVELS.index(new_level) > PRESSURE_LEVELS.index(old_level)
+        icon = "🔴" if new_level == "critical" else "🟡" if rising else "🟢"
+        print(f"{icon} 内存压力 {old_level} → {new_level}: 系统 {sample['system_used_percent']}%, "
+              f"进程 {sample['process_rss_mb']}MB, 缓存预算 {sample['budget_mb']}MB")
+        for listener in list(self._listeners):
+            try:
+                listener(old_level, new_level, sample)
+            except Exception as e:
+                print(f"⚠️ 内存压力监听者执行失败: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        """监控统计"""
+        return {
+            "level": self.level,
+            "budget_mb": round(self.budget / (1024 * 1024), 2),
+            "base_budget_mb": round(self.base_budget / (1024 * 1024), 2),
+            "threshold": self.threshold,
+            "critical_threshold": self.critical_threshold,
+            "level_changes": self.level_changes,
+            "running": self._thread is not None and self._thread.is_alive(),
+            "last_sample": self.last_sample
+        }
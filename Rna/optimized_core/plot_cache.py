@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+RNA项目优化版本 - 图表结果缓存
+按图表实际读取的obsm/obs数据指纹加绘图参数缓存PNG，命中时直接返回已有图片，
+不再重复绘制相同的UMAP等图表
+"""
+
+import os
+import glob
+import threading
+from typing import Any, Dict, Iterable, List, Optional
+
+from cache_keys import fingerprint
+
+
+class PlotCache:
+    """图表缓存
+
+    文件名为 "<图表名>-<参数指纹>_<数据指纹>.png"，命中判断只依赖文件是否存在，
+    因此多个进程（如Fork会话工作进程）可以安全地共享同一目录。
+    数据指纹变化只是一次未命中：旧指纹的图片可能仍被已返回的对话记录或其他会话引用，
+    不主动删除，只在超过条目上限时按修改时间淘汰
+    """
+
+    def __init__(self, cache_dir: str, max_entries: int = 256, enabled: bool = True):
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.max_entries = max_entries
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._local = threading.local()
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def key(self, plot_name: str, adata, obsm_keys: Iterable[str] = (),
+            obs_keys: Iterable[str] = (), params: Optional[Dict[str, Any]] = None) -> str:
+        """生成缓存键：只对图表读取的数据计算指纹
+
+        Args:
+            plot_name: 图表名称（仅字母、数字、下划线）
+            adata: AnnData对象
+            obsm_keys: 图表使用的嵌入，如 ["X_umap"]
+            obs_keys: 图表使用的obs列，如 ["leiden"]
+            params: 影响图表外观的绘图参数
+        """
+        data = {
+            "obsm": {k: adata.obsm[k] for k in obsm_keys if k in adata.obsm},
+            "obs": {k: adata.obs[k] for k in obs_keys if k in adata.obs.columns}
+        }
+        slot = fingerprint({"plot": plot_name, "params": params or {}})[:16]
+        return f"{plot_name}-{slot}_{fingerprint(data)}"
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.png")
+
+    def use_cached(self, key: str) -> bool:
+        """命中时登记已有图片路径并返回True，调用方据此跳过绘图"""
+        if not self.enabled:
+            return False
+        path = self._path(key)
+        if not os.path.exists(path):
+            self.misses += 1
+            return False
+        try:
+            os.utime(path)  # 更新修改时间，作为LRU依据
+        except OSError:
+            pass
+        self.hits += 1
+        self._pending().append(path)
+        return True
+
+    def save_figure(self, key: str, fig, dpi: int = 150) -> Optional[str]:
+        """保存图表到缓存并关闭图表，返回图片路径
+
+        缓存关闭时不做任何处理，图表由执行器按常规流程保存
+        """
+        import matplotlib.pyplot as plt
+
+        if not self.enabled:
+            return None
+
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        fig.savefig(tmp_path, format="png", bbox_inches='tight', dpi=dpi)
+        os.replace(tmp_path, path)
+        plt.close(fig)
+
+        self._pending().append(path)
+        self._evict()
+        return path
+
+    def _evict(self):
+        """超过条目上限时删除最久未使用的图片"""
+        paths = glob.glob(os.path.join(self.cache_dir, "*.png"))
+        if len(paths) <= self.max_entries:
+            return
+        paths.sort(key=lambda p: os.path.getmtime(p) if os.path.exists(p) else 0)
+        for path in paths[:len(paths) - self.max_entries]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def invalidate(self, plot_name: Optional[str] = None) -> int:
+        """删除指定图表（默认全部）的缓存图片"""
+        pattern = f"{glob.escape(plot_name)}-*.png" if plot_name else "*.png"
+        removed = 0
+        for path in glob.glob(os.path.join(self.cache_dir, pattern)):
+            try:
+                os.remove(path)
+                removed += 1
+            except OSError:
+                pass
+        self.invalidations += removed
+        return removed
+
+    def _pending(self) -> List[str]:
+        if not hasattr(self._local, "paths"):
+            self._local.paths = []
+        return self._local.paths
+
+    def drain(self) -> List[str]:
+        """取出当前线程本次执行中命中或写入的图片路径"""
+        paths = self._pending()
+        self._local.paths = []
+        return paths
+
+    def stats(self) -> Dict[str, Any]:
+        """缓存统计"""
+        paths = glob.glob(os.path.join(self.cache_dir, "*.png"))
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "entries": len(paths),
+            "size_mb": round(sum(os.path.getsize(p) for p in paths if os.path.exists(p)) / (1024 * 1024), 2),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "invalidations": self.invalidations
+        }
+
+
+_plot_cache: Optional[PlotCache] = None
+
+
+def configure_plot_cache(cache_dir: str, enabled: bool = True, max_entries: int = 256) -> PlotCache:
+    """设置全局图表缓存（Fork出的会话进程会继承该设置）"""
+    global _plot_cache
+    _plot_cache = PlotCache(cache_dir, max_entries=max_entries, enabled=enabled)
+    return _plot_cache
+
+
+def get_plot_cache() -> PlotCache:
+    """获取全局图表缓存；未配置时按环境变量创建"""
+    global _plot_cache
+    if _plot_cache is None:
+        _plot_cache = PlotCache(
+            os.getenv("PLOT_CACHE_DIR", os.path.join("tmp", "plots", "cache")),
+            enabled=os.getenv("ENABLE_PLOT_CACHE", "true").lower() == "true"
+        )
+    return _plot_cache
+
+
+def drain_cached_plots() -> List[str]:
+    """取出当前线程登记的缓存图片路径（未使用图表缓存时返回空列表）"""
+    if _plot_cache is None:
+        return []
+    return _plot_cache.drain()
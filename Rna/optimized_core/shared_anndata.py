@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+"""
+RNA项目优化版本 - 共享内存AnnData传输
+把CSR矩阵、obsm嵌入和obs列放入共享内存，进程间只传递轻量句柄，
+绘图等工作进程无需pickle整个adata即可零拷贝读取数据
+"""
+
+import os
+import uuid
+import atexit
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field, asdict
+from datetime import datetime
+from multiprocessing import shared_memory
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+@dataclass
+class SharedArraySpec:
+    """共享内存中单个数组的描述"""
+    name: str
+    shape: Tuple[int, ...]
+    dtype: str
+
+    def attach(self) -> Tuple[shared_memory.SharedMemory, np.ndarray]:
+        """挂载共享内存并返回只读数组视图（不拷贝数据）"""
+        shm = _attach_segment(self.name)
+        array = np.ndarray(self.shape, dtype=np.dtype(self.dtype), buffer=shm.buf)
+        array.flags.writeable = False
+        return shm, array
+
+
+@dataclass
+class SharedAnnDataHandle:
+    """共享AnnData的轻量句柄，可安全地pickle或序列化为JSON传给其他进程"""
+    handle_id: str
+    n_obs: int
+    n_vars: int
+    owner_pid: int
+    X_format: Optional[str] = None  # "csr" / "dense" / None
+    X: Dict[str, SharedArraySpec] = field(default_factory=dict)
+    obsm: Dict[str, SharedArraySpec] = field(default_factory=dict)
+    obs: Dict[str, Dict[str, Any]] = field(default_factory=dict)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """序列化为纯字典（可直接JSON序列化）"""
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "SharedAnnDataHandle":
+        """从字典恢复句柄"""
+        def spec(d):
+            return SharedArraySpec(d["name"], tuple(d["shape"]), d["dtype"])
+
+        obs = {}
+        for key, column in data.get("obs", {}).items():
+            column = dict(column)
+            column["values"] = spec(column["values"])
+            obs[key] = column
+
+        return cls(
+            handle_id=data["handle_id"],
+            n_obs=data["n_obs"],
+            n_vars=data["n_vars"],
+            owner_pid=data["owner_pid"],
+            X_format=data.get("X_format"),
+            X={k: spec(v) for k, v in data.get("X", {}).items()},
+            obsm={k: spec(v) for k, v in data.get("obsm", {}).items()},
+            obs=obs
+        )
+
+    def attach(self) -> "SharedAnnDataView":
+        """在当前进程中挂载共享数据"""
+        return SharedAnnDataView(self)
+
+
+class SharedAnnDataView:
+    """共享AnnData的只读视图，提供与AnnData相同的 X / obsm / obs 访问方式"""
+
+    def __init__(self, handle: SharedAnnDataHandle):
+        self.handle = handle
+        self.n_obs = handle.n_obs
+        self.n_vars = handle.n_vars
+        self._segments: List[shared_memory.SharedMemory] = []
+        self.obsm: Dict[str, np.ndarray] = {}
+        self.X = None
+
+        for key, spec in handle.obsm.items():
+            self.obsm[key] = self._attach(spec)
+
+        if handle.X_format == "csr":
+            import scipy.sparse as sp
+            self.X = sp.csr_matrix(
+                (self._attach(handle.X["data"]), self._attach(handle.X["indices"]),
+                 self._attach(handle.X["indptr"])),
+                shape=(handle.n_obs, handle.n_vars),
+                copy=False
+            )
+        elif handle.X_format == "dense":
+            self.X = self._attach(handle.X["data"])
+
+        self.obs = self._build_obs()
+
+    def _attach(self, spec: SharedArraySpec) -> np.ndarray:
+        shm, array = spec.attach()
+        self._segments.append(shm)
+        return array
+
+    def _build_obs(self):
+        import pandas as pd
+
+        columns = {}
+        for key, column in self.handle.obs.items():
+            values = self._attach(column["values"])
+            if column["kind"] == "categorical":
+                columns[key] = pd.Categorical.from_codes(
+                    values, categories=column["categories"], ordered=column["ordered"]
+                )
+            else:
+                columns[key] = values
+        return pd.DataFrame(columns, copy=False)
+
+    def close(self):
+        """释放对共享内存的引用（不会删除共享内存段）"""
+        self.obsm = {}
+        self.obs = None
+        self.X = None
+        for shm in self._segments:
+            try:
+                shm.close()
+            except BufferError:
+                # 调用方仍持有数组引用，交给进程退出时释放
+                pass
+        self._segments = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def _attach_segment(name: str) -> shared_memory.SharedMemory:
+    """挂载已存在的共享内存段，且不让当前进程的resource_tracker接管其生命周期"""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)  # Python 3.13+
+    except TypeError:
+        shm = shared_memory.SharedMemory(name=name)
+        try:
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(shm._name, "shared_memory")
+        except Exception:
+            pass
+        return shm
+
+
+# 当前进程创建的共享内存段：handle_id -> 段列表
+_owned_segments: Dict[str, List[shared_memory.SharedMemory]] = {}
+_owned_lock = threading.Lock()
+
+
+def _export_array(array: np.ndarray, segments: List[shared_memory.SharedMemory]) -> SharedArraySpec:
+    array = np.ascontiguousarray(array)
+    shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    segments.append(shm)
+    target = np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)
+    target[...] = array
+    del target
+    return SharedArraySpec(shm.name, tuple(array.shape), array.dtype.str)
+
+
+def share_anndata(adata, obsm_keys: Optional[List[str]] = None, obs_keys: Optional[List[str]] = None,
+                  include_X: bool = False) -> SharedAnnDataHandle:
+    """把adata的指定部分复制一次到共享内存，返回可跨进程传递的句柄
+
+    Args:
+        adata: AnnData对象
+        obsm_keys: 需要共享的嵌入（默认全部obsm）
+        obs_keys: 需要共享的obs列（默认不共享）
+        include_X: 是否共享表达矩阵（CSR或稠密）
+
+    Returns:
+        共享句柄，使用完毕后调用 release_shared(handle.handle_id)
+    """
+    import pandas as pd
+    import scipy.sparse as sp
+
+    segments: List[shared_memory.SharedMemory] = []
+    handle = SharedAnnDataHandle(
+        handle_id=uuid.uuid4().hex,
+        n_obs=int(adata.n_obs),
+        n_vars=int(adata.n_vars),
+        owner_pid=os.getpid()
+    )
+
+    try:
+        if include_X and adata.X is not None:
+            X = adata.X
+            if sp.issparse(X):
+                X = X.tocsr()
+                handle.X_format = "csr"
+                handle.X = {
+                    "data": _export_array(X.data, segments),
+                    "indices": _export_array(X.indices, segments),
+                    "indptr": _export_array(X.indptr, segments)
+                }
+            else:
+                handle.X_format = "dense"
+                handle.X = {"data": _export_array(np.asarray(X), segments)}
+
+        keys = list(adata.obsm.keys()) if obsm_keys is None else obsm_keys
+        for key in keys:
+            handle.obsm[key] = _export_array(np.asarray(adata.obsm[key]), segments)
+
+        for key in obs_keys or []:
+            series = adata.obs[key]
+            if isinstance(series.dtype, pd.CategoricalDtype) or series.dtype == object:
+                categorical = series.astype("category").cat
+                handle.obs[key] = {
+                    "kind": "categorical",
+                    "values": _export_array(categorical.codes.to_numpy(), segments),
+                    "categories": [str(c) for c in categorical.categories],
+                    "ordered": bool(categorical.ordered)
+                }
+            else:
+                handle.obs[key] = {
+                    "kind": "numeric",
+                    "values": _export_array(series.to_numpy(), segments)
+                }
+    except Exception:
+        _release_segments(segments)
+        raise
+
+    with _owned_lock:
+        _owned_segments[handle.handle_id] = segments
+    return handle
+
+
+def _release_segments(segments: List[shared_memory.SharedMemory]):
+    for shm in segments:
+        try:
+            shm.close()
+            shm.unlink()
+        except FileNotFoundError:
+            pass
+
+
+def release_shared(handle_id: str) -> bool:
+    """删除当前进程创建的共享内存段"""
+    with _owned_lock:
+        segments = _owned_segments.pop(handle_id, None)
+    if segments is None:
+        return False
+    _release_segments(segments)
+    return True
+
+
+def shared_stats() -> Dict[str, Any]:
+    """当前进程持有的共享内存统计"""
+    with _owned_lock:
+        total_bytes = sum(shm.size for segments in _owned_segments.values() for shm in segments)
+        return {
+            "active_handles": len(_owned_segments),
+            "total_size_mb": round(total_bytes / (1024 * 1024), 2)
+        }
+
+
+@atexit.register
+def _release_all():
+    with _owned_lock:
+        handle_ids = list(_owned_segments.keys())
+    for handle_id in handle_ids:
+        release_shared(handle_id)
+
+
+def render_embedding_plot(handle: Dict[str, Any], basis: str = "X_umap", color: Optional[str] = "leiden",
+                          output_path: Optional[str] = None) -> str:
+    """在独立进程中根据共享句柄绘制嵌入散点图，返回图片路径"""
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    if output_path is None:
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S_%f')
+        output_path = os.path.join("tmp/plots", f"{basis.lower()}_{color or 'none'}_{timestamp}.png")
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+
+    with SharedAnnDataHandle.from_dict(handle).attach() as view:
+        fig = _draw_embedding(plt, view, basis, color)
+        fig.savefig(output_path, bbox_inches='tight', dpi=150)
+        plt.close(fig)
+
+    return output_path
+
+
+def _draw_embedding(plt, view: SharedAnnDataView, basis: str, color: Optional[str]):
+    """绘制散点图；局部数组引用在返回时释放，保证共享内存可以正常关闭"""
+    coords = view.obsm[basis]
+    fig, ax = plt.subplots(figsize=(8, 6))
+
+    if color is None:
+        ax.scatter(coords[:, 0], coords[:, 1], s=1, alpha=0.7)
+    elif hasattr(view.obs[color], "cat"):
+        codes = view.obs[color].cat.codes.to_numpy()
+        categories = view.obs[color].cat.categories
+        colors = plt.cm.tab20(np.linspace(0, 1, max(len(categories), 1)))
+        for i, category in enumerate(categories):
+            mask = codes == i
+            ax.scatter(coords[mask, 0], coords[mask, 1], s=1, alpha=0.7,
+                       color=colors[i], label=str(category))
+        ax.legend(bbox_to_anchor=(1.05, 1), loc='upper left', markerscale=5)
+    else:
+        scatter = ax.scatter(coords[:, 0], coords[:, 1], c=view.obs[color].to_numpy(),
+                             s=1, alpha=0.7, cmap='viridis')
+        plt.colorbar(scatter, ax=ax)
+
+    label = basis.replace("X_", "").upper()
+    ax.set_xlabel(f"{label}_1")
+    ax.set_ylabel(f"{label}_2")
+    ax.set_title(f"{label}: {color}" if color else label)
+    return fig
+
+
+# 绘图进程池：使用spawn避免从多线程服务器进程fork。
+# spawn子进程会以 __mp_main__ 重新执行服务器的启动脚本，启动脚本不能在模块级配置日志或启动线程
+_plot_executor: Optional[ProcessPoolExecutor] = None
+_plot_executor_lock = threading.Lock()
+
+
+def get_plot_executor(max_workers: int = 2) -> ProcessPoolExecutor:
+    """获取共享的绘图进程池"""
+    global _plot_executor
+    with _plot_executor_lock:
+        if _plot_executor is None:
+            _plot_executor = ProcessPoolExecutor(
+                max_workers=max_workers,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return _plot_executor
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+RNA项目优化版本 - 启动耗时分析
+类似 python -X importtime：记录每个模块导入的自身耗时和累计耗时，
+并记录启动过程中的关键阶段（端口就绪、预热完成等）
+设置环境变量 RNA_STARTUP_PROFILE=true 启用
+"""
+
+import os
+import sys
+import time
+import threading
+from importlib.abc import MetaPathFinder
+from importlib.machinery import ExtensionFileLoader, SourceFileLoader, SourcelessFileLoader
+from typing import Any, Dict, List, Optional, Tuple
+
+
+_FILE_LOADERS = (SourceFileLoader, SourcelessFileLoader, ExtensionFileLoader)
+
+
+class _ImportTimingFinder(MetaPathFinder):
+    """不负责查找模块，只为其他查找器找到的模块包装 exec_module 计时"""
+
+    def __init__(self, profiler: "StartupProfiler"):
+        self.profiler = profiler
+        self._local = threading.local()
+
+    def find_spec(self, fullname, path, target=None):
+        if getattr(self._local, "searching", False):
+            return None
+        self._local.searching = True
+        try:
+            for finder in sys.meta_path:
+                if finder is self or not hasattr(finder, "find_spec"):
+                    continue
+                spec = finder.find_spec(fullname, path, target)
+                if spec is not None:
+                    break
+            else:
+                return None
+        finally:
+            self._local.searching = False
+
+        # 内置和冻结模块共享同一个加载器且几乎不耗时，只统计文件模块（.py / 扩展模块）
+        loader = spec.loader
+        if isinstance(loader, _FILE_LOADERS) and "exec_module" not in vars(loader):
+            loader.exec_module = self.profiler._timed(fullname, loader.exec_module)
+        return spec
+
+
+class StartupProfiler:
+    """启动耗时分析器"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        # 模块名 -> (自身耗时, 累计耗时)，单位秒
+        self.imports: Dict[str, Tuple[float, float]] = {}
+        self.phases: List[Tuple[str, float]] = []
+        self._local = threading.local()
+        self._finder: Optional[_ImportTimingFinder] = None
+
+    def install(self):
+        """开始记录之后发生的模块导入"""
+        if self._finder is None:
+            self._finder = _ImportTimingFinder(self)
+            sys.meta_path.insert(0, self._finder)
+
+    def uninstall(self):
+        if self._finder is not None and self._finder in sys.meta_path:
+            sys.meta_path.remove(self._finder)
+        self._finder = None
+
+    def _timed(self, fullname: str, exec_module):
+        def wrapper(module):
+            stack = self._local.__dict__.setdefault("stack", [])
+            # [子模块累计耗时]
+            frame = [0.0]
+            stack.append(frame)
+            start = time.perf_counter()
+            try:
+                return exec_module(module)
+            finally:
+                cumulative = time.perf_counter() - start
+                stack.pop()
+                if stack:
+                    stack[-1][0] += cumulative
+                self.imports[fullname] = (cumulative - frame[0], cumulative)
+        return wrapper
+
+    def mark(self, phase: str):
+        """记录启动阶段（距分析器创建的秒数）"""
+        self.phases.append((phase, time.perf_counter() - self.started))
+
+    def summary(self, top: int = 20) -> Dict[str, Any]:
+        """按累计耗时排序的导入统计和阶段时间线"""
+        ranked = sorted(self.imports.items(), key=lambda item: item[1][1], reverse=True)
+        return {
+            "phases": [{"phase": name, "seconds": round(t, 3)} for name, t in self.phases],
+            "modules_imported": len(self.imports),
+            "top_imports": [
+                {"module": name, "self_ms": round(own * 1000, 1), "cumulative_ms": round(cum * 1000, 1)}
+                for name, (own, cum) in ranked[:top]
+            ]
+        }
+
+    def report(self, top: int = 20) -> str:
+        """生成文本报告（格式参考 -X importtime）"""
+        summary = self.summary(top)
+        lines = ["⏱️ [启动分析] 阶段时间线:"]
+        for phase in summary["phases"]:
+            lines.append(f"  {phase['seconds']:>8.3f}s  {phase['phase']}")
+        lines.append(f"📦 [启动分析] 共导入 {summary['modules_imported']} 个模块，累计耗时最高的 {top} 个:")
+        lines.append(f"  {'self [ms]':>10} | {'cumulative':>10} | module")
+        for item in summary["top_imports"]:
+            lines.append(f"  {item['self_ms']:>10.1f} | {item['cumulative_ms']:>10.1f} | {item['module']}")
+        return "\n".join(lines)
+
+
+_profiler: Optional[StartupProfiler] = None
+
+
+def profile_startup_from_env() -> Optional[StartupProfiler]:
+    """RNA_STARTUP_PROFILE=true 时启用启动分析（需在重量级导入之前调用）"""
+    global _profiler
+    if _profiler is None and os.getenv("RNA_STARTUP_PROFILE", "false").lower() == "true":
+        _profiler = StartupProfiler()
+        _profiler.install()
+    return _profiler
+
+
+def get_startup_profiler() -> Optional[StartupProfiler]:
+    return _profiler
+
+
+def startup_mark(phase: str):
+    """记录启动阶段；未启用启动分析时不做任何处理"""
+    if _profiler is not None:
+        _profiler.mark(phase)
+
+
+def print_startup_report(top: Optional[int] = None):
+    """打印启动分析报告并停止记录导入"""
+    if _profiler is None:
+        return
+    top = top or int(os.getenv("RNA_STARTUP_PROFILE_TOP", "20"))
+    print(_profiler.report(top))
+    _profiler.uninstall()
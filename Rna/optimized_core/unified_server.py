@@ -10,37 +10,52 @@ import time
 import json
 import asyncio
 import logging
+import threading
 from pathlib import Path
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, Iterator, List, Optional, Tuple, Callable
+from contextlib import contextmanager
 from datetime import datetime
 
+# 启动耗时分析（RNA_STARTUP_PROFILE=true），需在其他导入之前启用
+from startup_profiler import profile_startup_from_env, startup_mark, print_startup_report
+profile_startup_from_env()
+
 # FastAPI和依赖
 from fastapi import FastAPI, HTTPException, Request, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse, FileResponse
+from fastapi.responses import HTMLResponse, FileResponse, PlainTextResponse
 from pydantic import BaseModel
 import uvicorn
 
 # 导入优化的核心组件
 from config import get_config, validate_config
-from cache_manager import get_cache_manager
-from execution_manager import get_execution_manager
-
-# 设置日志
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s [%(levelname)s] %(name)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(),
-        logging.FileHandler('unified_server.log', encoding='utf-8')
-    ]
+from cache_manager import get_cache_manager, InMemoryCache
+from cache_keys import fingerprint, make_key
+from execution_manager import get_execution_manager, BoundedExecutor, ExecutorSaturated
+from job_manager import JobManager, JobContext, Job
+from fork_server import ForkServer, DEFAULT_INIT_CODE
+from ws_hub import WebSocketHub, WebSocketClient
+
+# Rna目录（observability等公共模块）
+rna_dir = str(Path(__file__).resolve().parent.parent)
+if rna_dir not in sys.path:
+    sys.path.append(rna_dir)
+from log_management import setup_logging
+from observability import (
+    METRICS_CONTENT_TYPE, REGISTRY, REPL_EXECUTIONS, REPL_LATENCY,
+    observe_http_request, register_cache_metrics, render_metrics
 )
+
+startup_mark("模块导入完成")
+
 logger = logging.getLogger(__name__)
 
 class ChatRequest(BaseModel):
     message: str
     model: Optional[str] = "gpt-4o"
+    session_id: Optional[str] = None  # 结果只推送给订阅了该会话的WebSocket客户端
+    client_id: Optional[str] = None  # 发起请求的页面标识，推送时标记来源
 
 class ChatResponse(BaseModel):
     success: bool
@@ -49,6 +64,11 @@ class ChatResponse(BaseModel):
     execution_time: float = 0.0
     error: str = ""
 
+class JobRequest(BaseModel):
+    kind: str
+    params: Dict[str, Any] = {}
+    session_id: Optional[str] = None
+
 class UnifiedRNAServer:
     """统一RNA分析服务器"""
     
@@ -56,17 +76,107 @@ class UnifiedRNAServer:
         self.config = get_config()
         self.cache_manager = get_cache_manager()
         self.execution_manager = get_execution_manager()
+        # 分析代码在线程池中执行，事件循环保持响应；在途请求数受 max_concurrent_requests 限制
+        self.executor = BoundedExecutor(
+            max_workers=self.config.server.max_workers,
+            max_pending=self.config.performance.max_concurrent_requests
+        )
+        # 耗时分析作业：立即返回作业ID，进度通过 /ws 推送
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._warm_up_task: Optional[asyncio.Task] = None
+        self.job_manager = JobManager(
+            self.config.get_cache_path("jobs"),
+            max_workers=self.config.performance.job_workers,
+            on_update=self._on_job_update,
+            max_jobs=self.config.performance.max_jobs
+        )
+        self.job_manager.register("analysis_step", self._job_analysis_step)
+        self.job_manager.register("full_analysis", self._job_full_analysis)
+        self.job_manager.register("execute_code", self._job_execute_code)
         self.app = FastAPI(
             title="RNA分析统一服务器",
             description="整合前端、Agent核心和MCP后端的优化版本",
             version="2.0.0"
         )
+        self._start_time = time.time()
+        # WebSocket按会话定向推送，每个客户端独立的有界发送队列
+        self.ws_hub = WebSocketHub(
+            queue_size=self.config.server.ws_queue_size,
+            compress_threshold=self.config.server.ws_compress_threshold,
+            send_timeout=self.config.server.ws_send_timeout
+        )
         self._setup_middleware()
         self._setup_routes()
-        self._connected_clients = set()
+        # 分析步骤缓存：同一会话的检查-执行-写入需串行，避免并发请求交错修改adata；
+        # 不同会话各自加锁，可以并行执行（缓存条目按上游状态指纹在会话间共享）
+        # 会话ID -> [锁, 持有和等待该锁的请求数]
+        self._step_locks: Dict[Optional[str], list] = {}
+        self._step_locks_guard = threading.Lock()
+        self._step_cache_ttl = self.config.data.cache_ttl
+        # 快照体积较大，使用独立的非分片缓存（分片缓存的单分片预算装不下整个adata）
+        self.step_cache = InMemoryCache(max_size=self.config.cache.step_cache_size)
+        self.cache_manager.monitor.add_listener(self._on_memory_pressure)
+        self.step_cache_stats = {"hits": 0, "misses": 0, "stores": 0, "time_saved": 0.0}
+        # 不同会话的步骤在各自线程中并行执行，统计需加锁
+        self._step_stats_lock = threading.Lock()
+        self._register_metrics()
         
         logger.info("🚀 RNA分析统一服务器初始化完成")
+
+    def _register_metrics(self):
+        """把各组件的统计接入 /metrics（抓取时读取）"""
+        register_cache_metrics(lambda: {
+            "memory": self.cache_manager.memory_cache.stats(),
+            "disk": self.cache_manager.disk_cache.stats(),
+            "step": self._step_stats()
+        })
+        REGISTRY.callback("rna_active_sessions", "活跃的分析会话数",
+                          lambda: self.execution_manager.get_session_stats()["active"])
+        REGISTRY.callback("rna_queue_depth", "各队列中等待处理的数量", lambda: {
+            ("websocket",): self.ws_hub.stats()["queue_depth_total"],
+            ("executor",): self.executor.stats()["in_flight"],
+            ("jobs",): self.job_manager.stats()["active"]
+        }, ("queue",))
+        REGISTRY.callback("rna_websocket_clients", "已连接的WebSocket客户端数", lambda: len(self.ws_hub))
+        REGISTRY.callback("rna_websocket_dropped_messages", "发送队列满时丢弃的WebSocket消息数",
+                          lambda: self.ws_hub.dropped, type="counter")
+
+    def _execute_code(self, code: str, session_id: Optional[str] = None) -> Dict[str, Any]:
+        """在会话中执行代码并记录执行指标"""
+        mode = "forked" if self.execution_manager.fork_server is not None else "in_process"
+        with REPL_LATENCY.time(mode=mode):
+            result = self.execution_manager.execute_code(code, session_id)
+        REPL_EXECUTIONS.inc(mode=mode, status="ok" if result["success"] else "error")
+        return result
     
+    async def _warm_up(self):
+        """在线程中预热执行环境；预热完成前到达的代码执行请求会等待预热结束"""
+        try:
+            init_time = await asyncio.get_running_loop().run_in_executor(None, self.execution_manager.warm_up)
+            startup_mark("分析环境预热完成")
+            logger.info(f"🔥 [预热] 分析环境就绪，导入耗时 {init_time:.2f}s")
+        except Exception as e:
+            logger.error(f"❌ [预热] 分析环境初始化失败: {e}")
+        print_startup_report()
+
+    async def _run_blocking(self, fn, *args) -> Any:
+        """在有界执行器中运行同步函数：队列满返回429，超过 request_timeout 返回504"""
+        try:
+            return await self.executor.run(fn, *args, timeout=self.config.performance.request_timeout)
+        except ExecutorSaturated as e:
+            logger.warning(f"🚦 [限流] {e}")
+            raise HTTPException(
+                status_code=429,
+                detail=str(e),
+                headers={"Retry-After": str(e.retry_after)}
+            )
+        except asyncio.TimeoutError:
+            logger.error(f"⏰ [超时] 执行超过 {self.config.performance.request_timeout}s")
+            raise HTTPException(
+                status_code=504,
+                detail=f"执行超时（{self.config.performance.request_timeout}s）"
+            )
+
     def _setup_middleware(self):
         """设置中间件"""
         # CORS中间件
@@ -83,9 +193,16 @@ class UnifiedRNAServer:
         async def log_requests(request: Request, call_next):
             start_time = time.time()
             
-            logger.info(f"📥 [请求] {request.method} {request.url.path}")
+            logger.debug(f"📥 [请求] {request.method} {request.url.path}")
             
-            response = await call_next(request)
+            # 路由在 call_next 中才完成匹配，请求结束后再按匹配到的路由记录；处理中抛出的异常记为500
+            started = time.perf_counter()
+            status = 500
+            try:
+                response = await call_next(request)
+                status = response.status_code
+            finally:
+                observe_http_request(request.method, request.scope, time.perf_counter() - started, status)
             
             process_time = time.time() - start_time
             logger.info(f"📤 [响应] {response.status_code} - {process_time:.2f}s")
@@ -94,12 +211,31 @@ class UnifiedRNAServer:
     
     def _setup_routes(self):
         """设置路由"""
+
+        @self.app.on_event("startup")
+        async def on_startup():
+            # 作业在工作线程中更新状态，需要通过事件循环推送WebSocket消息
+            self._loop = asyncio.get_running_loop()
+            startup_mark("开始接受请求")
+            logger.info(f"⚡ [启动] 服务就绪，耗时 {time.time() - self._start_time:.2f}s，后台预热分析环境...")
+            # scanpy等模块在后台导入，健康检查等轻量请求不必等待
+            self._warm_up_task = asyncio.create_task(self._warm_up())
+
+        @self.app.on_event("shutdown")
+        async def stop_jobs():
+            self.job_manager.shutdown()
+            await self.ws_hub.close()
         
         @self.app.get("/")
         async def root():
             """主页"""
             return HTMLResponse(self._get_frontend_html())
         
+        @self.app.get("/metrics", response_class=PlainTextResponse)
+        async def metrics():
+            """Prometheus指标"""
+            return PlainTextResponse(render_metrics(), media_type=METRICS_CONTENT_TYPE)
+
         @self.app.get("/health")
         async def health_check():
             """健康检查"""
@@ -111,10 +247,11 @@ class UnifiedRNAServer:
                 "config_valid": validate_config(),
                 "api_keys": list(self.config.api_keys.keys()),
                 "cache_stats": self.cache_manager.get_stats(),
-                "execution_stats": self.execution_manager.get_stats()
+                "execution_stats": self.execution_manager.get_stats(),
+                "warmed_up": self.execution_manager.initialized
             }
             
-            logger.info(f"🏥 [健康检查] 返回系统状态")
+            logger.debug(f"🏥 [健康检查] 返回系统状态")
             return stats
         
         @self.app.post("/api/chat", response_model=ChatResponse)
@@ -126,21 +263,26 @@ class UnifiedRNAServer:
                 logger.info(f"💬 [聊天] 收到消息: {request.message[:100]}...")
                 
                 # 分析用户意图并执行相应操作
-                response_data = await self._process_chat_message(request.message, request.model)
+                response_data = await self._process_chat_message(request.message, request.model, request.session_id)
                 
                 execution_time = time.time() - start_time
                 response_data["execution_time"] = execution_time
                 
                 logger.info(f"✅ [聊天] 处理完成 - {execution_time:.2f}s")
                 
-                # 通过WebSocket推送更新
-                await self._broadcast_update({
-                    "type": "chat_response",
-                    "data": response_data
-                })
+                # 推送给同一会话的其他页面（未指定会话时不推送，结果只在HTTP响应中返回）
+                if request.session_id:
+                    self._publish({
+                        "type": "chat_response",
+                        "session_id": request.session_id,
+                        "origin": request.client_id,
+                        "data": response_data
+                    }, request.session_id)
                 
                 return ChatResponse(**response_data)
                 
+            except HTTPException:
+                raise
             except Exception as e:
                 execution_time = time.time() - start_time
                 error_msg = str(e)
@@ -203,10 +345,11 @@ class UnifiedRNAServer:
                 code = request.get("code", "")
                 if not code:
                     raise HTTPException(status_code=400, detail="代码不能为空")
+                session_id = request.get("session_id")
                 
                 logger.info(f"🐍 [代码执行] 执行自定义代码")
                 
-                result = self.execution_manager.execute_code(code)
+                result = await self._run_blocking(self._execute_code, code, session_id)
                 
                 return {
                     "success": result["success"],
@@ -217,69 +360,120 @@ class UnifiedRNAServer:
                     "error": result.get("error")
                 }
                 
+            except HTTPException:
+                raise
             except Exception as e:
                 logger.error(f"❌ [代码执行] 失败: {str(e)}")
                 raise HTTPException(status_code=500, detail=str(e))
         
+        @self.app.post("/api/jobs")
+        async def submit_job(request: JobRequest):
+            """提交作业，立即返回作业ID；相同的作业在执行期间只运行一次"""
+            try:
+                job, deduplicated = self.job_manager.submit(request.kind, request.params, request.session_id)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+            logger.info(f"📥 [作业] {'复用' if deduplicated else '提交'} {request.kind}: {job.job_id}")
+            return {"job_id": job.job_id, "status": job.status, "deduplicated": deduplicated}
+
+        @self.app.get("/api/jobs")
+        async def list_jobs(session_id: Optional[str] = None, limit: int = 50):
+            """列出作业（不含结果）"""
+            return {"jobs": [job.to_dict() for job in self.job_manager.list_jobs(session_id, limit)]}
+
+        @self.app.get("/api/jobs/{job_id}")
+        async def get_job(job_id: str):
+            """查询作业状态"""
+            job = self.job_manager.get(job_id)
+            if job is None:
+                raise HTTPException(status_code=404, detail="作业不存在")
+            return job.to_dict()
+
+        @self.app.get("/api/jobs/{job_id}/result")
+        async def get_job_result(job_id: str):
+            """获取作业结果；作业未结束时返回409"""
+            job = self.job_manager.get(job_id)
+            if job is None:
+                raise HTTPException(status_code=404, detail="作业不存在")
+            if job.status in ("queued", "running"):
+                raise HTTPException(status_code=409, detail=f"作业尚未完成: {job.status}")
+            return job.to_dict(include_result=True)
+
+        @self.app.post("/api/jobs/{job_id}/cancel")
+        async def cancel_job(job_id: str):
+            """取消作业"""
+            job = self.job_manager.cancel(job_id)
+            if job is None:
+                raise HTTPException(status_code=404, detail="作业不存在")
+            return job.to_dict()
+
         @self.app.get("/api/stats")
         async def get_system_stats():
             """获取系统统计信息"""
-            return {
-                "cache_stats": self.cache_manager.get_stats(),
-                "execution_stats": self.execution_manager.get_stats(),
-                "server_stats": {
-                    "connected_clients": len(self._connected_clients),
-                    "uptime": time.time() - self._start_time if hasattr(self, '_start_time') else 0
-                }
-            }
+            return self._system_stats()
         
         @self.app.websocket("/ws")
         async def websocket_endpoint(websocket: WebSocket):
-            """WebSocket连接"""
+            """WebSocket连接
+
+            连接后发送 {"type": "subscribe", "session_id": ..., "compress": true} 订阅会话，
+            也可以通过查询参数 ?session_id=...&compress=1 在连接时订阅
+            """
             await websocket.accept()
-            self._connected_clients.add(websocket)
+            client = self.ws_hub.connect(websocket)
+            session_id = websocket.query_params.get("session_id")
+            if session_id:
+                self.ws_hub.subscribe(client, session_id)
+            client.compress = websocket.query_params.get("compress") in ("1", "true")
             
-            logger.info(f"🔌 [WebSocket] 新客户端连接, 总连接: {len(self._connected_clients)}")
+            logger.info(f"🔌 [WebSocket] 新客户端连接, 总连接: {len(self.ws_hub)}")
             
             try:
                 while True:
                     data = await websocket.receive_text()
-                    message = json.loads(data)
+                    try:
+                        message = json.loads(data)
+                    except json.JSONDecodeError:
+                        self.ws_hub.send_to(client, {"type": "error", "error": "消息不是有效的JSON"})
+                        continue
                     
                     # 处理WebSocket消息
-                    await self._handle_websocket_message(websocket, message)
+                    await self._handle_websocket_message(client, message)
                     
             except WebSocketDisconnect:
-                self._connected_clients.discard(websocket)
-                logger.info(f"🔌 [WebSocket] 客户端断开连接, 剩余连接: {len(self._connected_clients)}")
+                pass
+            finally:
+                self.ws_hub.disconnect(client)
+                logger.info(f"🔌 [WebSocket] 客户端断开连接, 剩余连接: {len(self.ws_hub)}")
         
         # 静态文件服务
         plots_dir = Path("tmp/plots")
         plots_dir.mkdir(parents=True, exist_ok=True)
         self.app.mount("/plots", StaticFiles(directory=str(plots_dir)), name="plots")
     
-    async def _process_chat_message(self, message: str, model: str) -> Dict[str, Any]:
+    async def _process_chat_message(self, message: str, model: str,
+                                    session_id: Optional[str] = None) -> Dict[str, Any]:
         """处理聊天消息"""
         # 简化的意图识别
         message_lower = message.lower()
         
         # 根据关键词识别意图并执行相应操作
         if "加载" in message_lower or "load" in message_lower:
-            return await self._execute_analysis_step("load_data")
+            return await self._execute_analysis_step("load_data", session_id)
         elif "质量控制" in message_lower or "quality" in message_lower:
-            return await self._execute_analysis_step("quality_control")
+            return await self._execute_analysis_step("quality_control", session_id)
         elif "预处理" in message_lower or "preprocess" in message_lower:
-            return await self._execute_analysis_step("preprocessing")
+            return await self._execute_analysis_step("preprocessing", session_id)
         elif "降维" in message_lower or "dimension" in message_lower or "pca" in message_lower or "umap" in message_lower:
-            return await self._execute_analysis_step("dimensionality_reduction")
+            return await self._execute_analysis_step("dimensionality_reduction", session_id)
         elif "聚类" in message_lower or "cluster" in message_lower:
-            return await self._execute_analysis_step("clustering")
+            return await self._execute_analysis_step("clustering", session_id)
         elif "标记基因" in message_lower or "marker" in message_lower:
-            return await self._execute_analysis_step("marker_genes")
+            return await self._execute_analysis_step("marker_genes", session_id)
         elif "报告" in message_lower or "report" in message_lower:
-            return await self._execute_analysis_step("generate_report")
+            return await self._execute_analysis_step("generate_report", session_id)
         elif "完整分析" in message_lower or "全部" in message_lower:
-            return await self._execute_full_analysis()
+            return await self._execute_full_analysis(session_id)
         else:
             # 默认返回帮助信息
             return {
@@ -301,10 +495,9 @@ class UnifiedRNAServer:
                 "plots": []
             }
     
-    async def _execute_analysis_step(self, step_name: str) -> Dict[str, Any]:
-        """执行分析步骤"""
-        # 预定义的分析代码
-        analysis_codes = {
+    def _analysis_codes(self) -> Dict[str, str]:
+        """预定义的分析代码"""
+        return {
             "load_data": f"""
 # 加载PBMC3K数据集
 import scanpy as sc
@@ -409,32 +602,220 @@ print(f"识别出 {len(cluster_counts)} 个聚类")
 print("✅ 聚类分析完成!")
 """
         }
-        
+
+    @contextmanager
+    def _step_lock(self, session_id: Optional[str]) -> Iterator[None]:
+        """持有会话的步骤锁；最后一个等待者释放后删除该会话的条目，锁表不随历史会话数增长"""
+        with self._step_locks_guard:
+            entry = self._step_locks.get(session_id)
+            if entry is None:
+                entry = self._step_locks[session_id] = [threading.Lock(), 0]
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._step_locks_guard:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._step_locks[session_id]
+
+    def _state_fingerprint(self, session_id: Optional[str] = None) -> Optional[str]:
+        """会话执行环境中adata的内容指纹（没有adata时为None）；Fork会话在工作进程中计算"""
+        return self.execution_manager.fingerprint_variable("adata", session_id=session_id)
+
+    def _step_stats(self) -> Dict[str, Any]:
+        with self._step_stats_lock:
+            return dict(self.step_cache_stats)
+
+    def _count_step(self, hit: bool, time_saved: float = 0.0, stored: bool = False):
+        with self._step_stats_lock:
+            if stored:
+                self.step_cache_stats["stores"] += 1
+            elif hit:
+                self.step_cache_stats["hits"] += 1
+                self.step_cache_stats["time_saved"] += time_saved
+            else:
+                self.step_cache_stats["misses"] += 1
+
+    def _step_key(self, step_name: str, code: str, upstream: Optional[str]) -> str:
+        """步骤缓存键：(步骤, 参数, 上游状态指纹)；加载步骤与上游状态无关"""
+        if step_name == "load_data":
+            upstream = None
+        return make_key("analysis_step", (step_name, code, upstream), {})
+
+    def _lookup_step(self, key: str) -> Optional[Dict[str, Any]]:
+        """查找步骤缓存；图片文件已被清理的条目视为未命中"""
+        entry = self.step_cache.get(key)
+        if entry is None or not all(os.path.exists(p) for p in entry["plots"]):
+            return None
+        return entry
+
+    def _restore_step(self, key: str, entry: Dict[str, Any], session_id: Optional[str] = None) -> bool:
+        """把缓存的状态快照恢复到会话执行环境（拷贝一份，后续步骤的原地修改不影响缓存）
+
+        Fork会话的快照保存在各自的工作进程中，adata不经pickle往返；
+        快照不在当前会话可用的位置（其他Fork会话保存的，或已被淘汰）时返回False，按未命中处理
+        """
+        if self.execution_manager.is_forked(session_id):
+            return self.execution_manager.restore_snapshot("adata", key, session_id=session_id)
+        if entry["snapshot"] is None:
+            return False
+        self.execution_manager.set_variable("adata", entry["snapshot"].copy(), session_id=session_id)
+        return True
+
+    def _store_step(self, key: str, result: Dict[str, Any], session_id: Optional[str] = None):
+        """保存步骤的输出和状态快照；Fork会话的快照留在工作进程中，缓存条目只记录指纹"""
+        if self.execution_manager.is_forked(session_id):
+            snapshot = None
+            state_fingerprint = self.execution_manager.snapshot_variable("adata", key, session_id=session_id)
+            if state_fingerprint is None:
+                return
+            existing = self.step_cache.get(key)
+            if existing is not None and existing["snapshot"] is not None:
+                # 保留本进程会话保存的快照，Fork会话的快照已在其工作进程中
+                return
+        else:
+            adata = self.execution_manager.get_variable("adata", session_id=session_id)
+            if adata is None:
+                return
+            snapshot = adata.copy()
+            state_fingerprint = fingerprint(adata)
+        self.step_cache.set(key, {
+            "stdout": result["stdout"],
+            "plots": result["plots"],
+            "snapshot": snapshot,
+            "state_fingerprint": state_fingerprint,
+            "execution_time": result["execution_time"]
+        }, self._step_cache_ttl)
+        self._count_step(hit=False, stored=True)
+
+    def _run_analysis_step(self, step_name: str, session_id: Optional[str] = None) -> Dict[str, Any]:
+        """执行分析步骤：命中缓存时恢复状态快照并直接返回之前的输出和图表"""
+        analysis_codes = self._analysis_codes()
         if step_name not in analysis_codes:
             return {
                 "success": False,
                 "response": f"未知的分析步骤: {step_name}",
                 "plots": []
             }
-        
-        # 执行代码
-        result = self.execution_manager.execute_code(analysis_codes[step_name])
-        
+
+        code = analysis_codes[step_name]
+        with self._step_lock(session_id):
+            upstream = self._state_fingerprint(session_id) if step_name != "load_data" else None
+            key = self._step_key(step_name, code, upstream)
+
+            entry = self._lookup_step(key)
+            if entry is not None and self._restore_step(key, entry, session_id):
+                self._count_step(hit=True, time_saved=entry["execution_time"])
+                logger.info(f"⚡ [步骤缓存] 命中: {step_name}")
+                return {
+                    "success": True,
+                    "response": entry["stdout"],
+                    "plots": list(entry["plots"]),
+                    "cached": True
+                }
+
+            self._count_step(hit=False)
+            result = self._execute_code(code, session_id)
+
+            if result["success"]:
+                self._store_step(key, result, session_id)
+
         return {
             "success": result["success"],
             "response": result["stdout"] if result["success"] else result["error"],
             "plots": result["plots"]
         }
-    
-    async def _execute_full_analysis(self) -> Dict[str, Any]:
-        """执行完整分析流程"""
+
+    async def _execute_analysis_step(self, step_name: str, session_id: Optional[str] = None) -> Dict[str, Any]:
+        """执行分析步骤（在执行器线程中运行）"""
+        return await self._run_blocking(self._run_analysis_step, step_name, session_id)
+
+    def _fast_forward(self, steps: List[str], session_id: Optional[str] = None) -> Tuple[List[Dict[str, Any]], int]:
+        """沿缓存链跳过连续命中的步骤，只恢复最后一个命中步骤的快照
+
+        Returns:
+            (命中步骤的结果列表, 第一个未命中步骤的下标)
+        """
+        analysis_codes = self._analysis_codes()
+        chain: List[Tuple[str, Dict[str, Any]]] = []
+
+        with self._step_lock(session_id):
+            upstream = self._state_fingerprint(session_id)
+            for step in steps:
+                key = self._step_key(step, analysis_codes[step], upstream)
+                entry = self._lookup_step(key)
+                if entry is None:
+                    break
+                chain.append((key, entry))
+                upstream = entry["state_fingerprint"]
+
+            # 最后一个命中步骤的快照不可用时（Fork会话中已淘汰等）向前回退
+            while chain and not self._restore_step(*chain[-1], session_id):
+                chain.pop()
+
+        results = []
+        for _, entry in chain:
+            self._count_step(hit=True, time_saved=entry["execution_time"])
+            results.append({
+                "success": True,
+                "response": entry["stdout"],
+                "plots": list(entry["plots"]),
+                "cached": True
+            })
+        return results, len(results)
+
+    def _on_memory_pressure(self, old_level: str, new_level: str, sample: Dict[str, Any]):
+        """内存压力变化时按缓存管理器的预算比例收缩/恢复步骤缓存"""
+        monitor = self.cache_manager.monitor
+        ratio = monitor.budget / max(monitor.base_budget, 1)
+        self.step_cache.resize(int(self.config.cache.step_cache_size * ratio))
+
+    def _step_cache_summary(self) -> Dict[str, Any]:
+        """步骤缓存统计"""
+        stats = self._step_stats()
+        lookups = stats["hits"] + stats["misses"]
+        cache_stats = self.step_cache.stats()
+        return {
+            "entries": cache_stats["total_entries"],
+            "size_mb": cache_stats["current_size_mb"],
+            "hits": stats["hits"],
+            "misses": stats["misses"],
+            "stores": stats["stores"],
+            "hit_rate": round(stats["hits"] / lookups, 4) if lookups else 0.0,
+            "time_saved_seconds": round(stats["time_saved"], 2)
+        }
+
+    async def _execute_full_analysis(self, session_id: Optional[str] = None) -> Dict[str, Any]:
+        """执行完整分析流程（整个流程占用一个执行器名额）"""
+        return await self._run_blocking(self._run_full_analysis, None, session_id)
+
+    def _run_full_analysis(self, progress: Optional[Callable[[int, int, str], None]] = None,
+                           session_id: Optional[str] = None) -> Dict[str, Any]:
+        """执行完整分析流程（已缓存的前缀步骤直接复用结果）
+
+        Args:
+            progress: 每个步骤开始前调用 progress(已完成步骤数, 总步骤数, 步骤名)
+            session_id: 执行会话ID，为空时使用默认执行环境
+        """
         steps = ["load_data", "quality_control", "preprocessing", "dimensionality_reduction", "clustering"]
         all_plots = []
         all_output = []
-        
-        for step in steps:
+
+        cached_results, start_index = self._fast_forward(steps, session_id)
+        for step, result in zip(steps, cached_results):
+            all_plots.extend(result["plots"])
+            all_output.append(f"--- {step} (缓存) ---")
+            all_output.append(result["response"])
+        if start_index:
+            logger.info(f"⚡ [完整分析] 前 {start_index} 个步骤命中缓存")
+
+        for index, step in enumerate(steps[start_index:], start=start_index):
+            if progress is not None:
+                progress(index, len(steps), step)
             logger.info(f"📊 [完整分析] 执行步骤: {step}")
-            result = await self._execute_analysis_step(step)
+            result = self._run_analysis_step(step, session_id)
             
             if not result["success"]:
                 return {
@@ -453,36 +834,72 @@ print("✅ 聚类分析完成!")
             "plots": all_plots
         }
     
-    async def _handle_websocket_message(self, websocket: WebSocket, message: dict):
-        """处理WebSocket消息"""
+    def _job_analysis_step(self, context: JobContext) -> Dict[str, Any]:
+        step = context.params.get("step", "")
+        context.report(0.0, f"执行步骤: {step}")
+        return self._run_analysis_step(step, context.job.session_id)
+
+    def _job_full_analysis(self, context: JobContext) -> Dict[str, Any]:
+        return self._run_full_analysis(
+            progress=lambda done, total, step: context.report(done / total, f"执行步骤: {step}"),
+            session_id=context.job.session_id
+        )
+
+    def _job_execute_code(self, context: JobContext) -> Dict[str, Any]:
+        code = context.params.get("code", "")
+        if not code:
+            raise ValueError("代码不能为空")
+        return self._execute_code(code, context.job.session_id)
+
+    def _on_job_update(self, job: Job):
+        """作业状态变化时（在工作线程中调用）通过事件循环推送给作业所属会话"""
+        if job.session_id is None or self._loop is None or self._loop.is_closed():
+            return
+        update = {"type": "job_update", "session_id": job.session_id, "data": job.to_dict()}
+        self._loop.call_soon_threadsafe(self._publish, update, job.session_id)
+
+    def _system_stats(self) -> Dict[str, Any]:
+        """系统统计信息（/api/stats 和 WebSocket get_stats 共用）"""
+        return {
+            "cache_stats": self.cache_manager.get_stats(),
+            "execution_stats": self.execution_manager.get_stats(),
+            "step_cache_stats": self._step_cache_summary(),
+            "executor_stats": self.executor.stats(),
+            "job_stats": self.job_manager.stats(),
+            "websocket_stats": self.ws_hub.stats(),
+            "server_stats": {
+                "connected_clients": len(self.ws_hub),
+                "uptime": time.time() - self._start_time
+            }
+        }
+
+    async def _handle_websocket_message(self, client: WebSocketClient, message: dict):
+        """处理WebSocket消息（回复进入该客户端自己的发送队列）"""
         msg_type = message.get("type")
         
         if msg_type == "ping":
-            await websocket.send_text(json.dumps({"type": "pong"}))
+            self.ws_hub.send_to(client, {"type": "pong"})
         elif msg_type == "get_stats":
-            stats = await self.get_system_stats()
-            await websocket.send_text(json.dumps({
+            self.ws_hub.send_to(client, {
                 "type": "stats",
-                "data": stats
-            }))
+                "data": self._system_stats()
+            })
+        elif msg_type == "subscribe":
+            session_id = message.get("session_id")
+            if not session_id:
+                self.ws_hub.send_to(client, {"type": "error", "error": "缺少 session_id"})
+                return
+            self.ws_hub.subscribe(client, session_id)
+            if "compress" in message:
+                client.compress = bool(message["compress"])
+            self.ws_hub.send_to(client, {"type": "subscribed", "session_id": session_id})
+        elif msg_type == "unsubscribe":
+            self.ws_hub.unsubscribe(client, message.get("session_id"))
+            self.ws_hub.send_to(client, {"type": "unsubscribed", "session_id": message.get("session_id")})
     
-    async def _broadcast_update(self, update: dict):
-        """向所有连接的客户端广播更新"""
-        if not self._connected_clients:
-            return
-        
-        message = json.dumps(update)
-        disconnected = []
-        
-        for client in self._connected_clients:
-            try:
-                await client.send_text(message)
-            except:
-                disconnected.append(client)
-        
-        # 清理断开的连接
-        for client in disconnected:
-            self._connected_clients.discard(client)
+    def _publish(self, update: dict, session_id: Optional[str] = None) -> int:
+        """推送更新：指定会话时只发给该会话的订阅者（需在事件循环线程中调用）"""
+        return self.ws_hub.publish(update, session_id)
     
     def _get_frontend_html(self) -> str:
         """生成前端HTML页面"""
@@ -544,14 +961,19 @@ print("✅ 聚类分析完成!")
 
     <script>
         let ws;
+        // 会话ID在同一浏览器的页面间共享，页面ID区分推送来源
+        const sessionId = localStorage.getItem('rnaSessionId') || Math.random().toString(36).slice(2);
+        localStorage.setItem('rnaSessionId', sessionId);
+        const clientId = Math.random().toString(36).slice(2);
         
         function connectWebSocket() {
             const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
-            ws = new WebSocket(`${protocol}//${window.location.host}/ws`);
+            ws = new WebSocket(`${protocol}//${window.location.host}/ws?session_id=${sessionId}`);
             
             ws.onmessage = function(event) {
                 const data = JSON.parse(event.data);
-                if (data.type === 'chat_response') {
+                // 本页面发起的请求已通过HTTP响应显示
+                if (data.type === 'chat_response' && data.origin !== clientId) {
                     displayResponse(data.data);
                 }
             };
@@ -576,7 +998,7 @@ print("✅ 聚类分析完成!")
                 const response = await fetch('/api/chat', {
                     method: 'POST',
                     headers: {'Content-Type': 'application/json'},
-                    body: JSON.stringify({message: message})
+                    body: JSON.stringify({message: message, session_id: sessionId, client_id: clientId})
                 });
                 
                 const data = await response.json();
@@ -642,6 +1064,7 @@ print("✅ 聚类分析完成!")
                     <h4>执行统计</h4>
                     <p>总执行次数: ${stats.execution_stats.execution_stats.total_executions}</p>
                     <p>平均执行时间: ${stats.execution_stats.avg_execution_time.toFixed(2)}s</p>
+                    <p>步骤缓存命中率: ${(stats.step_cache_stats.hit_rate * 100).toFixed(1)}%</p>
                 </div>
                 <div class="stat-card">
                     <h4>系统状态</h4>
@@ -657,8 +1080,6 @@ print("✅ 聚类分析完成!")
     
     def run(self, host: str = "localhost", port: int = 8080):
         """启动服务器"""
-        self._start_time = time.time()
-        
         logger.info("🚀 启动RNA分析统一服务器...")
         logger.info(f"🌐 服务地址: http://{host}:{port}")
         logger.info(f"📚 API文档: http://{host}:{port}/docs")
@@ -672,11 +1093,40 @@ print("✅ 聚类分析完成!")
         )
 
 if __name__ == "__main__":
+    # 设置日志：后台线程写入当前运行日志目录，按 max_log_file_size 轮转。
+    # 绘图进程池（spawn）的子进程会以 __mp_main__ 重新执行本脚本，模块级不能创建日志handler和线程
+    _performance = get_config().performance
+    setup_logging(
+        "unified_server",
+        max_bytes=_performance.max_log_file_size,
+        backup_count=_performance.log_backup_count
+    )
+
     # 验证配置
     if not validate_config():
         logger.error("❌ 配置验证失败，请检查配置")
         sys.exit(1)
     
+    # 启动Fork会话服务器（必须在创建缓存清理等线程之前完成fork）
+    fork_server = None
+    if os.getenv("RNA_FORK_SERVER", "false").lower() == "true":
+        if ForkServer.is_supported():
+            config = get_config()
+            # 会话淘汰由执行管理器负责（先转存adata），Fork服务器保留一个余量
+            fork_server = ForkServer(
+                init_code=DEFAULT_INIT_CODE,
+                plots_dir=config.data.plots_dir,
+                max_sessions=config.performance.max_sessions + 1,
+                # 步骤快照保存在各会话工作进程中，避免每个步骤把adata整体pickle往返
+                snapshot_budget=config.cache.step_cache_size
+            )
+            fork_server.start()
+        else:
+            logger.warning("⚠️ [Fork服务器] 当前平台不支持fork，会话在本进程内执行")
+    
     # 启动统一服务器
     server = UnifiedRNAServer()
+    startup_mark("服务器对象创建完成")
+    if fork_server is not None:
+        server.execution_manager.attach_fork_server(fork_server)
     print("服务器创建完成") 
\ No newline at end of file
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+RNA项目优化版本 - WebSocket消息分发
+按会话订阅定向推送：每个客户端一个有界发送队列和独立的发送任务，
+慢客户端只会丢弃自己的旧消息，不会拖慢其他客户端
+"""
+
+import json
+import zlib
+import asyncio
+import logging
+from typing import Any, Dict, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+
+class _Frame:
+    """一条待发送消息：JSON只序列化一次，压缩帧按需生成一次"""
+
+    __slots__ = ("text", "_compressed")
+
+    def __init__(self, update: Dict[str, Any]):
+        self.text = json.dumps(update, ensure_ascii=False, default=str)
+        self._compressed: Optional[bytes] = None
+
+    def compressed(self) -> bytes:
+        if self._compressed is None:
+            self._compressed = zlib.compress(self.text.encode("utf-8"), 6)
+        return self._compressed
+
+
+class WebSocketClient:
+    """已连接的客户端"""
+
+    def __init__(self, websocket, queue_size: int):
+        self.websocket = websocket
+        self.queue: "asyncio.Queue[_Frame]" = asyncio.Queue(maxsize=queue_size)
+        self.sessions: Set[str] = set()
+        # 客户端声明支持后，大消息以zlib压缩的二进制帧发送
+        self.compress = False
+        self.sent = 0
+        self.dropped = 0
+        self.compressed_frames = 0
+        self.task: Optional[asyncio.Task] = None
+
+
+class WebSocketHub:
+    """WebSocket客户端管理和消息分发
+
+    - 指定 session_id 的消息只发给订阅了该会话的客户端，未指定时发给所有客户端
+    - 发送队列满时丢弃最旧的消息（进度等消息只需要最新状态）
+    - 单次发送超过 send_timeout 视为客户端失联并断开
+    """
+
+    def __init__(self, queue_size: int = 100, compress_threshold: int = 64 * 1024,
+                 send_timeout: float = 10.0):
+        self.queue_size = queue_size
+        self.compress_threshold = compress_threshold
+        self.send_timeout = send_timeout
+        self.clients: Set[WebSocketClient] = set()
+        self.published = 0
+        self.dropped = 0
+        self.disconnected_slow = 0
+
+    def __len__(self) -> int:
+        return len(self.clients)
+
+    def connect(self, websocket) -> WebSocketClient:
+        """登记已accept的连接并启动其发送任务"""
+        client = WebSocketClient(websocket, self.queue_size)
+        client.task = asyncio.create_task(self._sender(client))
+        self.clients.add(client)
+        return client
+
+    def disconnect(self, client: WebSocketClient):
+        """移除客户端并停止其发送任务"""
+        self.clients.discard(client)
+        if client.task is not None and client.task is not asyncio.current_task():
+            client.task.cancel()
+
+    def subscribe(self, client: WebSocketClient, session_id: str):
+        client.sessions.add(session_id)
+
+    def unsubscribe(self, client: WebSocketClient, session_id: Optional[str] = None):
+        """取消订阅指定会话（默认全部）"""
+        if session_id is None:
+            client.sessions.clear()
+        else:
+            client.sessions.discard(session_id)
+
+    def publish(self, update: Dict[str, Any], session_id: Optional[str] = None) -> int:
+        """把消息放入目标客户端的发送队列，立即返回入队的客户端数"""
+        targets = [c for c in self.clients if session_id is None or session_id in c.sessions]
+        if not targets:
+            return 0
+
+        frame = _Frame(update)
+        self.published += 1
+        for client in targets:
+            self._enqueue(client, frame)
+        return len(targets)
+
+    def send_to(self, client: WebSocketClient, update: Dict[str, Any]):
+        """只发给指定客户端（如对请求的直接回复）"""
+        self._enqueue(client, _Frame(update))
+
+    def _enqueue(self, client: WebSocketClient, frame: _Frame):
+        try:
+            client.queue.put_nowait(frame)
+        except asyncio.QueueFull:
+            client.queue.get_nowait()
+            client.queue.put_nowait(frame)
+            client.dropped += 1
+            self.dropped += 1
+
+    async def _sender(self, client: WebSocketClient):
+        websocket = client.websocket
+        try:
+            while True:
+                frame = await client.queue.get()
+                if client.compress and len(frame.text) >= self.compress_threshold:
+                    send = websocket.send_bytes(frame.compressed())
+                    client.compressed_frames += 1
+                else:
+                    send = websocket.send_text(frame.text)
+                await asyncio.wait_for(send, timeout=self.send_timeout)
+                client.sent += 1
+        except asyncio.CancelledError:
+            pass
+        except asyncio.TimeoutError:
+            self.disconnected_slow += 1
+            logger.warning(f"🐢 [WebSocket] 客户端发送超时（{self.send_timeout}s），断开连接")
+            self.disconnect(client)
+            try:
+                await websocket.close()
+            except Exception:
+                pass
+        except Exception as e:
+            logger.info(f"🔌 [WebSocket] 发送失败，移除客户端: {e}")
+            self.disconnect(client)
+
+    async def close(self):
+        """停止所有发送任务"""
+        for client in list(self.clients):
+            self.disconnect(client)
+
+    def stats(self) -> Dict[str, Any]:
+        """分发统计"""
+        depths = [c.queue.qsize() for c in self.clients]
+        return {
+            "clients": len(self.clients),
+            "subscriptions": sum(len(c.sessions) for c in self.clients),
+            "queue_depth_total": sum(depths),
+            "queue_depth_max": max(depths) if depths else 0,
+            "queue_size": self.queue_size,
+            "published": self.published,
+            "sent": sum(c.sent for c in self.clients),
+            "dropped": self.dropped,
+            "compressed_frames": sum(c.compressed_frames for c in self.clients),
+            "disconnected_slow": self.disconnected_slow
+        }
@@ -8,9 +8,14 @@ import threading
 import signal
 import os
 import time
+import asyncio
+import socket
 import subprocess
 import sys
+import urllib.request
+from dataclasses import dataclass, field
 from pathlib import Path
+from typing import Callable, Dict, List, Optional
 
 # 添加项目根目录到Python路径
 project_root = Path(__file__).parent.parent.absolute()
@@ -27,16 +32,19 @@ except ImportError:
     print(f"Python路径: {sys.path}")
     sys.exit(1)
 
-# 导入日志清理模块
+# 导入日志管理模块
 try:
-    from log_management import cleanup_logs_on_startup
+    from log_management import get_log_manager
 except ImportError:
-    print("⚠️ 日志管理模块未找到，跳过日志清理")
-    cleanup_logs_on_startup = None
+    print("⚠️ 日志管理模块未找到，日志写入 logs 目录且不做归档")
+    get_log_manager = None
 
 # 获取配置
 config = get_config()
 
+# 服务的stderr（崩溃信息）写入运行目录的 <服务名>.stderr.log，超过上限时转存为 .1，只保留最近两段
+SERVICE_STDERR_MAX_BYTES = 10 * 1024 * 1024
+
 
 def clean_generated_plots():
     """清理之前生成的图片文件"""
@@ -156,101 +164,278 @@ def check_data_path():
     return response.lower() == 'y'
 
 
-def start_backend_server():
-    """启动后端MCP服务器"""
-    print("\n🚀 启动后端MCP服务器...")
-
-    backend_dir = Path(__file__).parent / "3_backend_mcp"
-    server_script = backend_dir / "rna_mcp_server.py"
-
-    if not server_script.exists():
-        print(f"❌ 未找到服务器脚本: {server_script}")
-        return None
-
-    try:
-        process = subprocess.Popen([
-            sys.executable, str(server_script)
-        ], stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=str(backend_dir))
-
-        # 等待服务器启动
-        time.sleep(3)
-
-        if process.poll() is None:
-            print("✅ 后端MCP服务器已启动 (端口 8000)")
-            return process
-        else:
-            stdout, stderr = process.communicate()
-            print(f"❌ 后端服务器启动失败:")
-            print(f"STDOUT: {stdout.decode()}")
-            print(f"STDERR: {stderr.decode()}")
-            return None
-
-    except Exception as e:
-        print(f"❌ 启动后端服务器时出错: {e}")
-        return None
+@dataclass
+class ServiceSpec:
+    """被管理的服务"""
+    name: str
+    label: str
+    command: List[str]
+    cwd: Path
+    probe: Callable[[], bool]
+    depends_on: List[str] = field(default_factory=list)
 
 
-def start_frontend_app():
-    """启动前端Streamlit应用"""
-    print("\n🌐 启动前端Streamlit应用...")
+class ManagedService:
+    """服务运行状态"""
 
-    frontend_dir = Path(__file__).parent / "1_frontend"
-    app_script = frontend_dir / "rna_streamlit_app.py"
+    def __init__(self, spec: ServiceSpec, log_dir: Path):
+        self.spec = spec
+        self.stderr_path = log_dir / f"{spec.name}.stderr.log"
+        self.process: Optional[subprocess.Popen] = None
+        self.ready = threading.Event()
+        self.failed = False
+        self.restarts = 0
+        self.deps_ready_at: Optional[float] = None
+        self.launched_at: Optional[float] = None
+        self.ready_at: Optional[float] = None
 
-    if not app_script.exists():
-        print(f"❌ 未找到应用脚本: {app_script}")
-        return None
 
+def _copy_stderr(stream, path: Path, max_bytes: int):
+    """把子进程的stderr写入文件；写满 max_bytes 时转存为 <文件名>.1 后重新开始"""
+    out = open(path, "ab")
     try:
-        process = subprocess.Popen([
-            sys.executable, "-m", "streamlit", "run", str(app_script),
-            "--server.port", str(config.frontend_port),
-            "--server.address", config.host,
-            "--server.headless", "true"
-        ], cwd=str(frontend_dir))
-
-        time.sleep(2)
-
-        if process.poll() is None:
-            print("✅ 前端应用已启动 (端口 8501)")
-            return process
-        else:
-            print("❌ 前端应用启动失败")
-            return None
-
-    except Exception as e:
-        print(f"❌ 启动前端应用时出错: {e}")
-        return None
+        for line in iter(stream.readline, b""):
+            if out.tell() > 0 and out.tell() + len(line) > max_bytes:
+                out.close()
+                os.replace(path, path.with_name(path.name + ".1"))
+                out = open(path, "ab")
+            out.write(line)
+            out.flush()
+    finally:
+        out.close()
+        stream.close()
+
+
+class ServiceSupervisor:
+    """并行启动服务，按真实就绪探测结果启动依赖方，崩溃后按退避策略重启"""
+
+    def __init__(self, specs: List[ServiceSpec], log_dir: Path, startup_timeout: float = 120.0,
+                 max_restarts: int = 5, backoff_base: float = 1.0, backoff_max: float = 30.0,
+                 probe_interval: float = 0.2):
+        log_dir.mkdir(parents=True, exist_ok=True)
+        self.services: Dict[str, ManagedService] = {s.name: ManagedService(s, log_dir) for s in specs}
+        self.startup_timeout = startup_timeout
+        self.max_restarts = max_restarts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.probe_interval = probe_interval
+        self.started_at = time.time()
+        self._stop_event = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+    def start(self):
+        """为每个服务启动一个监管线程：依赖就绪后立即启动该服务"""
+        self.started_at = time.time()
+        for service in self.services.values():
+            thread = threading.Thread(target=self._supervise, args=(service,),
+                                      name=f"supervise-{service.spec.name}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _wait_for_dependencies(self, service: ManagedService) -> bool:
+        for dep_name in service.spec.depends_on:
+            dep = self.services[dep_name]
+            while not dep.ready.wait(self.probe_interval):
+                if self._stop_event.is_set() or dep.failed:
+                    return False
+        service.deps_ready_at = time.time()
+        return True
+
+    def _launch(self, service: ManagedService):
+        spec = service.spec
+        # stdout与服务自己的日志重复（各服务的日志系统已写入运行目录），直接丢弃；
+        # stderr由后台线程持续读取，写入大小受限的文件，避免管道写满后阻塞子进程
+        service.process = subprocess.Popen(spec.command, cwd=str(spec.cwd),
+                                           stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        threading.Thread(target=_copy_stderr,
+                         args=(service.process.stderr, service.stderr_path, SERVICE_STDERR_MAX_BYTES),
+                         name=f"stderr-{spec.name}", daemon=True).start()
+        service.launched_at = time.time()
+
+    def _wait_until_ready(self, service: ManagedService) -> bool:
+        deadline = time.time() + self.startup_timeout
+        while time.time() < deadline and not self._stop_event.is_set():
+            if service.process.poll() is not None:
+                return False
+            try:
+                if service.spec.probe():
+                    return True
+            except Exception:
+                pass
+            self._stop_event.wait(self.probe_interval)
+        return False
+
+    def _supervise(self, service: ManagedService):
+        spec = service.spec
+        if not self._wait_for_dependencies(service):
+            if not self._stop_event.is_set():
+                service.failed = True
+                print(f"❌ {spec.label} 的依赖服务启动失败，不再启动")
+            return
+
+        while not self._stop_event.is_set():
+            try:
+                self._launch(service)
+            except Exception as e:
+                print(f"❌ 启动{spec.label}时出错: {e}")
+                service.failed = True
+                return
+
+            if self._wait_until_ready(service):
+                service.ready_at = time.time()
+                service.ready.set()
+                print(f"✅ {spec.label} 已就绪 ({service.ready_at - service.launched_at:.2f}s)")
+                while service.process.poll() is None and not self._stop_event.is_set():
+                    self._stop_event.wait(0.5)
+            elif service.process.poll() is None and not self._stop_event.is_set():
+                print(f"⏰ {spec.label} 在 {self.startup_timeout:.0f}s 内未就绪，重新启动")
+                self._terminate(service)
+
+            if self._stop_event.is_set():
+                return
+
+            service.ready.clear()
+            service.restarts += 1
+            if service.restarts > self.max_restarts:
+                service.failed = True
+                print(f"❌ {spec.label} 已重启 {self.max_restarts} 次仍失败，放弃。错误输出: {service.stderr_path}")
+                return
+
+            delay = min(self.backoff_base * 2 ** (service.restarts - 1), self.backoff_max)
+            print(f"🔄 {spec.label} 已退出 (code={service.process.returncode})，"
+                  f"{delay:.1f}s 后第 {service.restarts} 次重启。错误输出: {service.stderr_path}")
+            self._stop_event.wait(delay)
+
+    def wait_until_ready(self, timeout: Optional[float] = None) -> bool:
+        """等待所有服务就绪；有服务放弃启动或超时返回False"""
+        deadline = time.time() + (timeout or self.startup_timeout * 2)
+        while time.time() < deadline:
+            if all(s.ready.is_set() for s in self.services.values()):
+                return True
+            if any(s.failed for s in self.services.values()):
+                return False
+            time.sleep(self.probe_interval)
+        return False
+
+    def failed_services(self) -> List[str]:
+        return [s.spec.label for s in self.services.values() if s.failed]
+
+    def print_timing(self):
+        """打印启动耗时分解"""
+        print("\n⏱️ 启动耗时分解 (相对启动器开始时间):")
+        serial_total = 0.0
+        end_to_end = 0.0
+        for service in self.services.values():
+            if service.ready_at is None or service.launched_at is None:
+                print(f"  {service.spec.label:<14} 未就绪")
+                continue
+            boot = service.ready_at - service.launched_at
+            serial_total += boot
+            end_to_end = max(end_to_end, service.ready_at - self.started_at)
+            waited = (service.deps_ready_at or self.started_at) - self.started_at
+            print(f"  {service.spec.label:<14} 等待依赖 {waited:6.2f}s | "
+                  f"启动→就绪 {boot:6.2f}s | 就绪于 {service.ready_at - self.started_at:6.2f}s")
+        print(f"  端到端冷启动: {end_to_end:.2f}s (各服务启动耗时之和 {serial_total:.2f}s)")
+
+    def _terminate(self, service: ManagedService, timeout: float = 10.0):
+        process = service.process
+        if process is None or process.poll() is not None:
+            return
+        process.terminate()
+        try:
+            process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+    def stop(self):
+        """停止所有服务（依赖方先停止）"""
+        self._stop_event.set()
+        for service in reversed(list(self.services.values())):
+            if service.process is not None and service.process.poll() is None:
+                print(f"停止{service.spec.label}...")
+                self._terminate(service)
+        for thread in self._threads:
+            thread.join(timeout=2)
+
+
+def _probe_host() -> str:
+    """监听所有接口时通过本机地址探测"""
+    return "127.0.0.1" if config.host in ("0.0.0.0", "") else config.host
+
+
+def probe_mcp_tools() -> bool:
+    """MCP就绪探测：能通过SSE获取到工具列表"""
+    url = f"http://{_probe_host()}:{config.mcp_port}/sse"
+    try:
+        from fastmcp import Client
+    except ImportError:
+        return probe_port(config.mcp_port)
 
+    async def list_tools():
+        async with Client(url) as client:
+            return await client.list_tools()
 
-def start_agent_core():
-    """启动智能体核心HTTP服务器"""
-    print("\n🤖 启动Agent Core服务...")
-    agent_dir = Path(__file__).parent / "2_agent_core"
-    server_script = agent_dir / "agent_server.py"
+    try:
+        tools = asyncio.run(asyncio.wait_for(list_tools(), timeout=5))
+    except Exception:
+        return False
+    return len(tools) > 0
 
-    if not server_script.exists():
-        print(f"❌ 未找到Agent Core脚本: {server_script}")
-        return None
 
+def probe_agent_health() -> bool:
+    """Agent Core就绪探测：/health 返回200"""
+    url = f"http://{_probe_host()}:{config.agent_port}/health"
     try:
-        # 使用 DEVNULL 避免阻塞
-        process = subprocess.Popen([
-            sys.executable, str(server_script)
-        ], stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT, cwd=str(agent_dir))
+        with urllib.request.urlopen(url, timeout=2) as response:
+            return response.status == 200
+    except Exception:
+        return False
 
-        # 等待服务器启动
-        time.sleep(3)
 
-        if process.poll() is None:
-            print("✅ Agent Core已启动 (端口 8002)")
-            return process
-        else:
-            print("❌ Agent Core启动失败")
-            return None
-    except Exception as e:
-        print(f"❌ 启动Agent Core时出错: {e}")
-        return None
+def probe_port(port: int) -> bool:
+    """端口是否已接受连接"""
+    try:
+        with socket.create_connection((_probe_host(), port), timeout=1):
+            return True
+    except OSError:
+        return False
+
+
+def build_service_specs() -> List[ServiceSpec]:
+    """MCP后端和前端同时启动；Agent Core在后台按需获取工具列表，启动不依赖MCP，
+    但等MCP就绪后再启动，保证全部就绪时即可处理请求"""
+    base_dir = Path(__file__).parent
+    return [
+        ServiceSpec(
+            name="mcp_backend",
+            label="后端MCP服务器",
+            command=[sys.executable, str(base_dir / "3_backend_mcp" / "rna_mcp_server.py")],
+            cwd=base_dir / "3_backend_mcp",
+            probe=probe_mcp_tools
+        ),
+        ServiceSpec(
+            name="agent_core",
+            label="Agent Core",
+            command=[sys.executable, str(base_dir / "2_agent_core" / "agent_server.py")],
+            cwd=base_dir / "2_agent_core",
+            probe=probe_agent_health,
+            depends_on=["mcp_backend"]
+        ),
+        ServiceSpec(
+            name="frontend",
+            label="前端应用",
+            command=[
+                sys.executable, "-m", "streamlit", "run",
+                str(base_dir / "1_frontend" / "rna_streamlit_app.py"),
+                "--server.port", str(config.frontend_port),
+                "--server.address", config.host,
+                "--server.headless", "true"
+            ],
+            cwd=base_dir / "1_frontend",
+            probe=lambda: probe_port(config.frontend_port)
+        ),
+    ]
 
 
 def signal_handler(signum, frame):
@@ -260,34 +445,18 @@ def signal_handler(signum, frame):
     sys.exit(0)
 
 
-backend_process = None
-frontend_process = None
-agent_process = None
+supervisor: Optional[ServiceSupervisor] = None
 
 
 def cleanup_processes():
     """清理进程"""
-    global backend_process, frontend_process, agent_process
-
-    if backend_process:
-        print("停止后端服务器...")
-        backend_process.terminate()
-        backend_process.wait()
-
-    if frontend_process:
-        print("停止前端应用...")
-        frontend_process.terminate()
-        frontend_process.wait()
-
-    if agent_process:
-        print("停止Agent Core...")
-        agent_process.terminate()
-        agent_process.wait()
+    if supervisor is not None:
+        supervisor.stop()
 
 
 def main():
     """主函数"""
-    global backend_process, frontend_process, agent_process
+    global supervisor
 
     # 设置信号处理
     signal.signal(signal.SIGINT, signal_handler)
@@ -295,20 +464,17 @@ def main():
 
     print_banner()
 
-    # 启动时清理日志
-    if cleanup_logs_on_startup:
-        print("\n🧹 启动前清理日志文件...")
+    # 为本次运行创建日志目录（各服务通过 RNA_RUN_ID 写入同一目录），之前的运行在后台压缩归档
+    log_manager = get_log_manager() if get_log_manager else None
+    log_dir = Path(__file__).parent / "logs"
+    if log_manager is not None:
         try:
-            current_dir = Path(__file__).parent
-            stats = cleanup_logs_on_startup(base_dir=str(
-                current_dir), action="delete", dry_run=False)
-            if stats["processed"] > 0:
-                print(
-                    f"✅ 清理了 {stats['processed']} 个日志文件，释放 {stats['total_size_freed']/1024:.1f} KB")
-            else:
-                print("✅ 无需清理，日志目录干净")
+            run_id = log_manager.start_run(launcher="run_rna_demo")
+            log_dir = log_manager.run_dir()
+            print(f"\n🗂️ 运行ID: {run_id}，日志目录: {log_dir}")
+            print(f"   保留最近 {log_manager.keep_runs} 次运行，查看: python -m log_management")
         except Exception as e:
-            print(f"⚠️ 日志清理出错: {e}")
+            print(f"⚠️ 日志目录初始化出错: {e}")
 
     # 清理历史生成的图片
     clean_generated_plots()
@@ -326,27 +492,25 @@ def main():
     if not check_data_path():
         sys.exit(1)
 
-    print("\n🎯 启动服务...")
+    print("\n🎯 并行启动服务...")
 
-    # 启动后端服务器
-    backend_process = start_backend_server()
-    if not backend_process:
-        print("❌ 无法启动后端服务器，退出")
-        sys.exit(1)
+    supervisor = ServiceSupervisor(
+        build_service_specs(),
+        log_dir=log_dir,
+        startup_timeout=float(os.getenv("RNA_STARTUP_TIMEOUT", "120")),
+        max_restarts=int(os.getenv("RNA_MAX_RESTARTS", "5"))
+    )
+    supervisor.start()
 
-    # 启动Agent Core服务器
-    agent_process = start_agent_core()
-    if not agent_process:
-        print("❌ 无法启动Agent Core服务器，正在清理...")
+    if not supervisor.wait_until_ready():
+        print(f"❌ 服务启动失败: {', '.join(supervisor.failed_services()) or '等待就绪超时'}，正在清理...")
+        supervisor.print_timing()
         cleanup_processes()
+        if log_manager is not None:
+            log_manager.finish_run("startup_failed")
         sys.exit(1)
 
-    # 启动前端应用
-    frontend_process = start_frontend_app()
-    if not frontend_process:
-        print("❌ 无法启动前端应用，正在清理...")
-        cleanup_processes()
-        sys.exit(1)
+    supervisor.print_timing()
 
     print("\n🎉 RnAgent Demo启动成功!")
     print("=" * 30)
@@ -375,17 +539,15 @@ def main():
     print("• '总结一下我们的分析结果'")
 
     try:
-        # 保持运行状态
+        # 保持运行状态；崩溃的服务由监管线程按退避策略重启
         while True:
             time.sleep(1)
 
-            # 检查进程状态
-            if backend_process.poll() is not None:
-                print("❌ 后端服务器意外停止")
-                break
-
-            if frontend_process.poll() is not None:
-                print("❌ 前端应用意外停止")
+            failed = supervisor.failed_services()
+            if failed:
+                print(f"❌ 服务无法恢复: {', '.join(failed)}")
+                if log_manager is not None:
+                    log_manager.finish_run("failed")
                 break
 
     except KeyboardInterrupt:
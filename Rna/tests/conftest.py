@@ -0,0 +1,12 @@
+"""测试公共设置：与各服务相同的导入路径（optimized_core 中的 config 优先）"""
+
+import os
+import sys
+
+RNA_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+OPTIMIZED_CORE_DIR = os.path.join(RNA_DIR, "optimized_core")
+
+if OPTIMIZED_CORE_DIR not in sys.path:
+    sys.path.insert(0, OPTIMIZED_CORE_DIR)
+if RNA_DIR not in sys.path:
+    sys.path.append(RNA_DIR)
@@ -0,0 +1,27 @@
+"""AnnData指纹：采样不到的原地修改在代码执行后（bump_generation）也能被发现"""
+
+import numpy as np
+import pytest
+
+anndata = pytest.importorskip("anndata")
+
+import cache_keys
+from cache_keys import bump_generation, fingerprint
+
+
+def _unsampled_position(shape):
+    sampled = set(cache_keys._sample_indices(shape[0] * shape[1]).tolist())
+    flat = next(i for i in range(shape[0] * shape[1]) if i not in sampled)
+    return np.unravel_index(flat, shape)
+
+
+def test_unsampled_in_place_edit_changes_fingerprint_after_execution():
+    adata = anndata.AnnData(np.zeros((300, 100), dtype=np.float32))
+    before = fingerprint(adata)
+    assert fingerprint(adata) == before
+
+    i, j = _unsampled_position(adata.shape)
+    adata.X[i, j] = 1.0  # 与执行器中运行 "adata.X[i, j] = v" 相同，对象和缓冲区都不变
+    bump_generation()
+
+    assert fingerprint(adata) != before
@@ -0,0 +1,45 @@
+"""磁盘缓存按数据类型选择编解码器：默认配置下可压缩的数组被压缩，无法压缩的数组保留内存映射"""
+
+import numpy as np
+import pytest
+
+from cache_manager import DiskCache
+from config import CacheConfig
+
+
+@pytest.fixture
+def default_disk_cache(tmp_path):
+    defaults = CacheConfig()
+    cache = DiskCache(
+        str(tmp_path / "disk"),
+        codec=defaults.disk_cache_codec,
+        compression_level=defaults.compression_level,
+        compression_min_size=defaults.compression_min_size,
+        compress_arrays=defaults.compress_arrays
+    )
+    yield cache
+    cache.close()
+
+
+def test_dense_array_is_compressed_under_default_config(default_disk_cache):
+    # 计数矩阵式的数据：大部分为0，取值范围小
+    rng = np.random.default_rng(0)
+    counts = (rng.random((2000, 500)) < 0.05).astype(np.float32) * rng.integers(1, 10, (2000, 500))
+
+    default_disk_cache.set("counts", counts)
+    stats = default_disk_cache.stats()
+    compressed = {name: s for name, s in stats["compression"].items() if name != "none" and s["entries"]}
+    assert compressed, stats["compression"]
+    (codec_stats,) = compressed.values()
+    assert codec_stats["stored_mb"] < codec_stats["raw_mb"]
+
+    np.testing.assert_array_equal(default_disk_cache.get("counts"), counts)
+
+
+def test_incompressible_array_keeps_memory_map(default_disk_cache):
+    noise = np.random.default_rng(1).random((1000, 200))
+
+    default_disk_cache.set("noise", noise)
+    restored = default_disk_cache.get("noise")
+    assert isinstance(restored, np.memmap)
+    np.testing.assert_array_equal(restored, noise)
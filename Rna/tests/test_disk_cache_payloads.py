@@ -0,0 +1,45 @@
+"""磁盘缓存按类型选择保存格式：只有精确的ndarray/稀疏矩阵走缓冲区格式，其余类型原样往返"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from cache_manager import DiskCache, _payload_format
+
+
+@pytest.fixture
+def disk_cache(tmp_path):
+    cache = DiskCache(str(tmp_path / "disk"), zero_copy_threshold=0)
+    yield cache
+    cache.close()
+
+
+def test_series_round_trip_keeps_type_and_index(disk_cache):
+    series = pd.Series(np.arange(1000, dtype=np.float64), index=[f"cell{i}" for i in range(1000)])
+    assert _payload_format(series, 0) == "pickle"
+
+    disk_cache.set("series", series)
+    restored = disk_cache.get("series")
+    assert type(restored) is pd.Series
+    pd.testing.assert_series_equal(restored, series)
+
+
+@pytest.mark.filterwarnings("ignore::PendingDeprecationWarning")
+def test_matrix_round_trip_keeps_type(disk_cache):
+    matrix = np.matrix(np.arange(1000, dtype=np.float64).reshape(100, 10))
+    assert _payload_format(matrix, 0) == "pickle"
+
+    disk_cache.set("matrix", matrix)
+    restored = disk_cache.get("matrix")
+    assert type(restored) is np.matrix
+    np.testing.assert_array_equal(restored, matrix)
+
+
+def test_plain_array_uses_memory_map(disk_cache):
+    array = np.arange(1000, dtype=np.float64)
+    assert _payload_format(array, 0) == "npy"
+
+    disk_cache.set("array", array)
+    restored = disk_cache.get("array")
+    assert isinstance(restored, np.memmap)
+    np.testing.assert_array_equal(restored, array)
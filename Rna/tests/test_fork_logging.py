@@ -0,0 +1,59 @@
+"""fork出的子进程写自己的日志文件，主日志轮转清理分段时不能删除它"""
+
+import json
+import os
+import subprocess
+import sys
+import textwrap
+
+import pytest
+
+from conftest import RNA_DIR
+
+pytestmark = pytest.mark.skipif(not hasattr(os, "fork"), reason="需要fork")
+
+SCRIPT = textwrap.dedent("""
+    import json, logging, os, sys, time
+    sys.path.insert(0, sys.argv[1])
+    from log_management import setup_logging
+    from log_management.async_logging import worker_log_file
+
+    log_file = os.path.join(sys.argv[2], "svc.log")
+    active = setup_logging("svc", log_file=log_file, max_bytes=512, backup_count=1)
+    logger = logging.getLogger("test")
+
+    pid = os.fork()
+    if pid == 0:
+        logger.info("child started")
+        # 父进程完成多次轮转后子进程继续写入
+        time.sleep(1.0)
+        logger.info("child still alive")
+        os._exit(0)
+
+    for i in range(200):
+        logger.info("parent record %d %s", i, "x" * 40)
+    time.sleep(0.2)
+    os.waitpid(pid, 0)
+    active.stop()
+    print(json.dumps({"child_log": worker_log_file(log_file, pid), "files": sorted(os.listdir(sys.argv[2]))}))
+""")
+
+
+def test_child_log_survives_parent_rollover(tmp_path):
+    log_dir = tmp_path / "run"
+    log_dir.mkdir()
+    env = dict(os.environ, LOG_ROOT=str(tmp_path / "logs"), LOG_MAX_AGE="0")
+    output = subprocess.run(
+        [sys.executable, "-c", SCRIPT, RNA_DIR, str(log_dir)],
+        env=env, capture_output=True, text=True, timeout=60, check=True
+    ).stdout
+    result = json.loads(output.strip().splitlines()[-1])
+
+    with open(result["child_log"], encoding="utf-8") as f:
+        content = f.read()
+    assert "child started" in content
+    assert "child still alive" in content
+
+    # 主日志已轮转且只保留 backup_count 个分段
+    segments = [name for name in result["files"] if name.startswith("svc.") and name != "svc.log"]
+    assert 1 <= len(segments) <= 2
@@ -0,0 +1,46 @@
+"""Fork会话服务器：模板进程退出后不能卡死或抛出未处理的异常，已有会话继续可用"""
+
+import os
+import signal
+import time
+
+import pytest
+
+from fork_server import ForkServer, SpawnError
+
+pytestmark = pytest.mark.skipif(not ForkServer.is_supported(), reason="需要fork")
+
+
+@pytest.fixture
+def server(tmp_path):
+    fork_server = ForkServer(init_code="base = [1, 2, 3]", plots_dir=str(tmp_path / "plots"))
+    fork_server.start(timeout=60)
+    yield fork_server
+    fork_server.stop()
+
+
+def test_killed_template_marks_server_stopped(server):
+    worker = server.get_or_spawn("existing")
+    assert worker.execute("total = sum(base)\nprint(total)", timeout=30)["success"]
+
+    template = server._process
+    os.kill(template.pid, signal.SIGKILL)
+    # 工作进程继承了模板的sentinel管道，join会等到超时；用is_alive（waitpid）判断退出
+    deadline = time.time() + 10
+    while template.is_alive() and time.time() < deadline:
+        time.sleep(0.05)
+
+    with pytest.raises(SpawnError):
+        server.get_or_spawn("new-session")
+    assert not server.running
+    assert server.get_stats()["spawn_stats"]["spawn_failures"] == 1
+
+    # 已有会话不依赖模板进程
+    assert server.get_or_spawn("existing") is worker
+    result = worker.execute("print(total * 2)", timeout=30)
+    assert result["success"]
+    assert result["stdout"].strip() == "12"
+
+    # 之后的请求直接失败，不再访问已关闭的连接
+    with pytest.raises(SpawnError):
+        server.get_or_spawn("another-session")
@@ -0,0 +1,54 @@
+"""作业管理器：状态回调中可以查询作业，已结束的作业按数量上限淘汰"""
+
+import threading
+import time
+
+from job_manager import JobManager, SUCCEEDED
+
+
+def _wait_finished(manager, job_id, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = manager.get(job_id)
+        if job is None or job.finished_at is not None:
+            return
+        time.sleep(0.02)
+    raise AssertionError("作业未在超时内结束")
+
+
+def test_on_update_can_query_manager(tmp_path):
+    seen = []
+    done = threading.Event()
+
+    def on_update(job):
+        # 回调在锁外调用：查询不会死锁，收到的是当时状态的快照
+        seen.append((job.status, manager.get(job.job_id) is not None))
+        if job.finished_at is not None:
+            done.set()
+
+    manager = JobManager(str(tmp_path), max_workers=1, on_update=on_update)
+    manager.register("echo", lambda ctx: ctx.params["value"])
+    job, reused = manager.submit("echo", {"value": 1})
+    assert not reused
+    assert done.wait(10)
+    manager.shutdown()
+
+    assert [status for status, _ in seen][-1] == SUCCEEDED
+    assert all(found for _, found in seen)
+
+
+def test_finished_jobs_evicted_past_cap(tmp_path):
+    manager = JobManager(str(tmp_path), max_workers=1, max_jobs=3)
+    manager.register("echo", lambda ctx: ctx.params["value"])
+    ids = []
+    for i in range(6):
+        job, _ = manager.submit("echo", {"value": i})
+        ids.append(job.job_id)
+        _wait_finished(manager, job.job_id)
+    manager.shutdown()
+
+    kept = {job.job_id for job in manager.list_jobs(limit=100)}
+    assert len(kept) <= 3
+    assert ids[-1] in kept and ids[0] not in kept
+    assert {p.stem for p in tmp_path.glob("*.json")} == kept
+    assert manager.stats()["evicted"] >= 3
@@ -0,0 +1,47 @@
+"""绘图进程池（spawn）的子进程重新执行服务器启动脚本时不能有初始化副作用"""
+
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+
+from conftest import RNA_DIR
+
+MCP_ENTRY = os.path.join(RNA_DIR, "3_backend_mcp", "rna_mcp_server.py")
+UNIFIED_ENTRY = os.path.join(RNA_DIR, "optimized_core", "unified_server.py")
+
+
+def _run_as_spawn_main(script: str):
+    """与spawn子进程的准备阶段相同：以 __mp_main__ 执行启动脚本，返回执行后的日志和线程状态"""
+    import logging
+    import runpy
+    import sys
+    import threading
+
+    sys.path.insert(0, os.path.dirname(script))
+    runpy.run_path(script, run_name="__mp_main__")
+    return {
+        "root_handlers": len(logging.getLogger().handlers),
+        "threads": sorted(t.name for t in threading.enumerate()),
+        "server_imported": "rna_mcp_app" in sys.modules,
+    }
+
+
+def _probe(script: str):
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+        return executor.submit(_run_as_spawn_main, script).result(timeout=120)
+
+
+def test_mcp_entry_has_no_side_effects_in_spawned_worker():
+    result = _probe(MCP_ENTRY)
+    assert result["root_handlers"] == 0
+    assert result["threads"] == ["MainThread"]
+    assert not result["server_imported"]
+
+
+def test_unified_server_has_no_logging_in_spawned_worker():
+    pytest.importorskip("fastapi")
+    result = _probe(UNIFIED_ENTRY)
+    assert result["root_handlers"] == 0
+    assert result["threads"] == ["MainThread"]
@@ -0,0 +1,37 @@
+"""转存记录：磁盘条目被淘汰、删除或清空后，对应的转存键同步移除"""
+
+import numpy as np
+import pytest
+
+from cache_manager import CacheEntry, CacheManager
+from config import get_config
+
+
+@pytest.fixture
+def manager(tmp_path, monkeypatch):
+    config = get_config()
+    monkeypatch.setattr(config.data, "cache_dir", str(tmp_path / "cache"))
+    # 磁盘预算只够容纳两个条目
+    monkeypatch.setattr(config.data, "max_cache_size", 2 * 80 * 1024 + 1024)
+    monkeypatch.setattr(config.cache, "enable_data_cache", True)
+    manager = CacheManager()
+    yield manager
+    manager.stop()
+    manager.disk_cache.close()
+
+
+def _spill(manager, *keys):
+    rng = np.random.default_rng(0)
+    manager._spill([(key, CacheEntry(rng.random(10 * 1024), ttl=600)) for key in keys])
+    manager._spill_executor.submit(lambda: None).result()
+
+
+def test_spilled_keys_follow_disk_evictions(manager):
+    _spill(manager, "a", "b", "c", "d")
+    assert manager._spilled_keys == {"c", "d"}
+
+    manager.disk_cache._remove("c")
+    assert manager._spilled_keys == {"d"}
+
+    manager.clear_all()
+    assert manager._spilled_keys == set()
@@ -51,12 +51,16 @@ class ConfigManager:
     def _load_config(self) -> EnvironmentConfig:
         """加载环境配置"""
         if self.current_env == "local":
-            return self._get_local_config()
+            config = self._get_local_config()
         elif self.current_env == "server":
-            return self._get_server_config()
+            config = self._get_server_config()
         else:
             raise ValueError(f"未知环境: {self.current_env}")
 
+        # PBMC3K_PATH 可指向其他10x数据目录（如 benchmarks.synthetic_data 生成的合成数据集）
+        config.data_path = os.getenv("PBMC3K_PATH", config.data_path)
+        return config
+
     def _get_local_config(self) -> EnvironmentConfig:
         """本地开发环境配置"""
         return EnvironmentConfig(